@@ -0,0 +1,188 @@
+# Packs small images, such as the frames of the animations, into a few large pages. The images
+# are then subsurfaces of the pages, so the game reads and decodes a few files instead of one
+# per image. The atlas is packed offline and saved next to the assets with an index of where
+# each image is. Run it from the game directory:
+#
+#   python atlas.py
+#   python atlas.py assets/animations/ assets/images/character/ --out assets/atlas/
+#
+# The AssetManager loads the saved atlas by itself and gives its subsurfaces for the images that
+# are loaded with per pixel alpha.
+
+import os
+import json
+import argparse
+
+import pygame
+
+
+class TextureAtlas (object):
+
+    # name of the index file in the directory of an atlas
+    index_name = "atlas.json"
+
+    def __init__(self):
+
+        # the surfaces that the images are packed in
+        self.pages = list()
+
+        # image name -> (page index, rect)
+        self.regions = dict()
+
+        # image name -> subsurface, made when the image is first asked for
+        self._images = dict()
+
+    def __contains__(self, name):
+        return name in self.regions
+
+    def __len__(self):
+        return len(self.regions)
+
+    # Get the image as a subsurface of its page. The same subsurface is given every time.
+    def get_image(self, name):
+
+        image = self._images.get(name)
+        if image is None:
+            page, rect = self.regions[name]
+            image = self.pages[page].subsurface(rect)
+            self._images[name] = image
+
+        return image
+
+    # Pack the (name, surface) images into pages no larger than the page size, with transparent
+    # pixels between the images. The pages keep per pixel alpha.
+    #
+    # The images are packed in rows. They are sorted from the tallest to the shortest, each row is
+    # as tall as its first image, and a new page is started when a row does not fit.
+    @staticmethod
+    def pack(images, page_size=1024, padding=1):
+
+        atlas = TextureAtlas()
+
+        # (name, surface, page, x, y) of the packed images and the used size of each page
+        placements = list()
+        page_sizes = list()
+
+        x = y = row_height = 0
+
+        ordered = sorted(images, key=lambda image: (image[1].get_height(), image[1].get_width()), reverse=True)
+
+        for name, surface in ordered:
+
+            width, height = surface.get_size()
+            if width + padding > page_size or height + padding > page_size:
+                print("Error. The image " + str(name) + " is larger than an atlas page.")
+                continue
+
+            if not page_sizes:
+                page_sizes.append([0, 0])
+
+            # start a new row
+            if x + width + padding > page_size:
+                x = 0
+                y += row_height
+                row_height = 0
+
+            # start a new page
+            if y + height + padding > page_size:
+                page_sizes.append([0, 0])
+                x = y = row_height = 0
+
+            page = len(page_sizes) - 1
+            placements.append((name, surface, page, x, y))
+
+            used = page_sizes[page]
+            used[0] = max(used[0], x + width)
+            used[1] = max(used[1], y + height)
+
+            x += width + padding
+            row_height = max(row_height, height + padding)
+
+        for width, height in page_sizes:
+            page = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+            page.fill((0, 0, 0, 0))
+            atlas.pages.append(page)
+
+        for name, surface, page, x, y in placements:
+            atlas.pages[page].blit(surface, (x, y))
+            atlas.regions[name] = (page, pygame.Rect((x, y), surface.get_size()))
+
+        return atlas
+
+    # Write the pages as images and the index of the regions to the directory.
+    def save(self, directory):
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        pages = list()
+        for i, page in enumerate(self.pages):
+            file_name = "atlas_" + str(i) + ".png"
+            pygame.image.save(page, os.path.join(directory, file_name))
+            pages.append(file_name)
+
+        regions = dict((name, [page, rect.x, rect.y, rect.width, rect.height])
+                       for name, (page, rect) in self.regions.items())
+
+        with open(os.path.join(directory, TextureAtlas.index_name), "w") as index:
+            json.dump({"pages": pages, "regions": regions}, index, sort_keys=True)
+
+    # Load an atlas saved in the directory, converting its pages to the display format. Returns
+    # None if there is no atlas in the directory.
+    @staticmethod
+    def load(directory):
+
+        path = os.path.join(directory, TextureAtlas.index_name)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path) as index:
+            data = json.load(index)
+
+        atlas = TextureAtlas()
+
+        for file_name in data["pages"]:
+            atlas.pages.append(pygame.image.load(os.path.join(directory, file_name)).convert_alpha())
+
+        for name, (page, x, y, width, height) in data["regions"].items():
+            atlas.regions[name] = (page, pygame.Rect(x, y, width, height))
+
+        return atlas
+
+
+# Get the (name, surface) of the images in the directories. The names are the paths the game
+# loads the images with, such as "assets/animations/Idle/1.png".
+def find_images(directories):
+
+    images = list()
+
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            for file_name in sorted(files):
+
+                if not file_name.lower().endswith(".png"):
+                    continue
+
+                path = os.path.join(root, file_name).replace(os.sep, "/")
+                images.append((path, pygame.image.load(path)))
+
+    return images
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Pack the images of the game into a texture atlas.")
+    parser.add_argument("directories", nargs="*", default=["assets/animations/", "assets/images/character/"],
+                        help="directories of the images to pack")
+    parser.add_argument("--out", default="assets/atlas/", help="directory to write the atlas to")
+    parser.add_argument("--page-size", type=int, default=1024, help="largest width and height of a page")
+    args = parser.parse_args()
+
+    atlas = TextureAtlas.pack(find_images(args.directories), args.page_size)
+    atlas.save(args.out)
+
+    print("Packed " + str(len(atlas)) + " images into " + str(len(atlas.pages)) + " pages in " + args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# Measures how long the physics system takes per step with the different ways of finding
+# collisions. Run it from the game directory:
+#
+#   python benchmark.py
+#   python benchmark.py --sizes 100 1000 --steps 10
+#
+# The worlds are made of box colliders only. A tenth of them are crates with rigid bodies
+# that fall onto the rest, which are static platforms.
+#
+# It also times the narrow phase of a circle against a box and counts the constructors that
+# are called per pair test, which should be none.
+#
+# Finally it times the render system drawing a few thousand sprites, one blit per sprite
+# against one Surface.blits call per layer and against the sprites baked onto chunks, with the
+# camera standing still and scrolling.
+
+import os
+import sys
+import random
+import time
+import argparse
+
+# run without opening a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from engine import Engine
+from world import World
+from systems import PhysicsSystem
+from systems import RenderSystem
+from broadphase import SpatialHash
+from components import RigidBody
+from components import Transform
+from util_math import Vector2
+import collision_kernel
+from collision_kernel import BoxBatch
+import collision_pool
+from collision_pool import PairPool
+from scripts import CameraFollow
+import pygame
+
+
+class BenchmarkWorld (World):
+
+    def __init__(self, colliders, seed=0):
+        super(BenchmarkWorld, self).__init__()
+        self.colliders = colliders
+        self.seed = seed
+
+    def load_scene(self):
+
+        rand = random.Random(self.seed)
+
+        # spread the colliders so that each one only overlaps a few others
+        side = int((self.colliders * 2500) ** 0.5)
+
+        crates = self.colliders // 10
+
+        for i in range(self.colliders - crates):
+            platform = self.create_box_collider_object(rand.randint(40, 200), rand.randint(20, 40))
+            platform.transform.position = Vector2(rand.uniform(0, side), rand.uniform(0, side))
+            platform.collider.surface_friction = 0.8
+
+        for i in range(crates):
+            crate = self.create_box_collider_object(40, 40)
+            crate.transform.position = Vector2(rand.uniform(0, side), rand.uniform(0, side))
+            crate.collider.restitution = 0
+            crate.collider.surface_friction = 0.8
+
+            crate.add_component(RigidBody())
+            crate.rigid_body.velocity = Vector2(rand.uniform(-100, 100), 0.0)
+            crate.rigid_body.gravity_scale = 2.0
+
+
+# A circle with a rigid body next to a box, either touching it or not
+class CircleBoxWorld (World):
+
+    def __init__(self, touching):
+        super(CircleBoxWorld, self).__init__()
+        self.touching = touching
+        self.circle = None
+        self.box = None
+
+    def load_scene(self):
+
+        self.box = self.create_box_collider_object(100, 20)
+        self.box.transform.position = Vector2(0.0, 0.0)
+
+        self.circle = self.create_circle_collider_object(20)
+        self.circle.add_component(RigidBody())
+
+        if self.touching:
+            self.circle.transform.position = Vector2(0.0, -25.0)
+        else:
+            self.circle.transform.position = Vector2(0.0, -40.0)
+
+
+# Sprites spread over a few screens in a handful of layers, seen by a camera that follows a target
+class SpriteWorld (World):
+
+    def __init__(self, sprites, seed=0):
+        super(SpriteWorld, self).__init__()
+        self.sprites = sprites
+        self.seed = seed
+        self.target = None
+
+    def load_scene(self):
+
+        rand = random.Random(self.seed)
+
+        width, height = self.engine.display.get_size()
+
+        # The same images are shared by many sprites, like the tiles of a level. Their sizes are even,
+        # so that their centers are on whole pixels with either division of Python.
+        images = list()
+        for i in range(16):
+            image = pygame.Surface((2 * rand.randint(8, 32), 2 * rand.randint(8, 32)))
+            image.fill((rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255)))
+            images.append(image)
+
+        for i in range(self.sprites):
+            sprite = self.create_renderable_object(rand.choice(images))
+            sprite.transform.position = Vector2(rand.randint(0, 3 * width), rand.randint(0, 3 * height))
+            sprite.renderer.depth = rand.randint(0, 3)
+
+        self.target = self.create_entity()
+        self.target.add_component(Transform(Vector2(1.5 * width, 1.5 * height)))
+
+        render = self.get_system(RenderSystem.tag)
+        render.camera = self.create_entity()
+        render.camera.add_component(Transform(Vector2(0, 0)))
+        render.camera.add_script(CameraFollow("camera follow", self.target.transform, width, height))
+
+
+# Time drawing the sprites. Returns the average milliseconds per frame.
+def time_render(engine, sprites, frames, batch_blits, bake, scroll):
+
+    world = SpriteWorld(sprites)
+    world.engine = engine
+    world.start_scene_loading()
+
+    default_batch_blits = RenderSystem.batch_blits
+    default_bake = RenderSystem.bake_static_layers
+
+    RenderSystem.batch_blits = batch_blits
+    RenderSystem.bake_static_layers = bake
+
+    render = world.get_system(RenderSystem.tag)
+    render.construct_scene(world.entity_manager.entities)
+
+    camera = render.camera
+    follow = camera.get_script("camera follow")
+
+    # the first frame indexes the sprites
+    follow.update()
+    render.render_scene()
+
+    start = time.time()
+    for i in range(frames):
+
+        if scroll:
+            world.target.transform.position.x += 3
+            follow.update()
+
+        render.render_scene()
+
+    ms = (time.time() - start) * 1000.0 / frames
+
+    RenderSystem.batch_blits = default_batch_blits
+    RenderSystem.bake_static_layers = default_bake
+
+    return ms
+
+
+# Count the constructors of python classes that are called while running the function
+def count_constructors(function):
+
+    calls = [0]
+
+    def profile(frame, event, arg):
+        if event == "call" and frame.f_code.co_name == "__init__":
+            calls[0] += 1
+
+    sys.setprofile(profile)
+    try:
+        function()
+    finally:
+        sys.setprofile(None)
+
+    return calls[0]
+
+
+# Time the circle against box narrow phase. Returns the average microseconds per pair test
+# and the number of constructors called per pair test.
+def time_circle_box(engine, touching, tests):
+
+    world = CircleBoxWorld(touching)
+    world.engine = engine
+    world.start_scene_loading()
+
+    physics = world.get_system(PhysicsSystem.tag)
+    circle = world.circle
+    box = world.box
+
+    position = circle.transform.position
+    x = position.x
+    y = position.y
+
+    def run(count):
+        for i in range(count):
+
+            # the collision response pushes the circle away from the box
+            position.x = x
+            position.y = y
+
+            physics._collide_pair(circle, box)
+
+    # the first test creates what is kept between tests
+    run(1)
+
+    constructors = count_constructors(lambda: run(tests))
+
+    start = time.time()
+    run(tests)
+
+    return (time.time() - start) * 1000000.0 / tests, float(constructors) / tests
+
+
+# Time a number of physics steps. Returns the average milliseconds per step.
+def time_steps(engine, colliders, broadphase_tag, collision_backend, steps):
+
+    world = BenchmarkWorld(colliders)
+    world.engine = engine
+    world.broadphase_tag = broadphase_tag
+    world.collision_backend = collision_backend
+    world.start_scene_loading()
+
+    engine.delta_time = PhysicsSystem.fixed_time_step
+
+    physics = world.get_system(PhysicsSystem.tag)
+    entities = world.entity_manager.entities
+
+    # start the worker processes before timing
+    physics.process(entities)
+
+    start = time.time()
+    for i in range(steps):
+        physics.process(entities)
+
+    ms = (time.time() - start) * 1000.0 / steps
+
+    if physics.pair_pool is not None:
+        physics.pair_pool.close()
+
+    return ms
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the collision detection of the physics system.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="number of colliders in each world")
+    parser.add_argument("--steps", type=int, default=5, help="physics steps timed per run")
+    parser.add_argument("--max-pairs", type=int, default=5000000,
+                        help="skip the brute force runs that would test more pairs per step than this")
+    parser.add_argument("--circle-tests", type=int, default=100000,
+                        help="circle against box pair tests timed per run")
+    parser.add_argument("--sprites", type=int, nargs="+", default=[1000, 4000],
+                        help="number of sprites in each render scene")
+    parser.add_argument("--frames", type=int, default=100, help="frames drawn per render run")
+    args = parser.parse_args()
+
+    engine = Engine(320, 240)
+
+    modes = [("brute force", None, None),
+             ("spatial hash", SpatialHash.tag, None)]
+
+    if collision_kernel.is_available():
+        modes.append(("brute force + numpy", None, BoxBatch.tag))
+        modes.append(("spatial hash + numpy", SpatialHash.tag, BoxBatch.tag))
+    else:
+        print("NumPy is not installed, skipping the batch backend.")
+
+    if collision_pool.is_available():
+        modes.append(("spatial hash + pool", SpatialHash.tag, PairPool.tag))
+    else:
+        print("The process pool needs Python 3.7, skipping the pool backend.")
+
+    print("%-10s %-24s %12s" % ("colliders", "mode", "ms/step"))
+
+    for size in args.sizes:
+        for name, broadphase_tag, collision_backend in modes:
+
+            # every crate is tested against every collider
+            if broadphase_tag is None and collision_backend is None and (size // 10) * size > args.max_pairs:
+                print("%-10d %-24s %12s" % (size, name, "skipped"))
+                continue
+
+            ms = time_steps(engine, size, broadphase_tag, collision_backend, args.steps)
+            print("%-10d %-24s %12.2f" % (size, name, ms))
+
+    print("")
+    print("%-24s %12s %18s" % ("circle against box", "us/pair", "constructors/pair"))
+
+    for name, touching in (("apart", False), ("touching", True)):
+        us, constructors = time_circle_box(engine, touching, args.circle_tests)
+        print("%-24s %12.3f %18.2f" % (name, us, constructors))
+
+    print("")
+    print("%-10s %-10s %16s %16s %16s" % ("sprites", "camera", "ms/frame blit", "ms/frame blits", "ms/frame baked"))
+
+    for size in args.sprites:
+        for name, scroll in (("still", False), ("scrolling", True)):
+            blit = time_render(engine, size, args.frames, False, False, scroll)
+            blits = time_render(engine, size, args.frames, True, False, scroll)
+            baked = time_render(engine, size, args.frames, True, True, scroll)
+            print("%-10d %-10s %16.2f %16.2f %16.2f" % (size, name, blit, blits, baked))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+
+from abc import ABCMeta
+from abc import abstractmethod
+from math import floor
+
+
+# Broadphase structures are used by the physics system to quickly find the colliders
+# that may be overlapping before running the (more expensive) narrow phase tests.
+# Every structure works with hashable keys (the physics system uses entity uuids) and
+# axis aligned bounding boxes given as (left, top, right, bottom) tuples.
+class Broadphase (object):
+
+    __metaclass__ = ABCMeta
+
+    tag = "broadphase"
+
+    @abstractmethod
+    def update(self, key, aabb):
+        """
+        Insert the key with its bounding box or move it if it already exists.
+        Returns True if the key was inserted or its box changed.
+        """
+
+    @abstractmethod
+    def remove(self, key):
+        """
+        Remove the key from the structure if it exists.
+        """
+
+    @abstractmethod
+    def query(self, aabb):
+        """
+        Return a list of the keys whose bounding boxes overlap the given one.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Remove every key from the structure.
+        """
+
+
+# test if two (left, top, right, bottom) boxes overlap. Touching edges count as overlapping
+# so the broadphase never rejects a pair that the narrow phase would accept.
+def aabb_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+# test if box a completely contains box b
+def aabb_contains(a, b):
+    return a[0] <= b[0] and a[1] <= b[1] and a[2] >= b[2] and a[3] >= b[3]
+
+
+# Uniform grid (spatial hash). Every key is stored in all the cells that its bounding
+# box touches. A query only visits the cells covered by the queried box, so the cost
+# depends on the local density of colliders instead of the total amount.
+class SpatialHash (Broadphase):
+
+    tag = "spatial hash"
+
+    def __init__(self, cell_size=128):
+        super(SpatialHash, self).__init__()
+
+        self.cell_size = float(cell_size)
+
+        # (column, row) -> set of keys inside that cell
+        self.cells = dict()
+
+        # key -> (aabb, cell range) of the last update
+        self.entries = dict()
+
+    # find the range of cells (min column, min row, max column, max row) covered by the box
+    def _cell_range(self, aabb):
+        s = self.cell_size
+        return int(floor(aabb[0] / s)), int(floor(aabb[1] / s)), int(floor(aabb[2] / s)), int(floor(aabb[3] / s))
+
+    def _add_to_cells(self, key, cell_range):
+        cells = self.cells
+        for column in range(cell_range[0], cell_range[2] + 1):
+            for row in range(cell_range[1], cell_range[3] + 1):
+                cell = (column, row)
+                bucket = cells.get(cell)
+
+                # create the cell the first time something goes into it
+                if bucket is None:
+                    bucket = set()
+                    cells[cell] = bucket
+
+                bucket.add(key)
+
+    def _remove_from_cells(self, key, cell_range):
+        cells = self.cells
+        for column in range(cell_range[0], cell_range[2] + 1):
+            for row in range(cell_range[1], cell_range[3] + 1):
+                cell = (column, row)
+                bucket = cells.get(cell)
+                if bucket is not None:
+                    bucket.discard(key)
+
+                    # do not keep empty cells around
+                    if not bucket:
+                        del cells[cell]
+
+    def update(self, key, aabb):
+        cell_range = self._cell_range(aabb)
+        entry = self.entries.get(key)
+
+        if entry is not None:
+
+            if entry[0] == aabb:
+                return False
+
+            # the key is still in the same cells - only the box needs to be updated
+            if entry[1] == cell_range:
+                self.entries[key] = (aabb, cell_range)
+                return True
+
+            self._remove_from_cells(key, entry[1])
+
+        self._add_to_cells(key, cell_range)
+        self.entries[key] = (aabb, cell_range)
+        return True
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._remove_from_cells(key, entry[1])
+
+    def query(self, aabb):
+        cells = self.cells
+        cell_range = self._cell_range(aabb)
+
+        # gather every key in the covered cells. Keys that span multiple cells are only added once.
+        found = set()
+        for column in range(cell_range[0], cell_range[2] + 1):
+            for row in range(cell_range[1], cell_range[3] + 1):
+                bucket = cells.get((column, row))
+                if bucket:
+                    found.update(bucket)
+
+        # only keep the keys whose boxes actually overlap
+        entries = self.entries
+        return [key for key in found if aabb_overlap(aabb, entries[key][0])]
+
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Sort and sweep along the x axis. The minimum and maximum x values of every box are kept
+# in a list of endpoints sorted between frames. Since colliders only move a few pixels per
+# frame, an endpoint is put back in order by an insertion sort that only swaps it with
+# the few endpoints that it passed.
+class SweepAndPrune (Broadphase):
+
+    tag = "sweep and prune"
+
+    class Endpoint (object):
+
+        __slots__ = ("value", "is_max", "key", "index")
+
+        def __init__(self, value, is_max, key, index):
+            self.value = value
+
+            # minimum endpoints go before maximum endpoints of the same value
+            self.is_max = is_max
+
+            self.key = key
+
+            # location of the endpoint in the sorted list
+            self.index = index
+
+    def __init__(self):
+        super(SweepAndPrune, self).__init__()
+
+        # sorted list of the endpoints of every box
+        self.endpoints = list()
+
+        # key -> [aabb, minimum endpoint, maximum endpoint]
+        self.entries = dict()
+
+        # width of the widest box. Used to find the boxes that start before a queried box.
+        self.max_extent = 0.0
+
+    # move an endpoint to the left or right until the list is sorted again (insertion sort)
+    def _sift(self, endpoint):
+
+        endpoints = self.endpoints
+        value = endpoint.value
+        is_max = endpoint.is_max
+        i = endpoint.index
+
+        # move to the left
+        while i > 0:
+            other = endpoints[i - 1]
+            if other.value < value or (other.value == value and other.is_max <= is_max):
+                break
+
+            endpoints[i] = other
+            other.index = i
+            i -= 1
+
+        # move to the right
+        last = len(endpoints) - 1
+        while i < last:
+            other = endpoints[i + 1]
+            if other.value > value or (other.value == value and other.is_max >= is_max):
+                break
+
+            endpoints[i] = other
+            other.index = i
+            i += 1
+
+        endpoints[i] = endpoint
+        endpoint.index = i
+
+    def update(self, key, aabb):
+
+        entry = self.entries.get(key)
+
+        if entry is None:
+            low = SweepAndPrune.Endpoint(aabb[0], False, key, len(self.endpoints))
+            self.endpoints.append(low)
+            high = SweepAndPrune.Endpoint(aabb[2], True, key, len(self.endpoints))
+            self.endpoints.append(high)
+
+            self._sift(low)
+            self._sift(high)
+
+            self.entries[key] = [aabb, low, high]
+
+        else:
+            if entry[0] == aabb:
+                return False
+
+            entry[0] = aabb
+            low = entry[1]
+            high = entry[2]
+
+            moved_left = aabb[0] < low.value
+            low.value = aabb[0]
+            high.value = aabb[2]
+
+            # sift the endpoint that moves away from the other one first so that the
+            # other endpoint is never in its way
+            if moved_left:
+                self._sift(low)
+                self._sift(high)
+            else:
+                self._sift(high)
+                self._sift(low)
+
+        extent = aabb[2] - aabb[0]
+        if extent > self.max_extent:
+            self.max_extent = extent
+
+        return True
+
+    def remove(self, key):
+
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        endpoints = self.endpoints
+        first = entry[1].index
+
+        del endpoints[entry[2].index]
+        del endpoints[first]
+
+        # fix the indices of the endpoints that shifted
+        for i in range(first, len(endpoints)):
+            endpoints[i].index = i
+
+        # the widest box was removed
+        if entry[0][2] - entry[0][0] >= self.max_extent:
+            self.max_extent = 0.0
+            for aabb, low, high in self.entries.values():
+                self.max_extent = max(self.max_extent, aabb[2] - aabb[0])
+
+    # index of the first endpoint whose value is not less than the given value
+    def _lower_bound(self, value):
+        endpoints = self.endpoints
+        low = 0
+        high = len(endpoints)
+        while low < high:
+            middle = (low + high) // 2
+            if endpoints[middle].value < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, aabb):
+
+        endpoints = self.endpoints
+        entries = self.entries
+        result = list()
+
+        # A box overlapping the queried box on the x axis must start somewhere between the
+        # queried box's right side and the widest possible box to the left of it.
+        right = aabb[2]
+        for i in range(self._lower_bound(aabb[0] - self.max_extent), len(endpoints)):
+            endpoint = endpoints[i]
+
+            if endpoint.value > right:
+                break
+
+            if not endpoint.is_max and aabb_overlap(aabb, entries[endpoint.key][0]):
+                result.append(endpoint.key)
+
+        return result
+
+    def clear(self):
+        del self.endpoints[:]
+        self.entries.clear()
+        self.max_extent = 0.0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Bounding volume hierarchy for colliders that (almost) never move such as floors and walls.
+# It is built once and then kept up to date lazily: moved keys only refit the boxes of their
+# ancestors and inserted/removed keys rebuild the tree, both right before the next query.
+class StaticTree (Broadphase):
+
+    tag = "static tree"
+
+    class Node (object):
+
+        __slots__ = ("aabb", "left", "right", "parent", "key")
+
+        def __init__(self, aabb, key=None):
+            self.aabb = aabb
+            self.left = None
+            self.right = None
+            self.parent = None
+            self.key = key
+
+    def __init__(self):
+        super(StaticTree, self).__init__()
+
+        self.root = None
+
+        # key -> bounding box
+        self.boxes = dict()
+
+        # key -> leaf node
+        self.leaves = dict()
+
+        # leaves whose boxes changed since the last refit
+        self._moved_leaves = list()
+
+        # amount of refits since the tree was last built
+        self._refit_count = 0
+
+        self._needs_rebuild = False
+
+    def build(self, items):
+        self.boxes = dict(items)
+        self._rebuild()
+
+    def _rebuild(self):
+        self.leaves.clear()
+        del self._moved_leaves[:]
+        self._refit_count = 0
+        self._needs_rebuild = False
+
+        items = list(self.boxes.items())
+        self.root = self._build_node(items) if items else None
+
+    # Top down construction. The items are split in half along the axis where their centers
+    # are the most spread out.
+    def _build_node(self, items):
+
+        if len(items) == 1:
+            key, aabb = items[0]
+            leaf = StaticTree.Node(aabb, key)
+            self.leaves[key] = leaf
+            return leaf
+
+        min_x = min_y = float("inf")
+        max_x = max_y = float("-inf")
+        for key, aabb in items:
+            cx = aabb[0] + aabb[2]
+            cy = aabb[1] + aabb[3]
+            min_x = min(min_x, cx)
+            max_x = max(max_x, cx)
+            min_y = min(min_y, cy)
+            max_y = max(max_y, cy)
+
+        if max_x - min_x >= max_y - min_y:
+            items.sort(key=lambda item: item[1][0] + item[1][2])
+        else:
+            items.sort(key=lambda item: item[1][1] + item[1][3])
+
+        half = len(items) // 2
+
+        node = StaticTree.Node(None)
+        node.left = self._build_node(items[:half])
+        node.right = self._build_node(items[half:])
+        node.left.parent = node
+        node.right.parent = node
+        node.aabb = _aabb_union(node.left.aabb, node.right.aabb)
+        return node
+
+    # bring the tree up to date with the changes since the last query
+    def _prepare(self):
+
+        # the tree becomes loose after many refits so rebuild it from scratch
+        if self._refit_count > len(self.leaves):
+            self._needs_rebuild = True
+
+        if self._needs_rebuild:
+            self._rebuild()
+            return
+
+        for leaf in self._moved_leaves:
+
+            # enlarge or shrink the ancestors of the leaf
+            node = leaf.parent
+            while node is not None:
+                aabb = _aabb_union(node.left.aabb, node.right.aabb)
+
+                # ancestors further up are not affected
+                if aabb == node.aabb:
+                    break
+
+                node.aabb = aabb
+                node = node.parent
+
+        self._refit_count += len(self._moved_leaves)
+        del self._moved_leaves[:]
+
+    def update(self, key, aabb):
+        old_aabb = self.boxes.get(key)
+        if old_aabb == aabb:
+            return False
+
+        self.boxes[key] = aabb
+
+        leaf = self.leaves.get(key)
+
+        # a new key requires the tree to be rebuilt
+        if leaf is None:
+            self._needs_rebuild = True
+
+        else:
+            leaf.aabb = aabb
+            self._moved_leaves.append(leaf)
+
+        return True
+
+    def remove(self, key):
+        if key in self.boxes:
+            del self.boxes[key]
+            self._needs_rebuild = True
+
+    def query(self, aabb):
+        self._prepare()
+
+        result = list()
+        if self.root is None:
+            return result
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+
+            if aabb_overlap(aabb, node.aabb):
+                if node.key is not None:
+                    result.append(node.key)
+                else:
+                    stack.append(node.left)
+                    stack.append(node.right)
+
+        return result
+
+    def clear(self):
+        self.boxes.clear()
+        self._rebuild()
+
+    def __contains__(self, key):
+        return key in self.boxes
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+# the smallest box that contains both boxes
+def _aabb_union(a, b):
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
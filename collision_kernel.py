@@ -0,0 +1,108 @@
+from components import BoxCollider
+from util_math import get_relative_rect_pos
+
+# NumPy is optional. Without it the physics system tests every pair with pygame rects.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Test if NumPy could be imported
+def is_available():
+    return numpy is not None
+
+
+# Packs the collision boxes of the entities of a world into contiguous arrays so that
+# a box can be tested against many others in a single vectorized pass instead of calling
+# Rect.colliderect one pair at a time.
+# Row i of the arrays belongs to the entity at index i of the entity list that was packed.
+class BoxBatch (object):
+
+    tag = "numpy"
+
+    def __init__(self):
+
+        # sides of the collision boxes
+        self.left = None
+        self.top = None
+        self.right = None
+        self.bottom = None
+
+        # True for the rows that hold a box collider
+        self.is_box = None
+
+        # True for the rows of entities that have an enabled collider
+        self.active = None
+
+        self.size = 0
+
+    # Fill the arrays with the collision boxes of the entities. Box colliders are placed
+    # relative to their transforms unless they are in the given static boxes (uuid -> box),
+    # which are already placed.
+    def pack(self, entities, static_boxes=None):
+
+        size = len(entities)
+
+        # only reallocate when the number of entities changes
+        if size != self.size or self.left is None:
+            self.left = numpy.zeros(size, dtype=numpy.int64)
+            self.top = numpy.zeros(size, dtype=numpy.int64)
+            self.right = numpy.zeros(size, dtype=numpy.int64)
+            self.bottom = numpy.zeros(size, dtype=numpy.int64)
+            self.is_box = numpy.zeros(size, dtype=bool)
+            self.active = numpy.zeros(size, dtype=bool)
+            self.size = size
+
+        for i in range(size):
+            self.update(i, entities[i], static_boxes)
+
+    # Copy the collision box of an entity into its row
+    def update(self, i, entity, static_boxes=None):
+
+        collider = entity.collider
+
+        if entity.disabled or collider is None:
+            self.active[i] = False
+            self.is_box[i] = False
+            return
+
+        self.active[i] = True
+
+        if collider.tag != BoxCollider.tag:
+            self.is_box[i] = False
+            return
+
+        box = collider.box
+        if static_boxes is None or static_boxes.get(entity.uuid) is not box:
+            get_relative_rect_pos(entity.transform.position, collider)
+
+        self.is_box[i] = True
+        self.left[i] = box.left
+        self.top[i] = box.top
+        self.right[i] = box.right
+        self.bottom[i] = box.bottom
+
+    # Get the rows that may be colliding with row i, sorted in increasing order.
+    # Only the given rows are tested, or the rows from start onwards if none are given.
+    # Rows that are not boxes are always returned since they need to be tested pair by pair.
+    # The sides are compared inclusively so that the exact test done afterwards never
+    # misses a collision.
+    def overlapping(self, i, rows=None, start=0):
+
+        if rows is None:
+            rows = numpy.arange(start, self.size)
+        else:
+            rows = numpy.asarray(rows, dtype=numpy.int64)
+
+        left = self.left[i]
+        top = self.top[i]
+        right = self.right[i]
+        bottom = self.bottom[i]
+
+        overlap = (self.left[rows] <= right) & (self.right[rows] >= left) & \
+                  (self.top[rows] <= bottom) & (self.bottom[rows] >= top)
+
+        mask = self.active[rows] & (overlap | ~self.is_box[rows]) & (rows != i)
+
+        return rows[mask]
@@ -0,0 +1,233 @@
+import sys
+import multiprocessing
+
+from components import BoxCollider
+from pygame import Rect
+
+# The process pool is optional. It needs concurrent.futures from Python 3.7 or later, which can
+# give the shared arrays to the worker processes when they start.
+try:
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing.sharedctypes import RawArray
+except ImportError:
+    ProcessPoolExecutor = None
+    RawArray = None
+
+
+# Test if a process pool can be created
+def is_available():
+    return ProcessPoolExecutor is not None and sys.version_info >= (3, 7)
+
+
+# Sides of a hit. These have the same values as PhysicsSystem.top, bottom, left and right.
+TOP = 0
+BOTTOM = 1
+LEFT = 2
+RIGHT = 3
+
+# a pair that has to be tested in the main process, such as a circle against a box
+UNKNOWN = -1
+
+# Layout of a row of the box array. Every collider has its box and transform position
+# before and after the physics step moves it.
+START_BOX = 0
+END_BOX = 4
+START_POSITION = 8
+END_POSITION = 10
+SIZE = 12
+IS_BOX = 14
+ROW = 15
+
+# A pair is the row of collider a, the row of collider b and whether b is tested at
+# its end position (it moved before a) or its start position.
+PAIR = 3
+
+# arrays shared with the worker processes
+_boxes = None
+_pairs = None
+
+
+def _init_worker(boxes, pairs):
+    global _boxes
+    global _pairs
+    _boxes = boxes
+    _pairs = pairs
+
+
+# Same as PhysicsSystem.calc_box_hit_orientation, from the values in the box array
+def _hit_orientation(x_a, y_a, w_a, h_a, x_b, y_b, w_b, h_b):
+
+    width = 0.5 * (w_a + w_b)
+    height = 0.5 * (h_a + h_b)
+
+    dx = x_b - x_a
+    dy = y_a - y_b
+
+    wy = width * dy
+    hx = height * dx
+
+    if wy > hx:
+        if wy > -hx:
+            return TOP
+        return LEFT
+
+    if wy > -hx:
+        return RIGHT
+    return BOTTOM
+
+
+# Run in a worker process. Get the pairs from first to last that overlap as (pair, side of the hit).
+# Collider a is always at its end position. The boxes are compared like Rect.colliderect.
+def _test_pairs(first, last):
+
+    boxes = _boxes
+    pairs = _pairs
+
+    hits = list()
+
+    for p in range(first, last):
+
+        a = pairs[p * PAIR] * ROW
+        b = pairs[p * PAIR + 1] * ROW
+        b_moved = pairs[p * PAIR + 2]
+
+        if not boxes[a + IS_BOX] or not boxes[b + IS_BOX]:
+            hits.append((p, UNKNOWN))
+            continue
+
+        left_a, top_a, right_a, bottom_a = boxes[a + END_BOX:a + END_BOX + 4]
+
+        if b_moved:
+            left_b, top_b, right_b, bottom_b = boxes[b + END_BOX:b + END_BOX + 4]
+            x_b, y_b = boxes[b + END_POSITION:b + END_POSITION + 2]
+        else:
+            left_b, top_b, right_b, bottom_b = boxes[b + START_BOX:b + START_BOX + 4]
+            x_b, y_b = boxes[b + START_POSITION:b + START_POSITION + 2]
+
+        if left_a < right_b and left_b < right_a and top_a < bottom_b and top_b < bottom_a:
+            x_a, y_a = boxes[a + END_POSITION:a + END_POSITION + 2]
+            w_a, h_a = boxes[a + SIZE:a + SIZE + 2]
+            w_b, h_b = boxes[b + SIZE:b + SIZE + 2]
+            hits.append((p, _hit_orientation(x_a, y_a, w_a, h_a, x_b, y_b, w_b, h_b)))
+
+    return hits
+
+
+# Runs the narrow phase of many collider pairs in worker processes. The colliders and the pairs
+# are written to arrays in shared memory, the workers test chunks of the pairs and the hits are
+# returned in the order of the pairs so the main process can respond to them deterministically.
+class PairPool (object):
+
+    tag = "process pool"
+
+    def __init__(self, workers=None):
+
+        # number of worker processes, defaults to the number of processors
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+
+        self.executor = None
+
+        self.boxes = None
+        self.pairs = None
+        self.box_capacity = 0
+        self.pair_capacity = 0
+
+        # used to round the end boxes the same way as the collision boxes
+        self._rect = Rect(0, 0, 0, 0)
+
+    # Make room for the given number of colliders and pairs. The workers are restarted when the
+    # arrays are replaced since they only get the arrays when they start.
+    def reserve(self, colliders, pairs):
+
+        if colliders <= self.box_capacity and pairs <= self.pair_capacity:
+            return
+
+        self.close()
+
+        self.box_capacity = max(colliders, 2 * self.box_capacity)
+        self.pair_capacity = max(pairs, 2 * self.pair_capacity)
+
+        self.boxes = RawArray("d", self.box_capacity * ROW)
+        self.pairs = RawArray("i", self.pair_capacity * PAIR)
+
+    # Write the collider of an entity to a row. The collision box is placed at the transform
+    # position, and also at the end position if it is given.
+    def set_row(self, i, entity, end_x=None, end_y=None):
+
+        boxes = self.boxes
+        r = i * ROW
+
+        collider = entity.collider
+        position = entity.transform.position
+
+        if end_x is None:
+            end_x = position.x
+            end_y = position.y
+
+        boxes[r + START_POSITION] = position.x
+        boxes[r + START_POSITION + 1] = position.y
+        boxes[r + END_POSITION] = end_x
+        boxes[r + END_POSITION + 1] = end_y
+
+        # zero sized boxes are left to the main process since colliderect never reports them
+        if collider.tag != BoxCollider.tag or collider.box.width == 0 or collider.box.height == 0:
+            boxes[r + IS_BOX] = 0
+            return
+
+        box = collider.box
+        boxes[r + IS_BOX] = 1
+        boxes[r + SIZE] = box.width
+        boxes[r + SIZE + 1] = box.height
+
+        self._set_box(r + START_BOX, collider, position.x, position.y)
+        self._set_box(r + END_BOX, collider, end_x, end_y)
+
+    # write the collision box placed at the position, rounded the same way as get_relative_rect_pos
+    def _set_box(self, i, collider, x, y):
+
+        box = collider.box
+        rect = self._rect
+        rect.size = box.size
+        rect.x = x - box.width/2 + collider.offset.x
+        rect.y = y - box.height/2 + collider.offset.y
+
+        boxes = self.boxes
+        boxes[i] = rect.left
+        boxes[i + 1] = rect.top
+        boxes[i + 2] = rect.right
+        boxes[i + 3] = rect.bottom
+
+    # write pair p
+    def set_pair(self, p, row_a, row_b, b_moved):
+        pairs = self.pairs
+        pairs[p * PAIR] = row_a
+        pairs[p * PAIR + 1] = row_b
+        pairs[p * PAIR + 2] = b_moved
+
+    # Test the first count pairs in the workers. Returns the pairs that overlap as (pair, side of the hit)
+    # sorted by pair. The side is UNKNOWN for the pairs that have to be tested in the main process.
+    def run(self, count):
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                initargs=(self.boxes, self.pairs))
+
+        # a few chunks per worker so that they finish at about the same time
+        chunk = max(1, -(-count // (self.workers * 4)))
+
+        futures = [self.executor.submit(_test_pairs, first, min(first + chunk, count))
+                   for first in range(0, count, chunk)]
+
+        hits = list()
+        for future in futures:
+            hits.extend(future.result())
+
+        return hits
+
+    # stop the worker processes
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -2,6 +2,7 @@ from pygame import Rect
 from abc import ABCMeta
 
 from util_math import Vector2
+from sprite_cache import ScaledSpriteCache
 
 from pygame import transform
 
@@ -92,20 +93,15 @@ class Renderer (Component):
         # if the renderer is affected by the camera
         self.is_static = False
 
+    # the images made by scale_image, shared by every renderer
+    scaled_images = ScaledSpriteCache()
+
     # scale the destination image surface relative to the
-    # source image.
+    # source image. The image is flipped if the scales are negative.
+    # The scaled images are cached, so the result must not be drawn on.
     @staticmethod
     def scale_image(src_image, x_scale, y_scale):
-
-        # flip the image if the scales are negative
-        invert_x = x_scale < 0
-        invert_y = y_scale < 0
-        dst_image = transform.flip(src_image, invert_x, invert_y)
-
-        # find the new dimensions of scaled image
-        new_width = src_image.get_width() * abs(x_scale)
-        new_height = src_image.get_height() * abs(y_scale)
-        return transform.scale(dst_image, (int(new_width), int(new_height)))
+        return Renderer.scaled_images.get(src_image, x_scale, y_scale)
 
     def set_image(self, image):
         self.original_image = image
@@ -123,8 +119,13 @@ class Renderer (Component):
 class RigidBody (Component):
     tag = "rigid body"
 
-    def __init__(self, velocity=Vector2(0.0, 0.0), m=1.0):
+    def __init__(self, velocity=None, m=1.0):
         super(RigidBody, self).__init__()
+
+        # every body gets its own velocity, a default vector would be shared by all of them
+        if velocity is None:
+            velocity = Vector2(0.0, 0.0)
+
         self.velocity = velocity
         self.mass = m
 
@@ -133,6 +134,34 @@ class RigidBody (Component):
 
         self.gravity_enabled = False
 
+        # Continuous bodies are swept against the static colliders so that they can't pass
+        # through thin colliders when they move fast. Only box colliders are swept.
+        self.continuous = False
+
+        # The contacts of the body are resolved by the contact solver of the world, if it has one.
+        # Other bodies keep the pairwise responses and the solver treats them like static colliders.
+        self.use_contact_solver = True
+
+        # Resting bodies are put to sleep by the physics system until something disturbs them.
+        # Sleeping bodies get no collision events, so bodies that scripts move by input, such as
+        # a player standing in a trigger, should not sleep.
+        self.can_sleep = True
+        self.sleeping = False
+
+        # number of physics steps that the body has been resting and where it started resting
+        self.sleep_counter = 0
+        self.sleep_anchor = None
+
+        # state of the body when it was put to sleep
+        self.sleep_position = None
+        self.sleep_gravity_scale = 0
+        self.sleep_contacts = None
+
+        # Positions before and after the last physics step. The render system draws the
+        # body between them since the physics runs at a fixed rate.
+        self.previous_position = None
+        self.step_position = None
+
         # self.fixed_angle = True
         # self.angular_velocity = Vector2(0, 0)
         # self.angular_drag = 0
@@ -141,9 +170,19 @@ class RigidBody (Component):
 class Collider(Component):
     tag = "collider"
 
+    # Collision layers are bit flags. Colliders are in the default layer and interact
+    # with all layers unless told otherwise.
+    default_category = 1
+    all_layers = 0xFFFFFFFF
+
     def __init__(self):
         super(Collider, self).__init__()
 
+        # The layer that this collider belongs to and the layers that it can collide with.
+        # Two colliders only collide if each one's category is in the other's mask.
+        self.category = Collider.default_category
+        self.mask = Collider.all_layers
+
         # A value of 1 means no friction
         # A value of 0 means total friction, brings it to a complete halt.
         # Higher values add energy to the object it is colliding with
@@ -182,10 +221,8 @@ class BoxCollider (Collider):
         # The tolerance hit box is used because when a collider is resolved, the original hit box , for a short time,
         # is not colliding with anything. The tolerance hit box takes care of that situation. (objects resting on floor).
 
-        ################################################################################
-        # The physics system does not use this for its calculations yet. When it is later implemented, the tolerance
-        # hit box should only register that it is overlapping.
-        ###############################################################################
+        # The physics system only uses it to find the colliders that are near each other (World.query_near),
+        # it never resolves collisions with it.
 
         self.tolerance = 10
         self.tolerance_hitbox = Rect(0, 0, width+self.tolerance, height+self.tolerance)
@@ -213,6 +250,12 @@ class CircleCollider(Collider):
         super(CircleCollider, self).__init__()
         self.radius = radius
 
+        # Square box collider used by the physics system in place of the circle when it collides
+        # with a box. It is kept with the radius and position it was last fitted to.
+        self.proxy = None
+        self.proxy_radius = radius
+        self.proxy_position = Vector2(0.0, 0.0)
+
 
 class Animator(Component):
 
@@ -349,11 +392,24 @@ class BehaviorScript(Script):
         self.script_name = script_name
         self.entity = None
 
+        # The collision events are only called for colliders in these layers
+        self.collision_mask = Collider.all_layers
+
     # The physics system calls this function when the belonging
     # entity of this script collides with another entity's collider
     def collision_event(self, other_collider):
         pass
 
+    # This is called by the Physics system during the first frame that the entity
+    # collides with the other collider
+    def collision_enter_event(self, other_collider):
+        pass
+
+    # This is called by the Physics system every frame after the first one that the entity
+    # keeps colliding with the other collider
+    def collision_stay_event(self, other_collider):
+        pass
+
     # This is called by the Physics system when the entity stops colliding with the other
     # collider
     def collision_exit_event(self, other_collider):
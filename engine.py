@@ -16,7 +16,9 @@ from pygame import font
 
 from util_math import Vector2
 from managers import IdManager
+from managers import AssetManager
 from systems import RenderSystem
+from systems import PhysicsSystem
 
 # Engine processes the current world, reads input events
 # and handles the main game loop
@@ -24,6 +26,10 @@ from systems import RenderSystem
 
 class Engine:
 
+    # The images and sounds of the game. They are shared by every engine, since the game modules
+    # load some of them before the engine that runs the game is made.
+    assets = AssetManager()
+
     # Requires screen parameters
     def __init__(self, display_w, display_h):
         pygame.init()
@@ -43,52 +49,131 @@ class Engine:
 
         # Create screen display with 32 bits per pixel, no flags set
         self.display = pygame.display.set_mode((display_w, display_h), pygame.HWSURFACE, 32)
+
+        # the images that were loaded for an earlier display are converted for this one
+        self.assets.set_display(self.display)
+
         self.delta_time = 0.0
+
+        # Longer frames are clamped to this many seconds, such as when the window is dragged.
+        self.max_delta_time = 0.05
+
         self.debug = False
         self.paused = False
 
         self.print_fps = False
 
+        # the world and the debug mode shown during the last frame, to know when the whole
+        # display has to be updated in dirty rect mode
+        self._shown_world = None
+        self._shown_debug = False
+
         self.worlds = list()
 
+        # Unload policy of the worlds. When more worlds than this are loaded, or their images take
+        # more bytes than the budget, the worlds that can be unloaded are unloaded, starting with
+        # the one the game went to the longest ago. None for no limit.
+        self.max_loaded_worlds = None
+        self.world_memory_budget = None
+
+        # counts the times the game went to a world
+        self._visits = 0
+
         self.game = None
 
+    # Go to the world. Its scene is loaded the first time.
     def set_world(self, world, append=False):
+
+        left_world = self.world
+
         world.engine = self
         self.world = world
-        self.world.resume()
 
         if append:
             self.worlds.append(world)
 
-    def run(self):
+        self._visits += 1
+        world.last_visit = self._visits
 
-        timer = pygame.time.Clock()
-        last_frame_time = 0.0
+        # the scene exists before the world resumes
+        if not world.scene_loaded:
+            self.load_world(world)
 
-        for world in self.worlds:
+        self.world.resume()
 
-            world.engine = self
+        # The world that was left may be in the middle of its update, such as when one of its
+        # scripts went to another world, so it is only unloaded once the game leaves another world.
+        self._unload_worlds(left_world)
 
-            # load the scene of the world before running
-            world.start_scene_loading()
+    # Load the scene of a world. Returns False if it failed.
+    def load_world(self, world):
 
-            render_system = world.get_system(RenderSystem.tag)
+        world.engine = self
 
-            # failed to obtain the render system
-            if render_system is None:
-                print("Error. Render system does not exist in the world.")
-                return
+        # load the assets of the world that are used during the game
+        self.assets.preload(world.asset_manifest)
 
-            # construct the scene order from the initial entities
-            render_system.construct_scene(world.entity_manager.entities)
+        world.start_scene_loading()
 
-        while True:
+        render_system = world.get_system(RenderSystem.tag)
+
+        # failed to obtain the render system
+        if render_system is None:
+            print("Error. Render system does not exist in the world.")
+            return False
+
+        # construct the scene order from the initial entities
+        render_system.construct_scene(world.entity_manager.entities)
+        return True
+
+    # Unload the worlds that can be unloaded until the loaded worlds are within the unload policy.
+    # The current world and the one that was just left are kept.
+    def _unload_worlds(self, left_world):
+
+        if self.max_loaded_worlds is None and self.world_memory_budget is None:
+            return
+
+        loaded = [w for w in self.worlds if w.scene_loaded]
+
+        unloadable = [w for w in loaded if w.can_unload and w is not self.world and w is not left_world]
+        unloadable.sort(key=lambda w: w.last_visit)
+
+        while unloadable and self._over_world_limits(loaded):
+
+            world = unloadable.pop(0)
+            world.unload_scene()
+            loaded.remove(world)
 
-            # do not run the game if delta time is too high
-            if self.delta_time >= 0.05:
-                self.delta_time = 0.0
-                continue
+            # forget the assets of the world that the other loaded worlds don't use
+            used = set()
+            for w in loaded:
+                used.update(w.asset_manifest)
+
+            for kind, path in world.asset_manifest:
+                if (kind, path) not in used:
+                    self.assets.unload(kind, path)
+
+    def _over_world_limits(self, loaded):
+
+        if self.max_loaded_worlds is not None and len(loaded) > self.max_loaded_worlds:
+            return True
+
+        if self.world_memory_budget is not None:
+            return sum(w.get_memory() for w in loaded) > self.world_memory_budget
+
+        return False
+
+    def run(self):
+
+        timer = pygame.time.Clock()
+        last_frame_time = 0.0
+
+        # the first world is loaded when it is set and the others when the game goes to them
+        if self.world is not None and not self.world.scene_loaded:
+            if not self.load_world(self.world):
+                return
+
+        while True:
 
             # Get the initial time in milliseconds of the current frame
             frame_start_time = pygame.time.get_ticks()
@@ -120,13 +205,17 @@ class Engine:
                             mixer.unpause()
                             mixer.music.unpause()
 
-                    # toggle debug mode
+                    # toggle debug mode and the physics profile overlay
                     elif event.key == pygame.K_F12:
                         self.debug = not self.debug
 
                     elif event.key == pygame.K_F11:
                         self.print_fps = not self.print_fps
 
+                    # switch the broadphase of the physics system
+                    elif event.key == pygame.K_F10:
+                        self.world.cycle_broadphase()
+
                 # pass input events to the world
                 if not self.paused:
                     self.world._take_input(event)
@@ -135,19 +224,54 @@ class Engine:
             if not self.paused:
                 self.world.run()
 
+            # show where the physics time went during the frame
+            if self.debug:
+                physics_system = self.world.get_system(PhysicsSystem.tag)
+                if physics_system is not None:
+                    physics_system.profiler.draw(self.display)
+
             # draw gui elements on top of everything
             self.gui.draw_widgets()
 
-            pygame.display.update()
+            rects = self._get_dirty_rects()
+            if rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(rects)
+
+            self._shown_world = self.world
+            self._shown_debug = self.debug
 
             # The time interval between this frame and the last one.
             # Convert the time from milliseconds to seconds
-            self.delta_time = (frame_start_time - last_frame_time)/1000.0
+            self.delta_time = min((frame_start_time - last_frame_time)/1000.0, self.max_delta_time)
             last_frame_time = frame_start_time
             timer.tick(self.fps)
 
+    # Get the regions of the display that changed during the frame when the render system of the
+    # world tracks them, or None to update the whole display.
+    def _get_dirty_rects(self):
+
+        render_system = self.world.get_system(RenderSystem.tag)
+        if render_system is None or not render_system.dirty_rect_mode:
+            return None
+
+        # the debug view draws over everything, and leaves it behind when it is turned off
+        if self.debug or self._shown_debug or self.world is not self._shown_world:
+            return None
+
+        # nothing was drawn by the world while paused
+        if self.paused:
+            return self.gui.dirty_rects
+
+        if render_system.dirty_rects is None:
+            return None
+
+        return render_system.dirty_rects + self.gui.dirty_rects
+
     @staticmethod
     def clean_up():
+        Engine.assets.close()
         font.quit()
         mixer.quit()
         pygame.quit()
@@ -173,17 +297,27 @@ class Gui:
         self.engine = engine
         self.id_manager = IdManager()
 
+        # the widgets drawn during the last frame and the regions of the screen that they changed
+        self._shown = list()
+        self.dirty_rects = list()
+
     # draw buttons, text, labels, hud elements
     def draw_widgets(self):
 
         display = self.engine.display
 
+        shown = list()
+
         for widget in self.widgets:
 
             x = widget.position.x
             y = widget.position.y
 
             display.blit(widget.image, (x, y))
+            shown.append((widget.image, (x, y)))
+
+        self.dirty_rects = RenderSystem.get_changed_rects(self._shown, shown)
+        self._shown = shown
 
     # Add widget to gui and assign a uuid.
     def add_widget(self, widget):
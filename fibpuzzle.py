@@ -3,11 +3,12 @@ from world import *
 from engine import *
 from components import BehaviorScript
 from components import WorldScript
+from utility import LAYER_CRATE
 
 engine = Engine(1200, 700)
 
 # sound effect to play once the puzzle is completed
-puzzle_finished_sfx = mixer.Sound("assets/sound/piano_low_key.wav")
+puzzle_finished_sfx = engine.assets.load_sound("assets/sound/piano_low_key.wav")
 
 
 class CheckBoxes(WorldScript):
@@ -76,15 +77,15 @@ class PlayerFibMovement(BehaviorScript):
         super(PlayerFibMovement, self).__init__("player move")
         self.h_speed = 200
         self.v_speed = 300
-        self.right = pygame.image.load("assets/images/character/character_east.png").convert_alpha()
-        self.left = pygame.image.load("assets/images/character/character_west.png").convert_alpha()
-        self.up = pygame.image.load("assets/images/character/character_north.png").convert_alpha()
-        self.down = pygame.image.load("assets/images/character/character_south.png").convert_alpha()
+        self.right = Engine.assets.load_image("assets/images/character/character_east.png", True)
+        self.left = Engine.assets.load_image("assets/images/character/character_west.png", True)
+        self.up = Engine.assets.load_image("assets/images/character/character_north.png", True)
+        self.down = Engine.assets.load_image("assets/images/character/character_south.png", True)
 
-        self.up_right = pygame.image.load("assets/images/character/character_northeast.png").convert_alpha()
-        self.up_left = pygame.image.load("assets/images/character/character_northwest.png").convert_alpha()
-        self.down_right = pygame.image.load("assets/images/character/character_southeast.png").convert_alpha()
-        self.down_left = pygame.image.load("assets/images/character/character_southwest.png").convert_alpha()
+        self.up_right = Engine.assets.load_image("assets/images/character/character_northeast.png", True)
+        self.up_left = Engine.assets.load_image("assets/images/character/character_northwest.png", True)
+        self.down_right = Engine.assets.load_image("assets/images/character/character_southeast.png", True)
+        self.down_left = Engine.assets.load_image("assets/images/character/character_southwest.png", True)
 
         self.selected_crate = None
 
@@ -198,35 +199,15 @@ class PlayerFibMovement(BehaviorScript):
         if self.selected_crate is None:
             return False
 
-        result = False
-
-        player = self.entity
-        crate = self.selected_crate
-
-        temp_player_box = player.collider.box
-        temp_crate_box = crate.collider.box
-
-        # use the tolerance hit boxes to detect collision
-        player.collider.box = player.collider.tolerance_hitbox
-        crate.collider.box = crate.collider.tolerance_hitbox
-
         # use the tolerance hit boxes to detect collision
-        if PhysicsSystem.box2box_collision(player.collider, crate.collider):
-            result = True
-
-        # # reset the collider boxes to the original ones
-        player.collider.box = temp_player_box
-        crate.collider.box = temp_crate_box
-
-        return result
+        return PhysicsSystem.tolerance_collision(self.entity.collider, self.selected_crate.collider)
 
     def check_if_near_crate(self):
         result = (False, None)
 
         # check if the player is near a box
-        for crate in self.entity.world.boxes:
-            if PhysicsSystem.tolerance_collision(self.entity.collider, crate.collider):
-                result = (True, crate)
+        for crate in self.entity.world.query_near(self.entity, layers=LAYER_CRATE):
+            result = (True, crate)
         return result
 
     def collision_event(self, other_collider):
@@ -259,22 +240,43 @@ class FibWorld(World):
         # used to signal that the puzzle has been already done
         self.puzzle_finished = False
 
+        # the room can be unloaded while the player is in the other rooms, but it stays completed
+        self.can_unload = True
+
         self.trigger_object_exit = None
 
+        # the images of the scene
+        self.asset_manifest = [(AssetManager.image, "assets/images/floors/Floor.png"),
+                               (AssetManager.alpha_image, "assets/images/floors/Lamps.png"),
+                               (AssetManager.alpha_image, "assets/images/crates/FibonacciBox_37a.png"),
+                               (AssetManager.alpha_image, "assets/images/crates/FibonacciBox_37b.png"),
+                               (AssetManager.alpha_image, "assets/images/crates/FibonacciBox_74.png"),
+                               (AssetManager.alpha_image, "assets/images/crates/FibonacciBox_111.png"),
+                               (AssetManager.alpha_image, "assets/images/crates/FibonacciBox_185.png"),
+                               (AssetManager.alpha_image, "assets/images/crates/FibonacciBox_296.png")]
+
     def resume(self):
         mixer.music.load("assets/music/game_select_bak.ogg")
         mixer.music.play(-1)
         mixer.music.set_volume(0.3)
 
+    # the boxes of the scene are kept in a list that load_scene adds to
+    def unload_scene(self):
+        super(FibWorld, self).unload_scene()
+        self.boxes = list()
+
     def load_scene(self):
 
+        # the camera never moves, so only the regions that changed are updated on the display
+        self.get_system(RenderSystem.tag).dirty_rect_mode = True
+
         self.trigger_object_exit = self.create_box_collider_object(200, 60)
         self.trigger_object_exit.collider.is_trigger = True
         self.trigger_object_exit.transform.position = Vector2(-90, 100)
         self.trigger_object_exit.name = "trigger object exit"
 
-        background_image = pygame.image.load("assets/images/floors/Floor.png").convert()
-        lamps_image  = pygame.image.load("assets/images/floors/Lamps.png").convert_alpha()
+        background_image = self.engine.assets.load_image("assets/images/floors/Floor.png")
+        lamps_image  = self.engine.assets.load_image("assets/images/floors/Lamps.png", True)
 
         # add necessary components to be able to position and render 
         # the background
@@ -289,7 +291,7 @@ class FibWorld(World):
         background_lamps.renderer.depth = -100
 
         # frames to demonstrate player animation
-        frame1 = pygame.image.load("assets/images/character/character_west.png").convert_alpha()
+        frame1 = self.engine.assets.load_image("assets/images/character/character_west.png", True)
 
         # setupt the player
         self.player = self.create_game_object(frame1)
@@ -297,6 +299,10 @@ class FibWorld(World):
         self.player.transform.position = Vector2(100, 100)
         self.player.renderer.depth = -10
         self.player.rigid_body.gravity_scale = 1
+
+        # the player is moved by input, so it is kept awake to get the events of the colliders it stands in
+        self.player.rigid_body.can_sleep = False
+
         self.player.add_script(PlayerFibMovement())
         self.player.collider.restitution = 1
         self.player.collider.box.w -= 60
@@ -306,40 +312,46 @@ class FibWorld(World):
 
         # boxes to be moved around
         # 450, 275 # 500, 275 # 475, 200 # 350, 225 # 400, 425 # 725, 350
-        box_image = pygame.image.load("assets/images/crates/FibonacciBox_37a.png").convert_alpha()
+        box_image = self.engine.assets.load_image("assets/images/crates/FibonacciBox_37a.png", True)
         pbox = self.create_game_object(box_image)
         pbox.transform.position = Vector2(526+600, 294-50)
         pbox.tag = "pbox1"
+        pbox.collider.category = LAYER_CRATE
         self.boxes.append(pbox)
 
-        box_image = pygame.image.load("assets/images/crates/FibonacciBox_37b.png").convert_alpha()
+        box_image = self.engine.assets.load_image("assets/images/crates/FibonacciBox_37b.png", True)
         pbox = self.create_game_object(box_image)
         pbox.transform.position = Vector2(489-400, 294+50)
         pbox.tag = "pbox2"
+        pbox.collider.category = LAYER_CRATE
         self.boxes.append(pbox)
 
-        box_image = pygame.image.load("assets/images/crates/FibonacciBox_74.png").convert_alpha()
+        box_image = self.engine.assets.load_image("assets/images/crates/FibonacciBox_74.png", True)
         pbox = self.create_game_object(box_image)
         pbox.transform.position = Vector2(508+450, 239-150)
         pbox.tag = "pbox3"
+        pbox.collider.category = LAYER_CRATE
         self.boxes.append(pbox)
 
-        box_image = pygame.image.load("assets/images/crates/FibonacciBox_111.png").convert_alpha()
+        box_image = self.engine.assets.load_image("assets/images/crates/FibonacciBox_111.png", True)
         pbox = self.create_game_object(box_image)
         pbox.transform.position = Vector2(415+200, 257+200)
         pbox.tag = "pbox4"
+        pbox.collider.category = LAYER_CRATE
         self.boxes.append(pbox)
 
-        box_image = pygame.image.load("assets/images/crates/FibonacciBox_185.png").convert_alpha()
+        box_image = self.engine.assets.load_image("assets/images/crates/FibonacciBox_185.png", True)
         pbox = self.create_game_object(box_image)
         pbox.transform.position = Vector2(452-100, 405+150)
         pbox.tag = "pbox5"
+        pbox.collider.category = LAYER_CRATE
         self.boxes.append(pbox)
 
-        box_image = pygame.image.load("assets/images/crates/FibonacciBox_296.png").convert_alpha()
+        box_image = self.engine.assets.load_image("assets/images/crates/FibonacciBox_296.png", True)
         pbox = self.create_game_object(box_image)
         pbox.transform.position = Vector2(692+230, 350+150)
         pbox.tag = "pbox6"
+        pbox.collider.category = LAYER_CRATE
         self.boxes.append(pbox)
 
         #screen dimensions halved 
@@ -364,10 +376,6 @@ class FibWorld(World):
 
         self.walls = [self.topWall, self.leftWall, self.rightWall, self.bottomWall]
 
-        # start the background music and set it to loop forever
-        mixer.music.play(-1)
-        mixer.music.set_volume(0.3)
-
 # f = FibWorld()
 # engine.set_world(f)
 # engine.worlds.append(f)
@@ -30,6 +30,18 @@ class Game(object):
         x = 1200/2 - title_screen.get_width()/2
         y = 700/2 - title_screen.get_height()/2
 
+        self.main_room = PlatformWorld()
+        self.maze_room = Maze()
+        self.fib_room = FibWorld()
+
+        # The game is started again by restarting and after the ending. The assets are shared by
+        # the engines, so the images loaded by the last game are kept if the new display has the
+        # same format and are not decoded again, and are loaded again otherwise.
+        #
+        # decode the assets of the worlds while the title screen is shown
+        for world in (self.main_room, self.maze_room, self.fib_room):
+            self.engine.assets.decode_in_background(world.asset_manifest)
+
         # show title screen
         exit_title_screen = False
         while not exit_title_screen:
@@ -47,10 +59,6 @@ class Game(object):
 
             pygame.display.update()
 
-        self.main_room = PlatformWorld()
-        self.maze_room = Maze()
-        self.fib_room = FibWorld()
-
         self.engine.worlds.append(self.main_room)
         self.engine.worlds.append(self.maze_room)
         self.engine.worlds.append(self.fib_room)
@@ -8,7 +8,7 @@ from state_machine import *
 
 engine = Engine(1200, 700)
 
-monster_appearance_sfx = mixer.Sound("assets/sound/piano_low_key.wav")
+monster_appearance_sfx = engine.assets.load_sound("assets/sound/piano_low_key.wav")
 
 
 class BookShelfInteraction(BehaviorScript):
@@ -38,16 +38,14 @@ class BookShelfInteraction(BehaviorScript):
                 # center on the mouse
                 self.mouse_rect.center = (x_mouse, y_mouse)
 
-                for book_shelf in self.entity.world.book_shelves:
+                # book shelves that the player clicked on
+                for book_shelf in self.entity.world.query_aabb(self.mouse_rect, "book shelf"):
 
                     # player must be touching book shelf
                     if PhysicsSystem.box2box_collision(self.entity.collider, book_shelf.collider):
+                        self.showing_hint = True
 
-                        # player clicked on book shelf
-                        if self.mouse_rect.colliderect(book_shelf.collider.box):
-                            self.showing_hint = True
-
-                            self.entity.world.engine.gui.add_widget(self.entity.world.text)
+                        self.entity.world.engine.gui.add_widget(self.entity.world.text)
 
             elif self.showing_hint:
                 self.entity.world.engine.gui.remove_widget(self.entity.world.text)
@@ -67,12 +65,11 @@ class ExitMainRoom(WorldScript):
             self.puzzles_done = self.world.engine.game.fib_room.puzzle_finished and self.world.engine.game.maze_room.puzzle
 
         # elevator hasn't been triggered yet
-        elevator_cabin = self.world.get_entity_by_tag("cabin")
+        elevator_cabin = self.world.elevator_cabin
         if self.puzzles_done and elevator_cabin.collider.is_trigger:
-            elevator_cabin = self.world.get_entity_by_tag("cabin")
 
             # on the elevator cabin
-            if PhysicsSystem.box2box_collision(self.world.player.collider, elevator_cabin.collider):
+            if self.world.query_collider(self.world.player, "cabin"):
                 monster_appearance_sfx.play()
                 elevator_cabin.collider.is_trigger = False
                 elevator_cabin.collider.treat_as_dynamic = True
@@ -143,7 +140,7 @@ class MonsterMovement(BehaviorScript):
                 player.disabled = True
 
                 # display a red cross over the player to signify that he is dead
-                img = pygame.image.load("assets/images/effects/blood_splatter.png").convert_alpha()
+                img = self.entity.world.engine.assets.load_image("assets/images/effects/blood_splatter.png", True)
                 splatter = self.entity.world.create_renderable_object(img)
                 splatter.renderer.depth = -100
                 splatter.transform.position = self.entity.transform.position
@@ -159,8 +156,10 @@ class UpdateAnimationHandler(WorldScript):
     def update(self):
         self.anim_state_machine.update()
 
-        # make the lamp source follow the player
-        self.world.lamp_source.transform.position = self.world.player.transform.position
+        # make the lamp source follow where the player is drawn
+        player = self.world.player
+        position = self.world.get_system(PhysicsSystem.tag).get_render_position(player)
+        self.world.lamp_source.transform.position = Vector2(position.x, position.y)
 
 
 class TeleportCrate(BehaviorScript):
@@ -187,7 +186,7 @@ class DeactivateSaw(BehaviorScript):
 
         if other_collider.entity.tag == "saw switch":
 
-            new_switch_image = pygame.image.load("assets/images/tiles/56x100_switchON.png").convert()
+            new_switch_image = self.entity.world.engine.assets.load_image("assets/images/tiles/56x100_switchON.png")
 
             other_collider.entity.renderer.set_image(new_switch_image)
 
@@ -242,33 +241,30 @@ class HandleLightLife(BehaviorScript):
             if event.key == pygame.K_q:
 
                 # make sure we are colliding with a light source
-                for lamp_light in self.entity.world.lamp_lights:
-
-                    # player is in range of a lamp light
-                    if PhysicsSystem.box2box_collision(self.entity.collider, lamp_light.collider):
+                for lamp_light in self.entity.world.query_collider(self.entity, "lamp light", LAYER_LIGHT):
 
-                        # reset lamp life and monster appearance timer
-                        self.lamp_life = self.max_lamp_life
-                        self.monster_appearance_timer = self.max_time_monster
+                    # reset lamp life and monster appearance timer
+                    self.lamp_life = self.max_lamp_life
+                    self.monster_appearance_timer = self.max_time_monster
 
-                        # disable monster
-                        if self.monster_spawned:
-                            self.entity.world.disable_monster()
+                    # disable monster
+                    if self.monster_spawned:
+                        self.entity.world.disable_monster()
 
-                        # set lamp source back to max capacity
-                        self.entity.world.lamp_source.transform.scale_by(1, 1)
+                    # set lamp source back to max capacity
+                    self.entity.world.lamp_source.transform.scale_by(1, 1)
 
-                        # destroy the lamp light that you obtained fuel from
-                        self.entity.world.destroy_entity(lamp_light)
+                    # destroy the lamp light that you obtained fuel from
+                    self.entity.world.destroy_entity(lamp_light)
 
-                        # remove from lamp lights list
-                        self.entity.world.lamp_lights.remove(lamp_light)
+                    # remove from lamp lights list
+                    self.entity.world.lamp_lights.remove(lamp_light)
 
-                        # remove it from the renderer
-                        self.entity.world.get_system(RenderSystem.tag).light_sources.remove(lamp_light)
+                    # remove it from the renderer
+                    self.entity.world.get_system(RenderSystem.tag).light_sources.remove(lamp_light)
 
-                        self.monster_spawned = False
-                        return
+                    self.monster_spawned = False
+                    return
 
 
 class GoToOtherLevel(BehaviorScript):
@@ -304,6 +300,7 @@ class PlatformWorld(World):
         self.player_anim_handler = None
 
         self.ladders = list()
+        self.elevator_cabin = None
         self.lamp_source = None
         self.crates = list()
 
@@ -320,6 +317,51 @@ class PlatformWorld(World):
 
         self.text = None
 
+        # the images of the scene and the ones shown by the scripts during the game
+        images = ["assets/images/gui/hint.png",
+                  "assets/images/tiles/56x100_switchOFF.png",
+                  "assets/images/tiles/56x100_switchON.png",
+                  "assets/images/environment/bookcase.png",
+                  "assets/images/backgrounds/eye_duck.png",
+                  "assets/images/backgrounds/horse.png",
+                  "assets/images/backgrounds/all_toys.png",
+                  "assets/images/backgrounds/no_toys.png",
+                  "assets/images/environment/elevator/extended_elevator.png"]
+
+        alpha_images = ["assets/images/lights/lamp_light_xsmall_mask.png",
+                        "assets/images/lights/lamp_light_mask.png",
+                        "assets/images/lights/lamp_light_small_mask.png",
+                        "assets/images/environment/lamp.png",
+                        "assets/images/environment/hazards/saw.png",
+                        "assets/images/ladders/ladder_body.png",
+                        "assets/images/ladders/ladder_top.png",
+                        "assets/images/platforms/30x200.png",
+                        "assets/images/platforms/30x400.png",
+                        "assets/images/platforms/50x250.png",
+                        "assets/images/platforms/120x400.png",
+                        "assets/images/platforms/150x800.png",
+                        "assets/images/platforms/50x300.png",
+                        "assets/images/platforms/50x140.png",
+                        "assets/images/platforms/50x180.png",
+                        "assets/images/walls/200x500.png",
+                        "assets/images/walls/200x350.png",
+                        "assets/images/walls/200x200.png",
+                        "assets/images/walls/170x600.png",
+                        "assets/images/floors/floor_tile.png",
+                        "assets/images/environment/elevator/elevator_shaft.png",
+                        "assets/images/crates/red_green.png",
+                        "assets/images/crates/gold_blue.png",
+                        "assets/images/crates/blue_green.png",
+                        "assets/images/crates/blue_red.png",
+                        "assets/images/effects/blood_splatter.png",
+                        "assets/images/environment/hazards/monster.png"]
+
+        self.asset_manifest = [(AssetManager.image, path) for path in images]
+        self.asset_manifest += [(AssetManager.alpha_image, path) for path in alpha_images]
+
+        # the packages are stacked on each other, so their contacts are solved together
+        self.contact_solver = ImpulseSolver.tag
+
     def resume(self):
         # load music to play in the background
         mixer.music.load("assets/music/MarysCreepyCarnivalTheme.ogg")
@@ -328,7 +370,7 @@ class PlatformWorld(World):
 
     def load_scene(self):
 
-        img = pygame.image.load("assets/images/gui/hint.png").convert()
+        img = self.engine.assets.load_image("assets/images/gui/hint.png")
         self.text = self.engine.gui.Widget(img, Vector2(0, 0))
 
         w = self.engine.display.get_width()
@@ -378,10 +420,6 @@ class PlatformWorld(World):
         render.camera.add_component(Transform(Vector2(0, 0)))
         render.camera.add_script(CameraFollow("camera follow", self.player.transform, w, h))
 
-        # start the background music and set it to loop forever
-        mixer.music.play(-1)
-        mixer.music.set_volume(0.3)
-
         self.get_system(PhysicsSystem.tag).gravity.y += 200
 
         self.add_script(UpdateAnimationHandler(self.player_anim_handler))
@@ -405,17 +443,17 @@ class PlatformWorld(World):
         render_sys = self.get_system(RenderSystem.tag)
 
         # a light source to see the monster
-        lamp_light_img = pygame.image.load("assets/images/lights/lamp_light_xsmall_mask.png").convert_alpha()
+        lamp_light_img = self.engine.assets.load_image("assets/images/lights/lamp_light_xsmall_mask.png", True)
         self.monster_light = self.create_renderable_object(lamp_light_img)
         self.monster_light.renderer.depth = 10000
 
-        large_lamp_light_img = pygame.image.load("assets/images/lights/lamp_light_mask.png").convert_alpha()
+        large_lamp_light_img = self.engine.assets.load_image("assets/images/lights/lamp_light_mask.png", True)
         self.lamp_source = self.create_renderable_object(large_lamp_light_img)
         self.lamp_source.renderer.depth = 10000
         render_sys.light_sources.append(self.lamp_source)
 
-        lamp_light_img = pygame.image.load("assets/images/lights/lamp_light_small_mask.png").convert_alpha()
-        lamp_img = pygame.image.load("assets/images/environment/lamp.png").convert_alpha()
+        lamp_light_img = self.engine.assets.load_image("assets/images/lights/lamp_light_small_mask.png", True)
+        lamp_img = self.engine.assets.load_image("assets/images/environment/lamp.png", True)
 
         # LAMP AT WALL A
         lamp = self.create_renderable_object(lamp_img)
@@ -459,7 +497,7 @@ class PlatformWorld(World):
 
     def load_saw(self):
 
-        img = pygame.image.load("assets/images/environment/hazards/saw.png").convert_alpha()
+        img = self.engine.assets.load_image("assets/images/environment/hazards/saw.png", True)
         saw = self.create_game_object(img)
         saw.transform.scale_by(0.75, 0.75)
         saw.renderer.depth = 70
@@ -489,7 +527,7 @@ class PlatformWorld(World):
 
         animator.set_animation(anim)
 
-        img = pygame.image.load("assets/images/tiles/56x100_switchOFF.png").convert()
+        img = self.engine.assets.load_image("assets/images/tiles/56x100_switchOFF.png")
 
         # add the switch to deactivate lever
         switch = self.create_game_object(img)
@@ -500,7 +538,7 @@ class PlatformWorld(World):
 
     def load_book_shelves(self):
 
-        img = pygame.image.load("assets/images/environment/bookcase.png").convert()
+        img = self.engine.assets.load_image("assets/images/environment/bookcase.png")
         w = img.get_width()
         h = img.get_height()
         pivot = Vector2(w/2, h/2)
@@ -537,14 +575,14 @@ class PlatformWorld(World):
         background.renderer.is_static = True
 
         path = "assets/images/backgrounds/"
-        img = pygame.image.load(path + "eye_duck.png").convert()
+        img = self.engine.assets.load_image(path + "eye_duck.png")
         background = self.create_renderable_object(img)
         background.renderer.pivot = Vector2(0, 0)
         #background = self.create_box_collider_object()
         background.renderer.depth = 100
         background.transform.position = Vector2(200, -300)
 
-        img = pygame.image.load(path + "horse.png").convert()
+        img = self.engine.assets.load_image(path + "horse.png")
         background = self.create_renderable_object(img)
         background.renderer.pivot = Vector2(0, 0)
         background.renderer.depth = 100
@@ -553,13 +591,13 @@ class PlatformWorld(World):
         background.transform.position = Vector2(x, -300)
 
         w = img.get_width()
-        img = pygame.image.load(path + "all_toys.png").convert()
+        img = self.engine.assets.load_image(path + "all_toys.png")
         background = self.create_renderable_object(img)
         background.renderer.pivot = Vector2(0, 0)
         background.renderer.depth = 100
         background.transform.position = Vector2(x + w, -300)
 
-        img = pygame.image.load(path + "no_toys.png").convert()
+        img = self.engine.assets.load_image(path + "no_toys.png")
         background = self.create_renderable_object(img)
         background.renderer.pivot = Vector2(0, 0)
         background.renderer.depth = 100
@@ -567,9 +605,9 @@ class PlatformWorld(World):
 
     def load_ladders(self):
         path = "assets/images/ladders/"
-        load = pygame.image.load
-        ladder_body = load(path + "ladder_body.png").convert_alpha()
-        ladder_top = load(path + "ladder_top.png").convert_alpha()
+        load = self.engine.assets.load_image
+        ladder_body = load(path + "ladder_body.png", True)
+        ladder_top = load(path + "ladder_top.png", True)
 
         shift = 200
 
@@ -581,15 +619,15 @@ class PlatformWorld(World):
 
         path = "assets/images/platforms/"
 
-        load = pygame.image.load
+        load = self.engine.assets.load_image
 
-        img_200x30 = load(path + "30x200.png").convert_alpha()
-        img_400x30 = load(path + "30x400.png").convert_alpha()
-        img_250x50 = load(path + "50x250.png").convert_alpha()
-        img_400x120 = load(path + "120x400.png").convert_alpha()
+        img_200x30 = load(path + "30x200.png", True)
+        img_400x30 = load(path + "30x400.png", True)
+        img_250x50 = load(path + "50x250.png", True)
+        img_400x120 = load(path + "120x400.png", True)
         # img_300x30 = load(path + "30x300.png").convert_alpha()
-        img_800x150 = load(path + "150x800.png").convert_alpha()
-        img_300x50 = load(path + "50x300.png").convert_alpha()
+        img_800x150 = load(path + "150x800.png", True)
+        img_300x50 = load(path + "50x300.png", True)
 
         plat_a = self.create_game_object(img_200x30)
         plat_a.transform.position = Vector2(300, 250+50+50)
@@ -637,12 +675,12 @@ class PlatformWorld(World):
 
         path = "assets/images/walls/"
 
-        load = pygame.image.load
+        load = self.engine.assets.load_image
 
-        img_200x500 = load(path + "200x500.png").convert_alpha()
-        img_200x350 = load(path + "200x350.png").convert_alpha()
-        img_200x200 = load(path + "200x200.png").convert_alpha()
-        img_600x170 = load(path + "170x600.png").convert_alpha()
+        img_200x500 = load(path + "200x500.png", True)
+        img_200x350 = load(path + "200x350.png", True)
+        img_200x200 = load(path + "200x200.png", True)
+        img_600x170 = load(path + "170x600.png", True)
 
         wall_a = self.create_game_object(img_200x500)
         wall_a.transform.position = Vector2(100, 350+75)
@@ -669,7 +707,7 @@ class PlatformWorld(World):
         w = self.engine.display.get_width()
         h = self.engine.display.get_height()
 
-        floor_tile = pygame.image.load("assets/images/floors/floor_tile.png").convert_alpha()
+        floor_tile = self.engine.assets.load_image("assets/images/floors/floor_tile.png", True)
 
         img = create_img_from_tile(floor_tile, w*2, 200)
         floor_a = self.create_game_object(img)
@@ -690,7 +728,7 @@ class PlatformWorld(World):
     def load_ceilings(self):
 
         w = self.engine.display.get_width()
-        floor_tile = pygame.image.load("assets/images/floors/floor_tile.png").convert_alpha()
+        floor_tile = self.engine.assets.load_image("assets/images/floors/floor_tile.png", True)
 
         img = create_img_from_tile(floor_tile, w*2, 200)
         img = pygame.transform.flip(img, False, True)
@@ -725,7 +763,16 @@ class PlatformWorld(World):
         self.player.transform.scale = Vector2(1, 1)
         self.player.renderer.depth = -10
         self.player.rigid_body.gravity_scale = 1.0
+        self.player.rigid_body.continuous = True
+
+        # the player is moved by input, and the climbing needs the ladder events while it stands still
+        self.player.rigid_body.can_sleep = False
+
+        # the movement scripts expect the player to be pushed out of what it runs into
+        self.player.rigid_body.use_contact_solver = False
+
         self.player.collider.restitution = 0
+        self.player.collider.category = LAYER_PLAYER
         self.player.name = "player"
 
         self.player.collider.set_box(40, 70)
@@ -745,8 +792,8 @@ class PlatformWorld(World):
 
         path = "assets/images/platforms/"
 
-        img_140x50 = pygame.image.load(path + "50x140.png").convert_alpha()
-        img_180x50 = pygame.image.load(path + "50x180.png").convert_alpha()
+        img_140x50 = self.engine.assets.load_image(path + "50x140.png", True)
+        img_180x50 = self.engine.assets.load_image(path + "50x180.png", True)
 
         # create elevator platforms
         for i in range(0, 4):
@@ -783,7 +830,7 @@ class PlatformWorld(World):
         # the elevator shaft
         path = "assets/images/environment/elevator/"
 
-        elev_shaft_img = pygame.image.load(path + "elevator_shaft.png").convert_alpha()
+        elev_shaft_img = self.engine.assets.load_image(path + "elevator_shaft.png", True)
         elevator_shaft = self.create_renderable_object(elev_shaft_img)
 
         y = elev_shaft_img.get_width()-150
@@ -791,7 +838,7 @@ class PlatformWorld(World):
         elevator_shaft.add_component(Transform(Vector2(1100, y)))
         elevator_shaft.renderer.depth = 50
 
-        elevator_cabin_img = pygame.image.load(path + "extended_elevator.png").convert()
+        elevator_cabin_img = self.engine.assets.load_image(path + "extended_elevator.png")
         elevator_cabin = self.create_renderable_object(elevator_cabin_img)
         elevator_cabin.add_component(Transform(Vector2(1100, y + elevator_cabin_img.get_height() + 100)))
         elevator_cabin.renderer.depth = 40
@@ -800,33 +847,35 @@ class PlatformWorld(World):
         elevator_cabin.add_component(BoxCollider(140, 20))
         elevator_cabin.collider.is_trigger = True
         elevator_cabin.collider.surface_friction = 0.75
+        elevator_cabin.collider.category = LAYER_GROUND
         elevator_cabin.tag = "cabin"
+        self.elevator_cabin = elevator_cabin
 
         elevator_cabin.add_script(MoveCabin())
 
     def load_boxes(self):
-        box_img = pygame.image.load("assets/images/crates/red_green.png").convert_alpha()
+        box_img = self.engine.assets.load_image("assets/images/crates/red_green.png", True)
         box = self.create_game_object(box_img)
         box.transform.position = Vector2(900, 560)
         set_box_attributes(box)
         box.add_script(TeleportCrate())
         self.crates.append(box)
 
-        box_img = pygame.image.load("assets/images/crates/gold_blue.png").convert_alpha()
+        box_img = self.engine.assets.load_image("assets/images/crates/gold_blue.png", True)
         box = self.create_game_object(box_img)
         box.transform.position = Vector2(540, 400)
         set_box_attributes(box)
         box.add_script(TeleportCrate())
         self.crates.append(box)
 
-        box_img = pygame.image.load("assets/images/crates/blue_green.png").convert_alpha()
+        box_img = self.engine.assets.load_image("assets/images/crates/blue_green.png", True)
         box = self.create_game_object(box_img)
         box.transform.position = Vector2(1300, -320)
         set_box_attributes(box)
         box.add_script(TeleportCrate())
         self.crates.append(box)
 
-        box_img = pygame.image.load("assets/images/crates/blue_red.png").convert_alpha()
+        box_img = self.engine.assets.load_image("assets/images/crates/blue_red.png", True)
         box = self.create_game_object(box_img)
         box.transform.position = Vector2(2475, 300)
         set_box_attributes(box)
@@ -840,7 +889,7 @@ class PlatformWorld(World):
         path_to_anims = "assets/animations/"
 
         # setup the idle animation
-        anim = load_anim_from_directory(path_to_anims + "Idle/")
+        anim = load_anim_from_directory(path_to_anims + "Idle/", self.engine.assets)
 
         # set time between frames in seconds
         anim.frame_latency = 0.18
@@ -850,20 +899,20 @@ class PlatformWorld(World):
         self.player_anim_handler.add_state(state)
 
         # setup the walk animation
-        anim = load_anim_from_directory(path_to_anims + "Walking/")
+        anim = load_anim_from_directory(path_to_anims + "Walking/", self.engine.assets)
         anim.frame_latency = 0.083
         state = AnimationStateMachine.AnimationState("walking", anim)
         self.player_anim_handler.add_state(state)
 
         # add jump animation
-        anim = load_anim_from_directory(path_to_anims + "Jumping/")
+        anim = load_anim_from_directory(path_to_anims + "Jumping/", self.engine.assets)
         anim.frame_latency = 0.12
         anim.cycle = False
         state = AnimationStateMachine.AnimationState("jumping", anim)
         self.player_anim_handler.add_state(state)
 
         # climb animation
-        anim = load_anim_from_directory(path_to_anims + "Climbing/")
+        anim = load_anim_from_directory(path_to_anims + "Climbing/", self.engine.assets)
         anim.frame_latency = 0.12
         state = AnimationStateMachine.AnimationState("climbing", anim)
         self.player_anim_handler.add_state(state)
@@ -921,6 +970,7 @@ class PlatformWorld(World):
 
         ladder.renderer.depth = 3
 
+        ladder.collider.category = LAYER_LADDER
         ladder.tag = "ladder"
 
         self.ladders.append(ladder)
@@ -929,7 +979,7 @@ class PlatformWorld(World):
 
         render_sys = self.get_system(RenderSystem.tag)
 
-        img = pygame.image.load("assets/images/environment/hazards/monster.png").convert_alpha()
+        img = self.engine.assets.load_image("assets/images/environment/hazards/monster.png", True)
         w = img.get_width()
         h = img.get_height()
         pivot = Vector2(w/2, h/2)
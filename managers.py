@@ -1,5 +1,14 @@
+import pygame
 
 from entity import *
+from atlas import TextureAtlas
+
+# Decoding assets in the background is optional. It needs concurrent.futures, which is part of
+# Python 3 and a separate package on Python 2.
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 
 class EntityManager (object):
@@ -43,4 +52,230 @@ class IdManager:
 
     # put it back in the ids container
     def recycle_id(self, id_val):
-        self.ids.append(id_val)
\ No newline at end of file
+        self.ids.append(id_val)
+
+# Loads the images and sounds of the game once and keeps them, so that getting an asset again,
+# such as when a world is loaded again or an effect is shown during the game, reads nothing
+# from the disk. The assets are shared by everyone who gets them, so they must not be changed.
+#
+# The files of a manifest can be read and decoded by background threads, such as while the title
+# screen is shown. Loading an asset that is being decoded waits for it, and images are converted
+# to the display format on the main thread. The threads are kept until every asset that was given
+# to them has been loaded, or until the manager is closed.
+#
+# The images are converted for the display that the engine set. They are kept when a new engine
+# sets a display of the same pixel format, such as when the game restarts, and are loaded again
+# otherwise.
+#
+# The images with per pixel alpha that were packed into the texture atlas of the game are given as
+# subsurfaces of its pages instead of being loaded on their own. See atlas.py.
+class AssetManager (object):
+
+    # kinds of the entries of a manifest
+    image = "image"
+    alpha_image = "alpha image"
+    sound = "sound"
+
+    # threads that decode the assets in the background
+    decode_workers = 4
+
+    # where the texture atlas is saved. None to load every image on its own.
+    atlas_directory = "assets/atlas/"
+
+    def __init__(self):
+
+        # (kind, path) -> surface or sound
+        self.assets = dict()
+
+        # (kind, path) -> future of the decoded file, until the asset is loaded
+        self._decoding = dict()
+
+        # created when assets are first decoded in the background
+        self._pool = None
+
+        # loaded with the first image, since the display mode has to be set
+        self.atlas = None
+        self._atlas_loaded = False
+
+        # (bits per pixel, masks) of the display the images were converted for
+        self._display_format = None
+
+    # Get the image at the path converted to the display format, with per pixel alpha if alpha
+    # is True. The display mode must be set before the first load.
+    def load_image(self, path, alpha=False):
+
+        kind = AssetManager.alpha_image if alpha else AssetManager.image
+
+        asset = self.assets.get((kind, path))
+        if asset is None:
+
+            atlas = self._get_atlas()
+
+            if alpha and atlas is not None and path in atlas:
+                asset = atlas.get_image(path)
+            else:
+                asset = self._decode(kind, path)
+                asset = asset.convert_alpha() if alpha else asset.convert()
+
+            self.assets[(kind, path)] = asset
+
+        return asset
+
+    # The mixer must be initialized before the first load.
+    def load_sound(self, path):
+
+        asset = self.assets.get((AssetManager.sound, path))
+        if asset is None:
+            asset = self._decode(AssetManager.sound, path)
+            self.assets[(AssetManager.sound, path)] = asset
+
+        return asset
+
+    # Start reading and decoding the assets of a manifest, a list of (kind, path), in the
+    # background. Returns the futures of the decoded files, which are waited for when the assets
+    # are loaded. Nothing is decoded ahead of time if threads are not available.
+    def decode_in_background(self, manifest):
+
+        if ThreadPoolExecutor is None:
+            return list()
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(AssetManager.decode_workers)
+
+        atlas = self._get_atlas()
+
+        futures = list()
+        for kind, path in manifest:
+
+            key = (kind, path)
+            if key in self.assets:
+                continue
+
+            if kind == AssetManager.alpha_image and atlas is not None and path in atlas:
+                continue
+
+            future = self._decoding.get(key)
+            if future is None:
+                future = self._pool.submit(AssetManager._read, kind, path)
+                self._decoding[key] = future
+
+            futures.append(future)
+
+        if not self._decoding:
+            self.close()
+
+        return futures
+
+    # Set the display that the images are converted for. The images converted for a display of
+    # another pixel format are forgotten, so that they are loaded again.
+    def set_display(self, display):
+
+        display_format = (display.get_bitsize(), display.get_masks())
+
+        if self._display_format is not None and display_format != self._display_format:
+
+            for key in [key for key in self.assets if key[0] != AssetManager.sound]:
+                del self.assets[key]
+
+            self.atlas = None
+            self._atlas_loaded = False
+
+        self._display_format = display_format
+
+    # Stop the background threads once the assets they were decoding are done. The assets that
+    # were not loaded yet are loaded on the main thread.
+    def close(self):
+
+        self._decoding.clear()
+
+        if self._pool is not None:
+            self._pool.shutdown(False)
+            self._pool = None
+
+    def _get_atlas(self):
+
+        if not self._atlas_loaded:
+            self._atlas_loaded = True
+            if AssetManager.atlas_directory is not None:
+                self.atlas = TextureAtlas.load(AssetManager.atlas_directory)
+
+        return self.atlas
+
+    # get the decoded file of an asset, waiting for it if it is being decoded in the background
+    def _decode(self, kind, path):
+
+        future = self._decoding.pop((kind, path), None)
+        if future is None:
+            return AssetManager._read(kind, path)
+
+        # the threads are not needed once every asset given to them was loaded
+        if not self._decoding:
+            self.close()
+
+        return future.result()
+
+    # Read and decode the file of an asset. Images are not converted to the display format, since
+    # this can run on any thread.
+    @staticmethod
+    def _read(kind, path):
+
+        if kind == AssetManager.sound:
+            return pygame.mixer.Sound(path)
+
+        return pygame.image.load(path)
+
+    # Load the assets of a manifest, a list of (kind, path), ahead of time.
+    def preload(self, manifest):
+
+        for kind, path in manifest:
+
+            if kind == AssetManager.image:
+                self.load_image(path)
+            elif kind == AssetManager.alpha_image:
+                self.load_image(path, True)
+            elif kind == AssetManager.sound:
+                self.load_sound(path)
+            else:
+                print("Error. Unknown asset kind: " + str(kind))
+
+    def is_loaded(self, kind, path):
+        return (kind, path) in self.assets
+
+    # Forget an asset, so that it is loaded from the disk again the next time.
+    def unload(self, kind, path):
+        self.assets.pop((kind, path), None)
+
+        if self._decoding.pop((kind, path), None) is not None and not self._decoding:
+            self.close()
+
+    # Get the bytes taken by each asset as (kind, path, bytes), largest first.
+    def get_memory(self):
+
+        memory = [(kind, path, AssetManager._get_size(asset)) for (kind, path), asset in self.assets.items()]
+        memory.sort(key=lambda entry: entry[2], reverse=True)
+        return memory
+
+    def get_total_memory(self):
+        return sum(entry[2] for entry in self.get_memory())
+
+    # print the memory taken by each asset
+    def print_memory(self):
+
+        for kind, path, size in self.get_memory():
+            print("%10.1f KB  %-12s %s" % (size / 1024.0, kind, path))
+
+        print("%10.1f KB  total" % (self.get_total_memory() / 1024.0))
+
+    @staticmethod
+    def _get_size(asset):
+
+        if isinstance(asset, pygame.Surface):
+            return asset.get_width() * asset.get_height() * asset.get_bytesize()
+
+        # sounds are kept decoded in the format of the mixer
+        mixer_format = pygame.mixer.get_init()
+        if mixer_format is None:
+            return 0
+
+        frequency, bits, channels = mixer_format
+        return int(asset.get_length() * frequency) * channels * (abs(bits) // 8)
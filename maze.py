@@ -3,34 +3,38 @@ from world import *
 from engine import *
 from components import BehaviorScript
 from scripts import CameraFollow
+from utility import LAYER_GROUND
+from utility import LAYER_PLAYER
+from utility import LAYER_LEVER
+from utility import LAYER_BLOCKED
 
 Engine(10, 10)
 
 scale_x = 56  # original 56
 scale_y = 100  # original 100
-tile = pygame.image.load("assets/images/tiles/56x100 tile.png").convert()
-off_switch_state_on = pygame.image.load("assets/images/tiles/56x100_switchOFF.png").convert()
-off_switch_state_off = pygame.image.load("assets/images/tiles/56x100_switchNORM.png").convert()
-on_switch = pygame.image.load("assets/images/tiles/56x100_switchON.png").convert()
+tile = Engine.assets.load_image("assets/images/tiles/56x100 tile.png")
+off_switch_state_on = Engine.assets.load_image("assets/images/tiles/56x100_switchOFF.png")
+off_switch_state_off = Engine.assets.load_image("assets/images/tiles/56x100_switchNORM.png")
+on_switch = Engine.assets.load_image("assets/images/tiles/56x100_switchON.png")
 
-player_image_north = pygame.image.load("assets/images/character/character_north.png").convert_alpha()
-player_image_south = pygame.image.load("assets/images/character/character_south.png").convert_alpha()
-player_image_east = pygame.image.load("assets/images/character/character_east.png").convert_alpha()
-player_image_west = pygame.image.load("assets/images/character/character_west.png").convert_alpha()
+player_image_north = Engine.assets.load_image("assets/images/character/character_north.png", True)
+player_image_south = Engine.assets.load_image("assets/images/character/character_south.png", True)
+player_image_east = Engine.assets.load_image("assets/images/character/character_east.png", True)
+player_image_west = Engine.assets.load_image("assets/images/character/character_west.png", True)
 
 
-player_image_northeast = pygame.image.load("assets/images/character/character_northeast.png").convert_alpha()
-player_image_northwest = pygame.image.load("assets/images/character/character_northwest.png").convert_alpha()
-player_image_southeast = pygame.image.load("assets/images/character/character_southeast.png").convert_alpha()
-player_image_southwest = pygame.image.load("assets/images/character/character_southwest.png").convert_alpha()
+player_image_northeast = Engine.assets.load_image("assets/images/character/character_northeast.png", True)
+player_image_northwest = Engine.assets.load_image("assets/images/character/character_northwest.png", True)
+player_image_southeast = Engine.assets.load_image("assets/images/character/character_southeast.png", True)
+player_image_southwest = Engine.assets.load_image("assets/images/character/character_southwest.png", True)
 
 
-lamp_light_img = pygame.image.load("assets/images/lights/lamp_light_1200x700.png").convert_alpha()
+lamp_light_img = Engine.assets.load_image("assets/images/lights/lamp_light_1200x700.png", True)
 
-bump_sound = mixer.Sound("assets/sound/bump.WAV")
-block_removed = mixer.Sound("assets/sound/dooropen.WAV")
-blocked_wall = mixer.Sound("assets/sound/effect_ice1.WAV")
-puzzle_finished_sfx = mixer.Sound("assets/sound/piano_low_key.wav")
+bump_sound = Engine.assets.load_sound("assets/sound/bump.WAV")
+block_removed = Engine.assets.load_sound("assets/sound/dooropen.WAV")
+blocked_wall = Engine.assets.load_sound("assets/sound/effect_ice1.WAV")
+puzzle_finished_sfx = Engine.assets.load_sound("assets/sound/piano_low_key.wav")
 bump_sound.set_volume(0.2)
 block_removed.set_volume(0.3)
 blocked_wall.set_volume(0.3)
@@ -66,8 +70,10 @@ class LightFollow(WorldScript):
 
     def update(self):
 
-        # make the lamp mask follow the player
-        self.world.lamp_mask.transform.position = self.world.player.transform.position
+        # make the lamp mask follow where the player is drawn
+        player = self.world.player
+        position = self.world.get_system(PhysicsSystem.tag).get_render_position(player)
+        self.world.lamp_mask.transform.position = Vector2(position.x, position.y)
 
 
 class PlayerMovement(BehaviorScript):
@@ -166,9 +172,17 @@ class Maze(World):
         # if puzzle is complete
         self.puzzle = False
 
+        # the maze can be unloaded while the player is in the other rooms, but it stays completed
+        self.can_unload = True
+
         # this object signals that the player completed the puzzle and can exit the maze
         self.exit_object_trigger = None
 
+        # the floor of the scene and the beams shown once the puzzle is completed
+        self.asset_manifest = [(AssetManager.image, "assets/images/floors/WoodenFloor.png"),
+                               (AssetManager.alpha_image, "assets/images/tiles/vertical_beam.png"),
+                               (AssetManager.alpha_image, "assets/images/tiles/horizontal_beam.png")]
+
     def resume(self):
         mixer.music.load("assets/music/VoiceInMyHead.ogg")
         mixer.music.play(-1)
@@ -178,42 +192,49 @@ class Maze(World):
         l1c = (12, 4)
         self.blocked1 = self.create_game_object(tile)
         self.blocked1.tag = "blocked1"
+        self.blocked1.collider.category = LAYER_BLOCKED
         _l1c = find_coordinate(l1c)
         self.blocked1.transform.position = Vector2(_l1c[0], _l1c[1])
 
         l2c = (24, 6)
         self.blocked2 = self.create_game_object(tile)
         self.blocked2.tag = "blocked2"
+        self.blocked2.collider.category = LAYER_BLOCKED
         _l2c = find_coordinate(l2c)
         self.blocked2.transform.position = Vector2(_l2c[0], _l2c[1])
 
         l3c = (15, 11)
         self.blocked3 = self.create_game_object(tile)
         self.blocked3.tag = "blocked3"
+        self.blocked3.collider.category = LAYER_BLOCKED
         _l3c = find_coordinate(l3c)
         self.blocked3.transform.position = Vector2(_l3c[0], _l3c[1])
 
         l4c = (4, 12)
         self.blocked4 = self.create_game_object(tile)
         self.blocked4.tag = "blocked4"
+        self.blocked4.collider.category = LAYER_BLOCKED
         _l4c = find_coordinate(l4c)
         self.blocked4.transform.position = Vector2(_l4c[0], _l4c[1])
 
         l5c = (1, 7)
         self.blocked5 = self.create_game_object(tile)
         self.blocked5.tag = "blocked5"
+        self.blocked5.collider.category = LAYER_BLOCKED
         _l5c = find_coordinate(l5c)
         self.blocked5.transform.position = Vector2(_l5c[0], _l5c[1])
 
         l6c = (23, 7)
         self.blocked6 = self.create_game_object(tile)
         self.blocked6.tag = "blocked6"
+        self.blocked6.collider.category = LAYER_BLOCKED
         _l6c = find_coordinate(l6c)
         self.blocked6.transform.position = Vector2(_l6c[0], _l6c[1])
 
         l7c = (-1, 15)
         self.blocked7 = self.create_game_object(tile)
         self.blocked7.tag = "blocked7"
+        self.blocked7.collider.category = LAYER_BLOCKED
         _l7c = find_coordinate(l7c)
         self.blocked7.transform.position = Vector2(_l7c[0], _l7c[1])
 
@@ -255,6 +276,7 @@ class Maze(World):
         self.lever1 = self.create_game_object(off_switch_state_off)
         self.lever1.add_component(animator_1)
         self.lever1.tag = "lever1_off"
+        self.lever1.collider.category = LAYER_LEVER
         _l1c = find_coordinate(l1c)
         self.lever1.transform.position = Vector2(_l1c[0], _l1c[1])
 
@@ -263,6 +285,7 @@ class Maze(World):
         self.lever2 = self.create_game_object(off_switch_state_off)
         self.lever2.add_component(animator_2)
         self.lever2.tag = "lever2_off"
+        self.lever2.collider.category = LAYER_LEVER
         _l2c = find_coordinate(l2c)
         self.lever2.transform.position = Vector2(_l2c[0], _l2c[1])
 
@@ -271,6 +294,7 @@ class Maze(World):
         self.lever3 = self.create_game_object(off_switch_state_off)
         self.lever3.add_component(animator_3)
         self.lever3.tag = "lever3_off"
+        self.lever3.collider.category = LAYER_LEVER
         _l3c = find_coordinate(l3c)
         self.lever3.transform.position = Vector2(_l3c[0], _l3c[1])
 
@@ -279,6 +303,7 @@ class Maze(World):
         self.lever4 = self.create_game_object(off_switch_state_off)
         self.lever4.add_component(animator_4)
         self.lever4.tag = "lever4_off"
+        self.lever4.collider.category = LAYER_LEVER
         _l4c = find_coordinate(l4c)
         self.lever4.transform.position = Vector2(_l4c[0], _l4c[1])
 
@@ -287,6 +312,7 @@ class Maze(World):
         self.lever5 = self.create_game_object(off_switch_state_off)
         self.lever5.add_component(animator_5)
         self.lever5.tag = "lever5_off"
+        self.lever5.collider.category = LAYER_LEVER
         _l5c = find_coordinate(l5c)
         self.lever5.transform.position = Vector2(_l5c[0], _l5c[1])
 
@@ -294,6 +320,7 @@ class Maze(World):
         self.lever6 = self.create_game_object(off_switch_state_off)
         self.lever6.add_component(animator_6)
         self.lever6.tag = "lever6_off"
+        self.lever6.collider.category = LAYER_LEVER
         _l6c = find_coordinate(l6c)
         self.lever6.transform.position = Vector2(_l6c[0], _l6c[1])
 
@@ -302,6 +329,7 @@ class Maze(World):
         self.lever7 = self.create_game_object(off_switch_state_off)
         self.lever7.add_component(animator_7)
         self.lever7.tag = "lever7_off"
+        self.lever7.collider.category = LAYER_LEVER
         _l7c = find_coordinate(l7c)
         self.lever7.transform.position = Vector2(_l7c[0], _l7c[1])
 
@@ -352,6 +380,7 @@ class Maze(World):
         # self.new_wall = self.create_game_object(create_wall(c, (c[0]+1, c[1]+1)))
         self.new_wall = self.create_game_object(tile)
         self.new_wall.tag = "wall"
+        self.new_wall.collider.category = LAYER_GROUND
         c1 = find_coordinate(c)
         self.new_wall.transform.position = Vector2(c1[0], c1[1])
 
@@ -361,7 +390,7 @@ class Maze(World):
         puzzle_finished_sfx.play()
 
         self.destroy_entity(self.blocked7)
-        vertical_beam = pygame.image.load("assets/images/tiles/vertical_beam.png").convert_alpha()
+        vertical_beam = self.engine.assets.load_image("assets/images/tiles/vertical_beam.png", True)
 
         new_wall = self.create_renderable_object(vertical_beam)
         c = find_coordinate((-1, 8))
@@ -407,7 +436,7 @@ class Maze(World):
         c = find_coordinate((3, 8))
         new_wall.transform.position = Vector2(c[0], c[1])
 
-        horizontal_beam = pygame.image.load("assets/images/tiles/horizontal_beam.png").convert_alpha()
+        horizontal_beam = self.engine.assets.load_image("assets/images/tiles/horizontal_beam.png", True)
 
         new_wall = self.create_renderable_object(horizontal_beam)
         c = find_coordinate((0, 7))
@@ -464,7 +493,7 @@ class Maze(World):
         background.renderer.is_static = True
 
         # add necessary components to be able to position and render the background
-        floor_image = pygame.image.load("assets/images/floors/WoodenFloor.png").convert()
+        floor_image = self.engine.assets.load_image("assets/images/floors/WoodenFloor.png")
 
         # add necessary components to be able to position and render
         # the background
@@ -531,9 +560,14 @@ class Maze(World):
         self.player.transform.position = Vector2(0, 0)
         self.player.renderer.depth = -10
         self.player.rigid_body.gravity_scale = 1
+
+        # the player is moved by input, so it is kept awake to get the events of the colliders it stands in
+        self.player.rigid_body.can_sleep = False
+
         self.player.add_script(PlayerMovement("player_move"))
         self.player.collider.restitution = 1
         self.player.collider.set_box(30, 30)
+        self.player.collider.category = LAYER_PLAYER
 
         # ==================================== Trigger Exit Object ===============================
         self.exit_object_trigger = self.create_box_collider_object(500, 200)
@@ -868,10 +902,6 @@ class Maze(World):
         self.construct_blocked_walls()
         self.add_script(LightFollow())
 
-        # start the background music and set it to loop forever
-        mixer.music.play(-1)
-        mixer.music.set_volume(0.3)
-
 
 class PlayerBehavior (BehaviorScript):
     def __init__(self, script_name):
@@ -884,6 +914,9 @@ class PlayerBehavior (BehaviorScript):
         self.touched_lever6 = False
         self.touched_lever7 = False
 
+        # only the levers and the blocked paths matter to the player, not the walls
+        self.collision_mask = LAYER_LEVER | LAYER_BLOCKED
+
     def collision_event(self, other_collider):
         other_entity = other_collider.entity
         # hits lever 1-7
@@ -0,0 +1,117 @@
+import time
+
+from pygame import font
+
+# The most precise clock available. Python 2 does not have perf_counter.
+clock = getattr(time, "perf_counter", time.time)
+
+
+# Counters of the work done by the physics system during one frame
+class PhysicsFrameStats (object):
+
+    def __init__(self):
+
+        # number of fixed steps and the time spent in the whole physics system
+        self.steps = 0
+        self.time = 0.0
+
+        # time spent moving the rigid bodies
+        self.integration_time = 0.0
+
+        # pairs gathered from the broadphase (or every pair without a broadphase)
+        self.candidates = 0
+
+        # pairs that went through the narrow phase, and the ones tested by the process pool
+        self.narrow_tests = 0
+        self.pool_tests = 0
+
+        # pairs that overlapped and the ones that got a collision response
+        self.collisions = 0
+        self.responses = 0
+
+        # time spent in the collision events of the scripts
+        self.script_time = 0.0
+
+        # script name -> [seconds, calls] of its collision events
+        self.script_times = dict()
+
+    # Get the scripts whose collision events took the longest as (script name, seconds, calls)
+    def slowest_scripts(self, count=3):
+        scripts = [(name, entry[0], entry[1]) for name, entry in self.script_times.items()]
+        scripts.sort(key=lambda script: script[1], reverse=True)
+        return scripts[:count]
+
+
+# Measures where the frame time goes inside the physics system. The physics system fills the
+# stats of the current frame while it is profiling and the last complete frame can be read or
+# drawn on the screen.
+class PhysicsProfiler (object):
+
+    def __init__(self):
+
+        # stats of the frame being measured and of the last complete frame
+        self.frame = None
+        self.last_frame = None
+
+        self._frame_start = 0.0
+
+        # created when the overlay is first drawn since the font module has to be initialized
+        self._font = None
+
+    def begin_frame(self):
+        self.frame = PhysicsFrameStats()
+        self._frame_start = clock()
+        return self.frame
+
+    def end_frame(self):
+        self.frame.time = clock() - self._frame_start
+        self.last_frame = self.frame
+        self.frame = None
+
+    # Call the collision event of a script and add its time to the frame
+    @staticmethod
+    def time_event(stats, script, event, collider):
+
+        start = clock()
+        event(collider)
+        elapsed = clock() - start
+
+        stats.script_time += elapsed
+
+        entry = stats.script_times.get(script.script_name)
+        if entry is None:
+            stats.script_times[script.script_name] = [elapsed, 1]
+        else:
+            entry[0] += elapsed
+            entry[1] += 1
+
+    # Draw the stats of the last frame in the top left corner of the surface
+    def draw(self, surface):
+
+        stats = self.last_frame
+        if stats is None:
+            return
+
+        if self._font is None:
+            self._font = font.Font(None, 18)
+
+        lines = [
+            "physics: " + str(stats.steps) + " steps " + PhysicsProfiler._ms(stats.time),
+            "integration: " + PhysicsProfiler._ms(stats.integration_time),
+            "candidates: " + str(stats.candidates) + " tests: " + str(stats.narrow_tests) +
+            " pool: " + str(stats.pool_tests),
+            "collisions: " + str(stats.collisions) + " responses: " + str(stats.responses),
+            "scripts: " + PhysicsProfiler._ms(stats.script_time)]
+
+        for name, seconds, calls in stats.slowest_scripts():
+            lines.append("  " + str(name) + ": " + PhysicsProfiler._ms(seconds) + " (" + str(calls) + ")")
+
+        y = 0
+        for line in lines:
+            text = self._font.render(line, True, (255, 255, 255), (0, 0, 0))
+            surface.blit(text, (0, y))
+            y += text.get_height()
+
+    @staticmethod
+    def _ms(seconds):
+        return "%.2f ms" % (seconds * 1000.0)
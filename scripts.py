@@ -4,6 +4,9 @@ from components import BehaviorScript
 from util_math import Vector2
 
 from systems import PhysicsSystem
+from utility import LAYER_GROUND
+from utility import LAYER_CRATE
+from utility import LAYER_LADDER
 
 
 class CameraFollow(BehaviorScript):
@@ -16,12 +19,18 @@ class CameraFollow(BehaviorScript):
 
     def update(self):
 
-        # center the target transform in the middle of the camera
-        x = self.target_transform.position.x - self.width/2
-        y = self.target_transform.position.y - self.height/2
-
         world = self.entity.world
 
+        # follow where the target is drawn
+        target_position = self.target_transform.position
+        physics = world.get_system(PhysicsSystem.tag)
+        if physics is not None and self.target_transform.entity is not None:
+            target_position = physics.get_render_position(self.target_transform.entity)
+
+        # center the target transform in the middle of the camera
+        x = target_position.x - self.width/2
+        y = target_position.y - self.height/2
+
         # keep camera within world bounds
         if world.is_bounded():
             if x < world.origin.x:
@@ -116,6 +125,9 @@ class PlayerPlatformMovement(BehaviorScript):
         self.grounded = False
         self.holding_crate = False
 
+        # only ground and crates can ground the player
+        self.collision_mask = LAYER_GROUND | LAYER_CRATE
+
     def update(self):
         keys = pygame.key.get_pressed()
 
@@ -215,13 +227,13 @@ class PlayerPlatformMovement(BehaviorScript):
 
         self.grounded = False
 
-        # iterate through object considered as ground
-        for other in self.entity.world.ground:
+        player = self.entity
+        world = player.world
 
-            player = self.entity
+        # iterate through the objects near the player that are considered as ground
+        for other in world.query_near(player):
 
-            # if the player collided with an element considered as ground, then ground the player
-            if PhysicsSystem.tolerance_collision(player.collider, other.collider):
+            if world.is_ground(other):
 
                 # check orientation of the collision
                 orientation = PhysicsSystem.calc_box_hit_orientation
@@ -232,31 +244,27 @@ class PlayerPlatformMovement(BehaviorScript):
 
         result = (False, None)
 
+        near = self.entity.world.query_near(self.entity)
+
         # check if the player is near a box
         for crate in self.entity.world.crates:
 
             # this code stops crates from being pushed inside of colliders such as walls
-            for entity in self.entity.world.entity_manager.entities:
-
-                # collider exists and is not a trigger
-                valid_collider = entity.collider is not None and not entity.collider.is_trigger
+            for entity in self.entity.world.query_collider(crate):
 
-                # don't consider the player or yourself during this collision test
-                if valid_collider and entity is not self.entity and entity is not crate:
+                # don't consider triggers or the player during this collision test
+                if not entity.collider.is_trigger and entity is not self.entity:
 
-                    # collision occurs
-                    if PhysicsSystem.box2box_collision(crate.collider, entity.collider):
+                    # check of the collision occurred from the sides
+                    side = PhysicsSystem.calc_box_hit_orientation(crate.collider, entity.collider)
+                    if side == PhysicsSystem.left or side == PhysicsSystem.right:
 
-                        # check of the collision occurred from the sides
-                        side = PhysicsSystem.calc_box_hit_orientation(crate.collider, entity.collider)
-                        if side == PhysicsSystem.left or side == PhysicsSystem.right:
-
-                            # stop the crate from moving
-                            return False, None
+                        # stop the crate from moving
+                        return False, None
 
             player = self.entity
 
-            if PhysicsSystem.tolerance_collision(player.collider, crate.collider):
+            if crate in near:
 
                 side = PhysicsSystem.calc_box_hit_orientation(player.collider, crate.collider)
 
@@ -295,6 +303,8 @@ class PlayerClimbing(BehaviorScript):
         self.move_down = False
         self.climbing = False
 
+        self.collision_mask = LAYER_LADDER
+
     def update(self):
         keys = pygame.key.get_pressed()
 
@@ -369,8 +379,5 @@ class PlayerClimbing(BehaviorScript):
                 self.climbing = True
 
     def colliding_with_ladder(self):
-        # check if the player is colliding with a ladder
-        for ladder in self.entity.world.ladders:
-            if PhysicsSystem.tolerance_collision(self.entity.collider, ladder.collider):
-                return True
-        return False
\ No newline at end of file
+        # check if the player is near a ladder, with the reach of the tolerance hit boxes
+        return len(self.entity.world.query_near(self.entity, "ladder")) > 0
\ No newline at end of file
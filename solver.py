@@ -0,0 +1,457 @@
+from math import sqrt
+
+from components import BoxCollider
+from components import CircleCollider
+
+
+# A contact found by the narrow phase between two colliders that push each other apart.
+# The normal points from entity a to entity b.
+class ContactConstraint (object):
+
+    def __init__(self, entity_a, entity_b, inv_mass_a, inv_mass_b):
+
+        # (smaller uuid, larger uuid) of the pair
+        self.key = None
+
+        self.entity_a = entity_a
+        self.entity_b = entity_b
+
+        self.inv_mass_a = inv_mass_a
+        self.inv_mass_b = inv_mass_b
+
+        self.normal_x = 0.0
+        self.normal_y = 1.0
+        self.penetration = 0.0
+
+        # combined bounciness and friction coefficient of the colliders
+        self.restitution = 0.0
+        self.friction = 0.0
+
+        # the normal speed that the solver aims for (the bounce)
+        self.bias = 0.0
+
+        # impulses accumulated over the iterations
+        self.normal_impulse = 0.0
+        self.tangent_impulse = 0.0
+
+
+# Resolves the contacts of a physics step with impulses instead of pushing the colliders one pair
+# at a time. The bodies that touch each other are grouped into islands and every island is solved
+# on its own for a fixed number of iterations. The contacts that still touch and their impulses are
+# kept for the next step, so a resting stack holds itself up from the start of each step instead of
+# sinking and being pushed out again. A stack of packages stops moving about twenty steps after it
+# lands, and its bodies sleep together once all of them rested for PhysicsSystem.sleep_steps.
+#
+# Collider.restitution gives the bounce and Collider.surface_friction the friction (1 means none,
+# 0 means total friction). RigidBody.mass weighs the impulses. Colliders without a rigid body,
+# sleeping bodies and bodies that don't use the solver are not moved by it.
+class ImpulseSolver (object):
+
+    tag = "impulse"
+
+    def __init__(self):
+
+        # iterations on the velocities and on the positions of each island
+        self.velocity_iterations = 8
+        self.position_iterations = 3
+
+        # Only contacts that approach faster than this (pixels per second) bounce. Slower contacts
+        # rest instead of bouncing forever from the gravity gained during a step.
+        self.restitution_threshold = 30.0
+
+        # Penetration in pixels that is left alone, so that resting colliders keep overlapping, and
+        # the fraction of the rest that is corrected per position iteration. The velocities stop
+        # the bodies from sinking further, so the penetration shrinks to the slop over a few steps.
+        self.slop = 0.25
+        self.correction = 0.8
+
+        # (smaller uuid, larger uuid) -> (entity a, entity b) found during the current step
+        self.contacts = dict()
+
+        # the bodies of each island solved during the last step, which only sleep together
+        self.islands = list()
+
+        # The contacts of the last step whose colliders still overlap. The collision boxes are on
+        # whole pixels, so bodies resting on each other are not found overlapping on every step.
+        # The physics system adds them to the next step to keep the bodies resting.
+        self.touching = dict()
+
+        # key -> (normal x, normal y, normal impulse, tangent impulse) of the last step, which start
+        # the impulses of the contacts found again, so a stack doesn't have to be pushed up from
+        # nothing on every step
+        self._impulses = dict()
+
+    # Record that the narrow phase found the colliders of two entities overlapping.
+    # A pair is only recorded once per step.
+    def add_contact(self, entity_a, entity_b):
+
+        if entity_a.uuid < entity_b.uuid:
+            key = (entity_a.uuid, entity_b.uuid)
+        else:
+            key = (entity_b.uuid, entity_a.uuid)
+
+        if key not in self.contacts:
+            self.contacts[key] = (entity_a, entity_b)
+
+    # forget the contacts of an entity that is removed from the world
+    def remove_entity(self, entity):
+
+        for contacts in (self.contacts, self.touching, self._impulses):
+            for key in [key for key in contacts if entity.uuid in key]:
+                del contacts[key]
+
+    # Solve the contacts of the step. Returns the entities that were moved.
+    def solve(self):
+
+        contacts = list()
+
+        # sorted so that the islands are solved in the same order every time
+        for key in sorted(self.contacts):
+            entity_a, entity_b = self.contacts[key]
+
+            # The masses are found now since a body can be woken up after its contact was found
+            inv_mass_a = ImpulseSolver._get_inverse_mass(entity_a)
+            inv_mass_b = ImpulseSolver._get_inverse_mass(entity_b)
+
+            # neither can be moved (static colliders or sleeping islands)
+            if inv_mass_a + inv_mass_b == 0:
+                continue
+
+            contact = ContactConstraint(entity_a, entity_b, inv_mass_a, inv_mass_b)
+            contact.key = key
+
+            collider_a = entity_a.collider
+            collider_b = entity_b.collider
+
+            if collider_a is None or collider_b is None:
+                continue
+
+            contact.restitution = max(collider_a.restitution, collider_b.restitution)
+
+            # surface frictions multiply, like the velocity scaling of box2box_response
+            contact.friction = max(0.0, 1.0 - collider_a.surface_friction * collider_b.surface_friction)
+
+            contacts.append(contact)
+
+        self.contacts.clear()
+
+        moved = dict()
+        self.islands = list()
+
+        impulses = self._impulses
+        self._impulses = dict()
+        self.touching = dict()
+
+        for island in ImpulseSolver._build_islands(contacts):
+
+            # find the contact geometry and the bounce of each contact
+            active = list()
+            for contact in island:
+                if ImpulseSolver._update_geometry(contact):
+                    self._prepare(contact, impulses.get(contact.key))
+                    active.append(contact)
+
+            if not active:
+                continue
+
+            for i in range(self.velocity_iterations):
+                for contact in active:
+                    self._solve_velocity(contact)
+
+            for i in range(self.position_iterations):
+                for contact in active:
+                    if ImpulseSolver._update_geometry(contact):
+                        self._correct_position(contact)
+
+            bodies = dict()
+            for contact in active:
+
+                self._impulses[contact.key] = (contact.normal_x, contact.normal_y,
+                                               contact.normal_impulse, contact.tangent_impulse)
+
+                if ImpulseSolver._update_geometry(contact) and contact.penetration > 0:
+                    self.touching[contact.key] = (contact.entity_a, contact.entity_b)
+
+                if contact.inv_mass_a > 0:
+                    bodies[contact.entity_a.uuid] = contact.entity_a
+                if contact.inv_mass_b > 0:
+                    bodies[contact.entity_b.uuid] = contact.entity_b
+
+            self.islands.append(list(bodies.values()))
+            moved.update(bodies)
+
+        return list(moved.values())
+
+    # Only awake rigid bodies that use the solver are moved by it
+    @staticmethod
+    def _get_inverse_mass(entity):
+
+        rigid_body = entity.rigid_body
+        if rigid_body is None or rigid_body.sleeping or not rigid_body.use_contact_solver or rigid_body.mass <= 0:
+            return 0.0
+
+        return 1.0 / rigid_body.mass
+
+    # Group the contacts by the bodies that they connect. Bodies that can't be moved don't join
+    # islands since they don't pass impulses on. The islands keep the order of the contacts.
+    @staticmethod
+    def _build_islands(contacts):
+
+        parent = dict()
+
+        def find(key):
+            root = key
+            while parent[root] != root:
+                root = parent[root]
+
+            # compress the path
+            while parent[key] != root:
+                parent[key], key = root, parent[key]
+
+            return root
+
+        for contact in contacts:
+            keys = list()
+            if contact.inv_mass_a > 0:
+                keys.append(contact.entity_a.uuid)
+            if contact.inv_mass_b > 0:
+                keys.append(contact.entity_b.uuid)
+
+            for key in keys:
+                parent.setdefault(key, key)
+
+            if len(keys) == 2:
+                root_a = find(keys[0])
+                root_b = find(keys[1])
+                if root_a != root_b:
+                    parent[root_b] = root_a
+
+        islands = dict()
+        order = list()
+        for contact in contacts:
+            if contact.inv_mass_a > 0:
+                root = find(contact.entity_a.uuid)
+            else:
+                root = find(contact.entity_b.uuid)
+
+            if root not in islands:
+                islands[root] = list()
+                order.append(root)
+
+            islands[root].append(contact)
+
+        return [islands[root] for root in order]
+
+    # Find the normal and the penetration of a contact from the current positions.
+    # Returns False if the colliders no longer overlap.
+    @staticmethod
+    def _update_geometry(contact):
+
+        collider_a = contact.entity_a.collider
+        collider_b = contact.entity_b.collider
+
+        if collider_a is None or collider_b is None:
+            return False
+
+        if collider_a.tag == CircleCollider.tag and collider_b.tag == CircleCollider.tag:
+            result = ImpulseSolver._circle_to_circle(collider_a, collider_b)
+
+        elif collider_a.tag == CircleCollider.tag and collider_b.tag == BoxCollider.tag:
+            result = ImpulseSolver._circle_to_box(collider_a, collider_b)
+
+        elif collider_a.tag == BoxCollider.tag and collider_b.tag == CircleCollider.tag:
+            result = ImpulseSolver._circle_to_box(collider_b, collider_a)
+            if result is not None:
+                result = (-result[0], -result[1], result[2])
+
+        else:
+            result = ImpulseSolver._box_to_box(collider_a, collider_b)
+
+        if result is None:
+            return False
+
+        contact.normal_x, contact.normal_y, contact.penetration = result
+        return True
+
+    # center and half size of a collider's box
+    @staticmethod
+    def _get_box(collider):
+        position = collider.entity.transform.position
+        return position.x + collider.offset.x, position.y + collider.offset.y, \
+            collider.box.width / 2.0, collider.box.height / 2.0
+
+    # Boxes are separated along the axis where they overlap the least
+    @staticmethod
+    def _box_to_box(collider_a, collider_b):
+
+        x_a, y_a, half_w_a, half_h_a = ImpulseSolver._get_box(collider_a)
+        x_b, y_b, half_w_b, half_h_b = ImpulseSolver._get_box(collider_b)
+
+        dx = x_b - x_a
+        dy = y_b - y_a
+
+        overlap_x = half_w_a + half_w_b - abs(dx)
+        overlap_y = half_h_a + half_h_b - abs(dy)
+
+        # The collision boxes are integer rects, so they can overlap while the exact boxes
+        # only touch. Those contacts still stop the bodies from approaching.
+        if overlap_x < -1 or overlap_y < -1:
+            return None
+
+        if overlap_x < overlap_y:
+            return (1.0 if dx >= 0 else -1.0), 0.0, max(overlap_x, 0.0)
+
+        return 0.0, (1.0 if dy >= 0 else -1.0), max(overlap_y, 0.0)
+
+    @staticmethod
+    def _circle_to_circle(collider_a, collider_b):
+
+        position_a = collider_a.entity.transform.position
+        position_b = collider_b.entity.transform.position
+
+        dx = position_b.x - position_a.x
+        dy = position_b.y - position_a.y
+        distance = sqrt(dx * dx + dy * dy)
+
+        penetration = collider_a.radius + collider_b.radius - distance
+        if penetration < 0:
+            return None
+
+        # the centers are on top of each other, push them apart vertically
+        if distance == 0:
+            return 0.0, 1.0, penetration
+
+        return dx / distance, dy / distance, penetration
+
+    # the normal points from the circle to the box
+    @staticmethod
+    def _circle_to_box(circle, box_collider):
+
+        position = circle.entity.transform.position
+        x, y, half_w, half_h = ImpulseSolver._get_box(box_collider)
+
+        # closest point on the box to the center of the circle
+        x_closest = min(max(position.x, x - half_w), x + half_w)
+        y_closest = min(max(position.y, y - half_h), y + half_h)
+
+        dx = x_closest - position.x
+        dy = y_closest - position.y
+        distance = sqrt(dx * dx + dy * dy)
+
+        if distance > 0:
+            penetration = circle.radius - distance
+            if penetration < 0:
+                return None
+            return dx / distance, dy / distance, penetration
+
+        # the center is inside the box, so push it out through the closest side like a box
+        dx = x - position.x
+        dy = y - position.y
+        overlap_x = half_w + circle.radius - abs(dx)
+        overlap_y = half_h + circle.radius - abs(dy)
+
+        if overlap_x < overlap_y:
+            return (1.0 if dx >= 0 else -1.0), 0.0, overlap_x
+
+        return 0.0, (1.0 if dy >= 0 else -1.0), overlap_y
+
+    # speed of b relative to a along a direction
+    @staticmethod
+    def _relative_speed(contact, x, y):
+
+        speed = 0.0
+
+        if contact.inv_mass_b > 0:
+            velocity = contact.entity_b.rigid_body.velocity
+            speed += velocity.x * x + velocity.y * y
+
+        if contact.inv_mass_a > 0:
+            velocity = contact.entity_a.rigid_body.velocity
+            speed -= velocity.x * x + velocity.y * y
+
+        return speed
+
+    # apply an impulse along a direction, pushing a and b apart when it is positive
+    @staticmethod
+    def _apply_impulse(contact, impulse, x, y):
+
+        if contact.inv_mass_a > 0:
+            velocity = contact.entity_a.rigid_body.velocity
+            velocity.x -= impulse * contact.inv_mass_a * x
+            velocity.y -= impulse * contact.inv_mass_a * y
+
+        if contact.inv_mass_b > 0:
+            velocity = contact.entity_b.rigid_body.velocity
+            velocity.x += impulse * contact.inv_mass_b * x
+            velocity.y += impulse * contact.inv_mass_b * y
+
+    # Find the bounce of a contact and apply the impulses it ended the last step with, given as
+    # (normal x, normal y, normal impulse, tangent impulse) or None
+    def _prepare(self, contact, impulses):
+
+        contact.normal_impulse = 0.0
+        contact.tangent_impulse = 0.0
+
+        normal_speed = ImpulseSolver._relative_speed(contact, contact.normal_x, contact.normal_y)
+
+        if normal_speed < -self.restitution_threshold:
+            contact.bias = -contact.restitution * normal_speed
+        else:
+            contact.bias = 0.0
+
+        # the impulses only carry over while the colliders touch along the same side
+        if impulses is not None and impulses[0] == contact.normal_x and impulses[1] == contact.normal_y:
+            contact.normal_impulse = impulses[2]
+            contact.tangent_impulse = impulses[3]
+
+            ImpulseSolver._apply_impulse(contact, contact.normal_impulse, contact.normal_x, contact.normal_y)
+            ImpulseSolver._apply_impulse(contact, contact.tangent_impulse, -contact.normal_y, contact.normal_x)
+
+    def _solve_velocity(self, contact):
+
+        inv_mass_sum = contact.inv_mass_a + contact.inv_mass_b
+        nx = contact.normal_x
+        ny = contact.normal_y
+
+        # normal impulse, which can only push the bodies apart
+        normal_speed = ImpulseSolver._relative_speed(contact, nx, ny)
+        impulse = (contact.bias - normal_speed) / inv_mass_sum
+
+        total = max(contact.normal_impulse + impulse, 0.0)
+        impulse = total - contact.normal_impulse
+        contact.normal_impulse = total
+
+        ImpulseSolver._apply_impulse(contact, impulse, nx, ny)
+
+        # friction impulse, limited by the normal impulse
+        tx = -ny
+        ty = nx
+
+        tangent_speed = ImpulseSolver._relative_speed(contact, tx, ty)
+        impulse = -tangent_speed / inv_mass_sum
+
+        limit = contact.friction * contact.normal_impulse
+        total = min(max(contact.tangent_impulse + impulse, -limit), limit)
+        impulse = total - contact.tangent_impulse
+        contact.tangent_impulse = total
+
+        ImpulseSolver._apply_impulse(contact, impulse, tx, ty)
+
+    # move the bodies apart by part of the penetration, the lighter body moving more
+    def _correct_position(self, contact):
+
+        depth = contact.penetration - self.slop
+        if depth <= 0:
+            return
+
+        amount = depth * self.correction / (contact.inv_mass_a + contact.inv_mass_b)
+
+        if contact.inv_mass_a > 0:
+            position = contact.entity_a.transform.position
+            position.x -= amount * contact.inv_mass_a * contact.normal_x
+            position.y -= amount * contact.inv_mass_a * contact.normal_y
+
+        if contact.inv_mass_b > 0:
+            position = contact.entity_b.transform.position
+            position.x += amount * contact.inv_mass_b * contact.normal_x
+            position.y += amount * contact.inv_mass_b * contact.normal_y
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+from pygame import transform
+
+
+# Keeps the images made by scaling and flipping sprites, so that scaling a sprite again by the
+# same amount, such as when a character turns around or a light fades, does not transform it
+# again. The least recently used images are dropped when their pixels go over the memory budget.
+#
+# The scales are quantized to the size of the image they make, or to multiples of the scale
+# step if it is set, so scales that make the same image share it.
+#
+# The images are shared by every renderer that scaled the same sprite the same way, so they
+# must not be drawn on.
+class ScaledSpriteCache (object):
+
+    def __init__(self, budget=32 * 1024 * 1024, scale_step=0):
+
+        # bytes of pixels the cached images can take
+        self.budget = budget
+
+        # scales are rounded to multiples of this, 0 to only round them to whole pixels
+        self.scale_step = scale_step
+
+        # (source, width, height, flip x, flip y) -> image, from least to most recently used
+        self._images = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._images)
+
+    # Get the source image scaled by the scales, flipped along the axes with negative scales
+    def get(self, source, x_scale, y_scale):
+
+        if self.scale_step:
+            x_scale = round(x_scale / self.scale_step) * self.scale_step
+            y_scale = round(y_scale / self.scale_step) * self.scale_step
+
+        width = int(source.get_width() * abs(x_scale))
+        height = int(source.get_height() * abs(y_scale))
+        key = (source, width, height, x_scale < 0, y_scale < 0)
+
+        images = self._images
+
+        image = images.pop(key, None)
+        if image is not None:
+            images[key] = image
+            self.hits += 1
+            return image
+
+        self.misses += 1
+
+        image = transform.scale(transform.flip(source, x_scale < 0, y_scale < 0), (width, height))
+
+        # images larger than the whole budget are not kept
+        size = ScaledSpriteCache._get_size(image)
+        if size > self.budget:
+            return image
+
+        images[key] = image
+        self.size += size
+
+        while self.size > self.budget:
+            self._evict()
+
+        return image
+
+    def clear(self):
+        self._images.clear()
+        self.size = 0
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # drop the least recently used image
+    def _evict(self):
+        key, image = self._images.popitem(last=False)
+        self.size -= ScaledSpriteCache._get_size(image)
+        self.evictions += 1
+
+    @staticmethod
+    def _get_size(image):
+        return image.get_width() * image.get_height() * image.get_bytesize()
@@ -0,0 +1,360 @@
+from math import ceil
+from math import floor
+
+import pygame
+
+from broadphase import SpatialHash
+
+
+# The sprites of a run that overlap one cell of the world, baked onto one surface
+class StaticChunk (object):
+
+    def __init__(self, column, row):
+
+        self.column = column
+        self.row = row
+
+        # renderers that overlap the cell, in their draw order
+        self.members = list()
+
+        # Where the surface is in the world. It is cropped to the sprites drawn on it and it is
+        # None when the chunk has to be baked again.
+        self.rect = None
+        self.surface = None
+
+
+# Renderers that are next to each other in the draw order of a layer and never move on their own,
+# such as the tiles of the floors and walls. The world is split into square cells and the sprites
+# of the run that overlap a cell are drawn once onto the chunk of that cell, so the whole run is
+# drawn with a few large blits. A chunk is only baked again when one of its sprites moves, is
+# disabled, changes its sprite or is removed.
+#
+# The sprites of a run are placed the same distance between pixels, which is kept by the chunks,
+# so they are drawn on the same pixels as on their own.
+#
+# Only sprites without per pixel alpha are baked, onto opaque chunks whose empty parts are filled
+# with the empty color and drawn with a color key. Blending sprites with soft edges onto a chunk
+# and the chunk onto the screen would round their colors twice. The chunks are run length encoded,
+# so their empty and opaque parts are fast to draw. A chunk is baked with per pixel alpha instead if
+# one of its renderers is given a sprite that can't be baked after the run was made.
+class StaticRun (object):
+
+    # color of the pixels of the opaque chunks that no sprite is drawn on
+    empty_color = (255, 0, 255)
+
+    def __init__(self, order, chunk_size, cell_size):
+
+        # draw order of the run among the other renderers of its layer
+        self.order = order
+
+        self.chunk_size = chunk_size
+
+        # (column, row) -> chunk
+        self.chunks = dict()
+
+        # where the renderers were baked, to only check the ones seen by the camera for changes
+        self._hash = SpatialHash(cell_size)
+
+        # the last box that was looked at and the keys of the renderers baked inside it, which are
+        # kept until a renderer is baked again
+        self._seen = None
+
+        # how far the sprites are placed from whole pixels
+        self.fraction = None
+
+        # uuid -> renderer, draw order, the state it was baked with, if its sprite can be baked onto an
+        # opaque chunk and the cells it overlaps
+        self._renderers = dict()
+        self._orders = dict()
+        self._states = dict()
+        self._opaque = dict()
+        self._cells = dict()
+
+    # Test if a renderer can be part of a run. Sprites at least as large as a chunk gain nothing
+    # from it, and sprites with a surface alpha would not look the same.
+    @staticmethod
+    def can_bake(renderer, chunk_size):
+
+        sprite = renderer.sprite
+        if sprite.get_width() >= chunk_size or sprite.get_height() >= chunk_size:
+            return False
+
+        return sprite.get_alpha() in (None, 255) and StaticRun.is_opaque(sprite)
+
+    # Test if a sprite can be baked onto an opaque chunk. It must not have per pixel alpha, and the
+    # pixels it draws must not have the empty color.
+    @staticmethod
+    def is_opaque(sprite):
+
+        if sprite.get_flags() & pygame.SRCALPHA:
+            return False
+
+        colorkey = sprite.get_colorkey()
+        if colorkey is not None and tuple(colorkey[:3]) == StaticRun.empty_color:
+            return True
+
+        return pygame.mask.from_threshold(sprite, StaticRun.empty_color, (1, 1, 1, 255)).count() == 0
+
+    # what the chunks of a renderer depend on: (sprite, disabled, left, top)
+    @staticmethod
+    def get_state(renderer):
+        entity = renderer.entity
+        position = entity.transform.position
+        return renderer.sprite, entity.disabled, position.x - renderer.pivot.x, position.y - renderer.pivot.y
+
+    def __len__(self):
+        return len(self._renderers)
+
+    def get_renderers(self):
+        return list(self._renderers.values())
+
+    # the number of pixels of the chunk surfaces
+    def get_area(self):
+
+        area = 0
+        for chunk in self.chunks.values():
+            if chunk.rect is None:
+                self._crop(chunk)
+            area += chunk.rect.width * chunk.rect.height
+
+        return area
+
+    # Test if a renderer can be added after the ones of the run
+    def can_add(self, renderer):
+        return self.fraction is None or StaticRun._get_fraction(StaticRun.get_state(renderer)) == self.fraction
+
+    # Test if the sprite of a renderer overlaps any sprite of the run
+    def overlaps(self, renderer):
+
+        rect = StaticRun._get_rect(StaticRun.get_state(renderer))
+        states = self._states
+
+        for key in self._hash.query((rect.left, rect.top, rect.right, rect.bottom)):
+            if rect.colliderect(StaticRun._get_rect(states[key])):
+                return True
+
+        return False
+
+    def add(self, renderer, order):
+
+        key = renderer.entity.uuid
+
+        self._renderers[key] = renderer
+        self._orders[key] = order
+
+        state = StaticRun.get_state(renderer)
+
+        if self.fraction is None:
+            self.fraction = StaticRun._get_fraction(state)
+
+        self._place(renderer, state)
+
+    @staticmethod
+    def _get_fraction(state):
+        x, y = state[2:]
+        return x - floor(x), y - floor(y)
+
+    # where the sprite of a state is drawn, on whole pixels
+    @staticmethod
+    def _get_rect(state):
+        sprite, disabled, x, y = state
+        return pygame.Rect(int(floor(x)), int(floor(y)), sprite.get_width(), sprite.get_height())
+
+    def remove(self, renderer):
+
+        key = renderer.entity.uuid
+        if key not in self._renderers:
+            return
+
+        self._unplace(renderer)
+        self._hash.remove(key)
+        self._seen = None
+
+        del self._renderers[key]
+        del self._orders[key]
+        del self._states[key]
+        del self._opaque[key]
+
+    # Bake a renderer again if it changed. Returns True if it did.
+    def refresh(self, renderer):
+
+        state = StaticRun.get_state(renderer)
+        if state == self._states.get(renderer.entity.uuid):
+            return False
+
+        self._unplace(renderer)
+        self._place(renderer, state)
+        return True
+
+    # Get the chunks that overlap the box (left, top, right, bottom), or every chunk if the box is
+    # None. The renderers that were baked inside the box are checked for changes first, like the
+    # renderers that are drawn on their own, and the chunks are baked if they have to be.
+    # Returns True as well if any chunk was baked.
+    def get_visible(self, aabb):
+
+        if aabb is None:
+            keys = list(self._renderers.keys())
+        elif self._seen is not None and self._seen[0] == aabb:
+            keys = self._seen[1]
+        else:
+            keys = self._hash.query(aabb)
+            self._seen = (aabb, keys)
+
+        # the same test as refresh, written out since it runs for every sprite in view every frame
+        changed = False
+        renderers = self._renderers
+        states = self._states
+        for key in keys:
+
+            renderer = renderers[key]
+            entity = renderer.entity
+            position = entity.transform.position
+            pivot = renderer.pivot
+
+            state = (renderer.sprite, entity.disabled, position.x - pivot.x, position.y - pivot.y)
+            if state != states[key]:
+                self._unplace(renderer)
+                self._place(renderer, state)
+                changed = True
+
+        chunks = self._get_chunks(aabb)
+
+        visible = list()
+        for chunk in chunks:
+
+            if chunk.surface is None:
+                self._bake(chunk)
+                changed = True
+
+            rect = chunk.rect
+            if rect.width and rect.height:
+                if aabb is None or (rect.left < aabb[2] and rect.top < aabb[3] and
+                                    rect.right > aabb[0] and rect.bottom > aabb[1]):
+                    visible.append(chunk)
+
+        return visible, changed
+
+    def _get_chunks(self, aabb):
+
+        if aabb is None:
+            return sorted(self.chunks.values(), key=lambda chunk: (chunk.row, chunk.column))
+
+        size = float(self.chunk_size)
+        chunks = self.chunks
+
+        visible = list()
+        for row in range(int(floor(aabb[1] / size)), int(floor(aabb[3] / size)) + 1):
+            for column in range(int(floor(aabb[0] / size)), int(floor(aabb[2] / size)) + 1):
+                chunk = chunks.get((column, row))
+                if chunk is not None:
+                    visible.append(chunk)
+
+        return visible
+
+    # add a renderer to the chunks of the cells it overlaps
+    def _place(self, renderer, state):
+
+        key = renderer.entity.uuid
+        sprite, disabled, x, y = state
+
+        size = float(self.chunk_size)
+        left = int(floor(x / size))
+        top = int(floor(y / size))
+        right = max(left, int(ceil((x + sprite.get_width()) / size)) - 1)
+        bottom = max(top, int(ceil((y + sprite.get_height()) / size)) - 1)
+
+        cells = [(column, row) for row in range(top, bottom + 1) for column in range(left, right + 1)]
+
+        orders = self._orders
+        order = orders[key]
+
+        for cell in cells:
+
+            chunk = self.chunks.get(cell)
+            if chunk is None:
+                chunk = StaticChunk(cell[0], cell[1])
+                self.chunks[cell] = chunk
+
+            members = chunk.members
+            members.append(renderer)
+
+            # keep the draw order if the renderer moved into the chunk of renderers drawn after it
+            if len(members) > 1 and orders[members[-2].entity.uuid] > order:
+                members.sort(key=lambda r: orders[r.entity.uuid])
+
+            chunk.rect = None
+            chunk.surface = None
+
+        if self._states.get(key, (None,))[0] is not sprite:
+            self._opaque[key] = StaticRun.is_opaque(sprite)
+
+        self._states[key] = state
+        self._cells[key] = cells
+
+        self._hash.update(key, (x, y, x + sprite.get_width(), y + sprite.get_height()))
+        self._seen = None
+
+    # remove a renderer from the chunks it was baked on
+    def _unplace(self, renderer):
+
+        for cell in self._cells.pop(renderer.entity.uuid, ()):
+
+            chunk = self.chunks[cell]
+            chunk.members = [r for r in chunk.members if r is not renderer]
+
+            if chunk.members:
+                chunk.rect = None
+                chunk.surface = None
+            else:
+                del self.chunks[cell]
+
+    # crop the chunk to the sprites drawn on it
+    def _crop(self, chunk):
+
+        size = self.chunk_size
+        cell = pygame.Rect(chunk.column * size, chunk.row * size, size, size)
+
+        rect = None
+        for renderer in chunk.members:
+            state = self._states[renderer.entity.uuid]
+            if state[1]:
+                continue
+
+            sprite_rect = StaticRun._get_rect(state)
+            if rect is None:
+                rect = sprite_rect
+            else:
+                rect.union_ip(sprite_rect)
+
+        if rect is None:
+            chunk.rect = pygame.Rect(cell.x, cell.y, 0, 0)
+        else:
+            chunk.rect = rect.clip(cell)
+
+    def _bake(self, chunk):
+
+        if chunk.rect is None:
+            self._crop(chunk)
+
+        rect = chunk.rect
+
+        opaque = all([self._opaque[renderer.entity.uuid] for renderer in chunk.members])
+
+        if opaque:
+            surface = pygame.Surface(rect.size).convert()
+            surface.fill(StaticRun.empty_color)
+        else:
+            surface = pygame.Surface(rect.size, pygame.SRCALPHA).convert_alpha()
+            surface.fill((0, 0, 0, 0))
+
+        for renderer in chunk.members:
+            sprite, disabled, x, y = self._states[renderer.entity.uuid]
+            if not disabled:
+                surface.blit(sprite, (int(floor(x)) - rect.x, int(floor(y)) - rect.y))
+
+        if opaque:
+            surface.set_colorkey(StaticRun.empty_color, pygame.RLEACCEL)
+        else:
+            surface.set_alpha(255, pygame.RLEACCEL)
+
+        chunk.surface = surface
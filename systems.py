@@ -1,8 +1,23 @@
 
 from abc import abstractmethod
+from math import sqrt
+from math import floor
 
 from components import *
 from util_math import get_relative_rect_pos
+from broadphase import SpatialHash
+from broadphase import StaticTree
+from broadphase import SweepAndPrune
+from broadphase import aabb_contains
+from broadphase import aabb_overlap
+import collision_kernel
+from collision_kernel import BoxBatch
+import collision_pool
+from collision_pool import PairPool
+from solver import ImpulseSolver
+from profiler import PhysicsProfiler
+from profiler import clock
+from static_chunks import StaticRun
 
 import pygame
 
@@ -21,6 +36,32 @@ class System (object):
         """
 
 
+# Two entities whose colliders are touching. The physics system keeps a contact across
+# frames for as long as the colliders keep touching.
+class Contact (object):
+
+    def __init__(self, entity_a, entity_b, frame):
+        self.entity_a = entity_a
+        self.entity_b = entity_b
+
+        # The colliders are saved so the exit event can pass them along even if they
+        # were removed from their entities.
+        self.collider_a = entity_a.collider
+        self.collider_b = entity_b.collider
+
+        # the physics step when the colliders started touching
+        self.first_frame = frame
+
+        # the last physics step when the colliders were touching
+        self.last_frame = frame
+
+    # get the entity touching the given entity
+    def get_other(self, entity):
+        if entity is self.entity_a:
+            return self.entity_b
+        return self.entity_a
+
+
 # Detects collision between objects with Collision Box Components
 # Handles basic bouncing collision between objects.
 
@@ -38,144 +79,1581 @@ class PhysicsSystem (System):
     # This value represents a magnitude of velocity to ignore and treat it as zero
     ignore_velocity_epsilon = 10
 
-    # holds pairs of colliding entities per iteration.
-    collision_queue = list()
+    # holds pairs of colliding entities per iteration.
+    collision_queue = list()
+
+    # The broadphases that a world can select. None means testing every pair (brute force).
+    broadphase_tags = [None, SpatialHash.tag, SweepAndPrune.tag]
+
+    # Rigid bodies whose speed stays below ignore_velocity_epsilon for this many steps are put
+    # to sleep. Sleeping bodies are not moved and do not look for collisions.
+    sleep_steps = 60
+
+    # A body resting on a collider gains speed from gravity until the collision boxes (which
+    # are integer rects) overlap again. Staying within this many pixels also counts as resting.
+    sleep_distance = 1.0
+
+    # The physics is simulated in steps of this many seconds regardless of the frame rate.
+    fixed_time_step = 1.0 / 120
+
+    # Maximum number of steps per frame. Time beyond this is dropped so that a slow frame
+    # does not cause even slower frames.
+    max_sub_steps = 8
+
+    # Extra space around an entity when gathering its collision candidates from the broadphase.
+    # Candidates are gathered again if the collision response pushes it further than this.
+    broadphase_margin = 4
+
+    # How many pixels a continuous rigid body is let into the collider that it was stopped at
+    continuous_skin = 2
+
+    # The process pool backend only tests the pairs in worker processes when a step has at least
+    # this many candidate pairs. Smaller worlds are faster without sending the pairs to the workers.
+    pool_min_pairs = 20000
+
+    # number of worker processes of the pool backend. None uses one per processor.
+    pool_workers = None
+
+    # Counting the candidate pairs costs about as much as testing them. When a step had too few
+    # pairs for the pool, they are only counted again after this many steps.
+    pool_check_steps = 60
+
+    # rects that the tolerance hit boxes are placed in when they are tested
+    _tolerance_rect_a = Rect(0, 0, 0, 0)
+    _tolerance_rect_b = Rect(0, 0, 0, 0)
+
+    # Length in pixels of the pieces that a ray cast is split into when searching the broadphase
+    raycast_segment_length = 256
+
+    def __init__(self):
+        super(PhysicsSystem, self).__init__()
+
+        self.gravity = Vector2(0.0, 500.0)
+        self.terminal_speed = 800
+
+        # Structure used to find nearby colliders. It is created from the world settings.
+        self.broadphase = None
+
+        # uuid -> entity for the entities inside the broadphase
+        self._broadphase_entities = dict()
+
+        # uuid -> index of the entity in the world during the current frame
+        self._entity_order = dict()
+
+        # Bounding volume hierarchy of the colliders that are not moved by the physics system
+        self.static_tree = StaticTree()
+
+        # uuid -> entity for the entities inside the static tree
+        self._static_entities = dict()
+
+        # uuid -> the collision box that was offset when the static collider was placed
+        self._static_boxes = dict()
+
+        # Arrays of collision boxes used to test a box against many others at once (needs NumPy).
+        # It is created from the world settings.
+        self.box_batch = None
+
+        # Worker processes that test the candidate pairs of large worlds. It is created from the
+        # world settings.
+        self.pair_pool = None
+
+        # uuid -> (end x, end y, [(entity b, side of the hit)]) of the entities whose pairs were
+        # tested by the pool during the current step, or None if the pool is not used.
+        self._pool_hits = None
+
+        # number of candidate pairs counted for the pool during the last check
+        self._pool_pairs = 0
+
+        # The entities that were moved differently than the pool expected during the current step.
+        # Their pairs are tested in this process.
+        self._pool_moved = SpatialHash()
+        self._pool_moved_entities = dict()
+
+        # Resolves the contacts of each step with impulses. It is created from the world settings.
+        # Without it the colliders are pushed apart one pair at a time by the collision responses.
+        self.solver = None
+
+        # (smaller uuid, larger uuid) -> contact between the entities that are touching
+        self.contacts = dict()
+
+        # uuid -> {uuid of the other entity -> contact} to find the contacts of an entity
+        self._entity_contacts = dict()
+
+        # number of physics steps taken. Used to tell if a contact is still touching.
+        self.frame = 0
+
+        # uuid -> entity for the sleeping rigid bodies
+        self._sleeping = dict()
+
+        # frame time that has not been simulated yet
+        self.time_accumulator = 0.0
+
+        # How far the accumulated time is into the next step, from 0 to 1. Used to draw
+        # the rigid bodies between their last two physics states.
+        self.interpolation_alpha = 1.0
+
+        # How far the tolerance hit boxes reach past the collision boxes. The largest margin of
+        # the colliders in the broadphase, used to find the colliders near an entity.
+        self.tolerance_margin = 0
+
+        # uuid -> (entity, x, y, entities near it) of the near queries answered during the frame
+        self._near_cache = dict()
+
+        # Measures the work done during each frame. It runs while the engine is in debug mode
+        # or when profiling is set.
+        self.profiler = PhysicsProfiler()
+        self.profiling = False
+
+        # stats of the frame being measured, or None when not profiling
+        self._profile = None
+
+    def process(self, entities):
+
+        # empty the collision queue
+        del PhysicsSystem.collision_queue[:]
+
+        # the near queries are answered again once the colliders move
+        self._near_cache.clear()
+
+        if self.profiling or self.world.engine.debug:
+            self._profile = self.profiler.begin_frame()
+
+        # run as many fixed steps as the frame time allows
+        self.time_accumulator += self.world.engine.delta_time
+
+        steps = 0
+        while self.time_accumulator >= self.fixed_time_step:
+
+            # the simulation can't keep up, drop the remaining time
+            if steps == self.max_sub_steps:
+                self.time_accumulator = 0.0
+                break
+
+            self._step(entities)
+
+            self.time_accumulator -= self.fixed_time_step
+            steps += 1
+
+        self.interpolation_alpha = self.time_accumulator / self.fixed_time_step
+
+        if self._profile is not None:
+            self._profile.steps = steps
+            self.profiler.end_frame()
+            self._profile = None
+
+    # Get the stats of the last frame that was profiled, or None
+    def get_profile(self):
+        return self.profiler.last_frame
+
+    # Advance the simulation by one fixed time step
+    def _step(self, entities):
+
+        self.frame += 1
+
+        # wake the bodies that were disturbed since the last step
+        if self._sleeping:
+            self._check_sleeping_bodies()
+
+        broadphase = self._get_broadphase()
+        self._update_collision_backend()
+        batch = self.box_batch
+
+        if self.world.contact_solver != (self.solver.tag if self.solver is not None else None):
+            self._update_contact_solver()
+
+        # no broadphase - test every entity against every other entity
+        if broadphase is None:
+            self._process_brute_force(entities, batch)
+
+        else:
+            self._process_broadphase(entities, broadphase, batch)
+
+        # resolve the contacts found during the step all at once
+        if self.solver is not None:
+            self._add_touching_contacts()
+            for e in self.solver.solve():
+                if broadphase is not None:
+                    self._refresh_broadphase_entry(e)
+
+        # trigger the collision exit event for the contacts that were not touched this frame
+        self._end_contacts()
+
+        # bodies that have been resting for long enough
+        resting = dict()
+
+        # save the state of the rigid bodies that were simulated
+        for e in entities:
+            rigid_body = e.rigid_body
+            if rigid_body is not None:
+                if e.disabled or not PhysicsSystem._is_dynamic(e):
+                    rigid_body.step_position = None
+
+                elif not rigid_body.sleeping:
+                    position = e.transform.position
+                    rigid_body.step_position = Vector2(position.x, position.y)
+
+                    if rigid_body.can_sleep and self._update_sleep_counter(e):
+                        resting[e.uuid] = e
+
+        if resting:
+            self._put_resting_to_sleep(resting)
+
+    # Only entities with a collider and a rigid body (or a collider treated as dynamic) look
+    # for collisions against the other entities.
+    @staticmethod
+    def _is_dynamic(entity):
+        collider = entity.collider
+        if collider is None:
+            return False
+        return entity.rigid_body is not None or collider.treat_as_dynamic
+
+    def _process_brute_force(self, entities, batch=None):
+
+        if batch is not None:
+            batch.pack(entities)
+
+        for index, eA in enumerate(entities):
+
+            # ignore disabled entities
+            if eA.disabled:
+                continue
+
+            if PhysicsSystem._is_dynamic(eA):
+
+                # sleeping bodies are not moved and only collide with awake bodies
+                if eA.rigid_body is not None and eA.rigid_body.sleeping:
+                    continue
+
+                # Move the rigid body
+                if eA.rigid_body is not None:
+                    self._integrate_motion(eA.transform, eA.rigid_body)
+
+                # every other entity is a candidate
+                if self._profile is not None:
+                    self._profile.candidates += len(entities) - 1
+
+                # test the box against all the other boxes at once
+                if batch is not None and eA.collider.tag == BoxCollider.tag:
+                    self._collide_batch(index, eA, entities, batch)
+                    continue
+
+                # Find another entity that it may collide with
+                for eB in entities:
+
+                    if eB.disabled:
+                        continue
+
+                    # Check that coll_comp_b is valid and that coll_comp_a is not colliding with itself
+                    if eB.collider is not None and eA is not eB:
+                        self._collide_pair(eA, eB)
+
+    # Same results as the brute force approach, but each entity is only tested against the
+    # entities that the broadphase reports as being nearby.
+    def _process_broadphase(self, entities, broadphase, batch=None):
+
+        self._sync_broadphase(entities, broadphase)
+
+        # the rows of the batch match the entity order recorded by the sync
+        if batch is not None:
+            batch.pack(entities, self._static_boxes)
+
+        # test the pairs of large worlds in the worker processes
+        self._pool_hits = None
+        if self.pair_pool is not None:
+            self._test_pairs_in_pool(entities, broadphase)
+
+        for eA in entities:
+
+            # ignore disabled entities
+            if eA.disabled:
+                continue
+
+            if PhysicsSystem._is_dynamic(eA):
+
+                # sleeping bodies are not moved and only collide with awake bodies
+                if eA.rigid_body is not None and eA.rigid_body.sleeping:
+                    continue
+
+                # Move the rigid body
+                if eA.rigid_body is not None:
+                    self._integrate_motion(eA.transform, eA.rigid_body)
+
+                # the entity moved, so update its location in the broadphase
+                self._refresh_broadphase_entry(eA)
+
+                if self._pool_hits is None:
+                    self._collide_with_candidates(eA, broadphase, batch)
+
+                else:
+                    if not self._collide_pool_hits(eA, broadphase):
+                        self._collide_with_candidates(eA, broadphase)
+                    self._check_pool_expectation(eA)
+
+        self._pool_hits = None
+        self._pool_moved.clear()
+        self._pool_moved_entities.clear()
+
+    def _get_broadphase(self):
+
+        tag = self.world.broadphase_tag
+        cell_size = self.world.broadphase_cell_size
+
+        if tag is None:
+            self.broadphase = None
+
+        # (re)create the broadphase if the world settings changed
+        elif self.broadphase is None or self.broadphase.tag != tag or \
+                (tag == SpatialHash.tag and self.broadphase.cell_size != cell_size):
+
+            if tag == SpatialHash.tag:
+                self.broadphase = SpatialHash(cell_size)
+
+            elif tag == SweepAndPrune.tag:
+                self.broadphase = SweepAndPrune()
+
+            else:
+                print("Error. Unknown broadphase: " + str(tag))
+                self.broadphase = None
+
+            self._broadphase_entities.clear()
+
+        return self.broadphase
+
+    # Create the structures of the collision backend selected by the world
+    def _update_collision_backend(self):
+
+        tag = self.world.collision_backend
+
+        if tag != BoxBatch.tag:
+            self.box_batch = None
+
+        if tag != PairPool.tag and self.pair_pool is not None:
+            self.pair_pool.close()
+            self.pair_pool = None
+
+        if tag is None:
+            return
+
+        if tag == BoxBatch.tag:
+
+            if not collision_kernel.is_available():
+                print("Error. NumPy is not installed, collisions are tested pair by pair.")
+                self.world.collision_backend = None
+
+            elif self.box_batch is None:
+                self.box_batch = BoxBatch()
+
+        elif tag == PairPool.tag:
+
+            if not collision_pool.is_available():
+                print("Error. The process pool needs Python 3.7, collisions are tested in this process.")
+                self.world.collision_backend = None
+
+            elif self.pair_pool is None:
+                self.pair_pool = PairPool(self.pool_workers)
+
+        else:
+            print("Error. Unknown collision backend: " + str(tag))
+            self.world.collision_backend = None
+
+    # Create the contact solver selected by the world
+    def _update_contact_solver(self):
+
+        tag = self.world.contact_solver
+
+        if tag is None:
+            self.solver = None
+
+        elif tag == ImpulseSolver.tag:
+            self.solver = ImpulseSolver()
+
+        else:
+            print("Error. Unknown contact solver: " + str(tag))
+            self.world.contact_solver = None
+            self.solver = None
+
+    # Give the solver the contacts of the last step that still touch, unless a script changed
+    # the colliders so that they no longer collide
+    def _add_touching_contacts(self):
+
+        for eA, eB in list(self.solver.touching.values()):
+
+            collider_a = eA.collider
+            collider_b = eB.collider
+
+            if eA.disabled or eB.disabled or collider_a is None or collider_b is None:
+                continue
+
+            if collider_a.is_trigger or collider_b.is_trigger or not self._layers_collide(collider_a, collider_b):
+                continue
+
+            self.solver.add_contact(eA, eB)
+
+    # Test a box against every other entity using the box batch. Only the entities whose boxes
+    # overlap it (and the ones that are not boxes) go through the narrow phase, in the same
+    # order as the brute force loop.
+    def _collide_batch(self, index, eA, entities, batch):
+
+        # a script added or removed entities during the step
+        if len(entities) != batch.size:
+            batch.pack(entities)
+
+        batch.update(index, eA)
+        rows = batch.overlapping(index)
+
+        k = 0
+        while k < len(rows):
+
+            j = rows[k]
+            k += 1
+
+            eB = entities[j]
+            if eB.disabled or eB.collider is None:
+                continue
+
+            if self._collide_pair(eA, eB):
+
+                if eA.collider is None:
+                    return
+
+                # A script added or removed entities. Like the brute force loop, carry on from
+                # the position after eB in the changed list.
+                if len(entities) != batch.size:
+                    batch.pack(entities)
+                    index = PhysicsSystem._find_index(entities, eA)
+
+                    # eA was removed, so it has no row to test with
+                    if index < 0:
+                        self._collide_rest(eA, entities, j + 1)
+                        return
+
+                # the collision response or the scripts may have moved the entities
+                else:
+                    batch.update(index, eA)
+                    batch.update(j, eB)
+
+                # test again since the box moved, starting after eB
+                rows = batch.overlapping(index, start=j + 1)
+                k = 0
+
+    # test an entity against the entities from the start index onwards, pair by pair
+    def _collide_rest(self, eA, entities, start):
+
+        p = start
+        while p < len(entities):
+
+            eB = entities[p]
+            p += 1
+
+            if eB.disabled:
+                continue
+
+            if eB.collider is not None and eA is not eB:
+                self._collide_pair(eA, eB)
+
+    @staticmethod
+    def _find_index(entities, entity):
+        for i in range(len(entities)):
+            if entities[i] is entity:
+                return i
+        return -1
+
+    # Keep only the candidates whose boxes overlap the entity's box or that are not boxes.
+    def _filter_candidates(self, eA, candidates, batch):
+
+        if not candidates or eA.collider.tag != BoxCollider.tag:
+            return candidates
+
+        order = self._entity_order
+        index = order.get(eA.uuid)
+        if index is None:
+            return candidates
+
+        batch.update(index, eA, self._static_boxes)
+
+        rows = [order.get(eB.uuid) for eB in candidates]
+
+        # a candidate was removed during the step, test them all
+        if None in rows:
+            return candidates
+
+        by_row = dict(zip(rows, candidates))
+
+        return [by_row[row] for row in batch.overlapping(index, rows)]
+
+    # Static colliders are the ones that are not moved by the physics system. These are kept in
+    # the static tree while the dynamic ones are kept in the broadphase.
+    @staticmethod
+    def _is_static(entity):
+        return entity.collider is not None and not PhysicsSystem._is_dynamic(entity)
+
+    # Build the tree of static colliders. The world calls this once its scene has been loaded.
+    def build_static_tree(self, entities):
+
+        static_entities = self._static_entities
+        static_entities.clear()
+        self._static_boxes.clear()
+
+        items = list()
+        for e in entities:
+            if not e.disabled and PhysicsSystem._is_static(e):
+                static_entities[e.uuid] = e
+                items.append((e.uuid, PhysicsSystem.get_aabb(e)))
+                self._place_static_collider(e)
+
+        self.static_tree.build(items)
+
+    # Static colliders are only offset relative to their transforms when they are placed or moved,
+    # instead of at every pair test.
+    def _place_static_collider(self, entity):
+        collider = entity.collider
+        if collider.tag == BoxCollider.tag:
+            get_relative_rect_pos(entity.transform.position, collider)
+            self._static_boxes[entity.uuid] = collider.box
+
+    # Insert every collider into the broadphase or the static tree, move the ones that changed
+    # location and remove the ones that no longer exist. This also records the order of the
+    # entities so the candidates are tested in the same order as the brute force approach.
+    def _sync_broadphase(self, entities, broadphase):
+
+        order = self._entity_order
+        order.clear()
+
+        tracked = self._broadphase_entities
+        static_entities = self._static_entities
+
+        i = 0
+        for e in entities:
+            if not e.disabled and e.collider is not None:
+                order[e.uuid] = i
+                self._update_entry(e)
+            i += 1
+
+        # remove the entities that were destroyed, disabled, or lost their collider
+        if len(tracked) + len(static_entities) != len(order):
+            for key in list(tracked.keys()):
+                if key not in order:
+                    broadphase.remove(key)
+                    del tracked[key]
+
+            for key in list(static_entities.keys()):
+                if key not in order:
+                    self.static_tree.remove(key)
+                    del static_entities[key]
+                    self._static_boxes.pop(key, None)
+
+    # Insert or move the entity in the structure that it belongs to. Entities are moved between
+    # the broadphase and the static tree if they stopped or started being dynamic.
+    def _update_entry(self, entity):
+
+        key = entity.uuid
+        aabb = PhysicsSystem.get_aabb(entity)
+
+        # the tolerance hit box may reach past the box in the broadphase
+        collider = entity.collider
+        if collider.tag == BoxCollider.tag:
+            margin = max(collider.tolerance_hitbox.width - collider.box.width,
+                         collider.tolerance_hitbox.height - collider.box.height) // 2 + 1
+            if margin > self.tolerance_margin:
+                self.tolerance_margin = margin
+
+        if PhysicsSystem._is_dynamic(entity):
+
+            if key in self._static_entities:
+                self.static_tree.remove(key)
+                del self._static_entities[key]
+                self._static_boxes.pop(key, None)
+
+            self._broadphase_entities[key] = entity
+            self.broadphase.update(key, aabb)
+
+        else:
+
+            if key in self._broadphase_entities:
+                self.broadphase.remove(key)
+                del self._broadphase_entities[key]
+
+            self._static_entities[key] = entity
+
+            # A script moved a static collider (or it was just added). The tree is refit lazily.
+            # The box is also re-offset if a script replaced it.
+            moved = self.static_tree.update(key, aabb)
+            if moved or self._static_boxes.get(key) is not entity.collider.box:
+                self._place_static_collider(entity)
+
+    # update the location of an entity that was moved during the physics step
+    def _refresh_broadphase_entry(self, entity):
+
+        key = entity.uuid
+
+        # make sure the entity was not destroyed during a collision event
+        if self._broadphase_entities.get(key) is not entity and self._static_entities.get(key) is not entity:
+            return
+
+        if entity.collider is None:
+            return
+
+        self._update_entry(entity)
+
+    # Remove an entity from the broadphase. The world calls this when it destroys an entity.
+    def remove_from_broadphase(self, entity):
+
+        key = entity.uuid
+        if self._broadphase_entities.get(key) is entity:
+            del self._broadphase_entities[key]
+            self._entity_order.pop(key, None)
+
+            if self.broadphase is not None:
+                self.broadphase.remove(key)
+
+        elif self._static_entities.get(key) is entity:
+            del self._static_entities[key]
+            self._static_boxes.pop(key, None)
+            self._entity_order.pop(key, None)
+            self.static_tree.remove(key)
+
+    # find the entities near the box sorted in the order that they exist in the world
+    def _get_candidates(self, aabb, broadphase, after=-1):
+
+        order = self._entity_order
+        tracked = self._broadphase_entities
+        static_entities = self._static_entities
+
+        keys = [key for key in broadphase.query(aabb) if order.get(key, -1) > after]
+        keys.extend([key for key in self.static_tree.query(aabb) if order.get(key, -1) > after])
+        keys.sort(key=order.get)
+
+        return [tracked[key] if key in tracked else static_entities[key] for key in keys]
+
+    # Test an entity against the candidates from the broadphase. Only the candidates that come
+    # after the given order in the world are tested.
+    def _collide_with_candidates(self, eA, broadphase, batch=None, after=-1):
+
+        # the region that the candidates were gathered from
+        region = PhysicsSystem._pad_aabb(PhysicsSystem.get_aabb(eA), PhysicsSystem.broadphase_margin)
+
+        candidates = self._get_candidates(region, broadphase, after)
+
+        if self._profile is not None:
+            self._profile.candidates += len(candidates)
+
+        # The candidates before filtering. They are filtered again whenever the entity moves.
+        gathered = candidates
+        if batch is not None:
+            candidates = self._filter_candidates(eA, gathered, batch)
+
+        static_entities = self._static_entities
+
+        i = 0
+        while i < len(candidates):
+
+            eB = candidates[i]
+            i += 1
+
+            if eB is eA or eB.disabled or eB.collider is None:
+                continue
+
+            # static colliders are already placed relative to their transforms
+            b_is_static = static_entities.get(eB.uuid) is eB
+
+            if self._collide_pair(eA, eB, b_is_static):
+
+                # the collision response or the scripts may have moved the entities
+                self._refresh_broadphase_entry(eA)
+                self._refresh_broadphase_entry(eB)
+
+                if eA.collider is None:
+                    return
+
+                # If the entity was pushed outside of the region that the candidates were
+                # gathered from then gather them again. Only the entities that come after
+                # eB are taken since the rest were already tested.
+                aabb = PhysicsSystem.get_aabb(eA)
+                if not aabb_contains(region, aabb):
+                    region = PhysicsSystem._pad_aabb(aabb, PhysicsSystem.broadphase_margin)
+                    candidates = self._get_candidates(region, broadphase, self._entity_order.get(eB.uuid, -1))
+                    i = 0
+
+                    if self._profile is not None:
+                        self._profile.candidates += len(candidates)
+
+                    gathered = candidates
+
+                # The candidates were filtered with the old box, so filter the ones that come
+                # after eB again.
+                elif batch is not None:
+                    gathered = gathered[PhysicsSystem._find_index(gathered, eB) + 1:]
+
+                if batch is not None:
+                    order = self._entity_order
+                    if eB.uuid in order:
+                        batch.update(order[eB.uuid], eB, self._static_boxes)
+                    candidates = self._filter_candidates(eA, gathered, batch)
+                    i = 0
+
+    # Write the colliders and the candidate pairs of the step to the pool and test them in the worker
+    # processes. Every awake dynamic entity is expected to be tested at the position that it is
+    # integrated to, against the other colliders where they are when its turn comes: their end
+    # position if they come before it in the world and their start position otherwise.
+    # Does nothing if there are not enough pairs to be worth it.
+    def _test_pairs_in_pool(self, entities, broadphase):
+
+        if self._pool_pairs < self.pool_min_pairs and self.frame % self.pool_check_steps != 0:
+            return
+
+        pool = self.pair_pool
+        order = self._entity_order
+        dt = self.fixed_time_step
+
+        # entity a, its end position and the region where its candidates are
+        movers = list()
+
+        # the candidates are in the broadphase at their start position, so they are gathered from
+        # a region padded by the longest motion of the step
+        max_motion = 0.0
+
+        for e in entities:
+            if e.disabled or e.uuid not in order or not PhysicsSystem._is_dynamic(e):
+                continue
+
+            rigid_body = e.rigid_body
+            position = e.transform.position
+
+            if rigid_body is None:
+                movers.append((e, position.x, position.y))
+
+            elif not rigid_body.sleeping:
+                # the same as _integrate_motion
+                motion = dt * rigid_body.velocity
+                movers.append((e, position.x + motion.x, position.y + motion.y))
+                max_motion = max(max_motion, abs(motion.x), abs(motion.y))
+
+        candidates = list()
+        count = 0
+        for eA, x, y in movers:
+            position = eA.transform.position
+            aabb = PhysicsSystem._pad_aabb(PhysicsSystem.get_aabb(eA), max_motion)
+            aabb = (aabb[0] + x - position.x, aabb[1] + y - position.y, aabb[2] + x - position.x, aabb[3] + y - position.y)
+
+            others = [eB for eB in self._get_candidates(aabb, broadphase) if eB is not eA]
+            candidates.append(others)
+            count += len(others)
+
+        self._pool_pairs = count
+        if count < self.pool_min_pairs:
+            return
+
+        if self._profile is not None:
+            self._profile.candidates += count
+            self._profile.pool_tests += count
+
+        pool.reserve(len(entities), count)
+
+        moved = dict()
+        for eA, x, y in movers:
+            moved[eA.uuid] = (x, y)
+
+        for e in entities:
+            if e.uuid in order:
+                end = moved.get(e.uuid)
+                if end is None:
+                    pool.set_row(order[e.uuid], e)
+                else:
+                    pool.set_row(order[e.uuid], e, end[0], end[1])
+
+        p = 0
+        for k in range(len(movers)):
+            eA = movers[k][0]
+            row_a = order[eA.uuid]
+
+            for eB in candidates[k]:
+                row_b = order[eB.uuid]
+                pool.set_pair(p, row_a, row_b, row_b < row_a and eB.uuid in moved)
+                p += 1
+
+        hits = dict()
+        for eA, x, y in movers:
+            hits[eA.uuid] = (x, y, list())
+
+        # the pairs of each entity are contiguous, so the hits stay in the order of the world
+        k = 0
+        first = 0
+        for pair, side in pool.run(count):
+
+            while pair >= first + len(candidates[k]):
+                first += len(candidates[k])
+                k += 1
+
+            if side == collision_pool.UNKNOWN:
+                side = None
+
+            hits[movers[k][0].uuid][2].append((candidates[k][pair - first], side))
+
+        self._pool_hits = hits
+
+    # Respond to the hits that the pool found for an entity. Returns False if the entity was
+    # not moved as expected, in which case its pairs have to be tested in this process.
+    def _collide_pool_hits(self, eA, broadphase):
+
+        expected = self._pool_hits.get(eA.uuid)
+        if expected is None:
+            return False
+
+        x, y, hits = expected
+        position = eA.transform.position
+        if position.x != x or position.y != y:
+            return False
+
+        # The colliders that moved differently than expected were tested at the wrong location,
+        # so they are tested again.
+        tests = hits
+        if self._pool_moved_entities:
+            region = PhysicsSystem._pad_aabb(PhysicsSystem.get_aabb(eA), PhysicsSystem.broadphase_margin)
+            moved = [self._pool_moved_entities[key] for key in self._pool_moved.query(region)]
+
+            if moved:
+                order = self._entity_order
+                tests = [hit for hit in hits if hit[0].uuid not in self._pool_moved_entities]
+                tests.extend([(eB, None) for eB in moved if eB is not eA and eB.uuid in order])
+                tests.sort(key=lambda hit: order[hit[0].uuid])
+
+        static_entities = self._static_entities
+
+        for eB, side in tests:
+
+            if eB.disabled or eB.collider is None:
+                continue
+
+            b_is_static = static_entities.get(eB.uuid) is eB
+
+            if self._collide_pair(eA, eB, b_is_static, side):
+
+                self._refresh_broadphase_entry(eA)
+                self._refresh_broadphase_entry(eB)
+                self._note_pool_moved(eB)
+
+                if eA.collider is None:
+                    return True
+
+                # the entity was pushed, so the rest of its pairs are tested in this process
+                self._collide_with_candidates(eA, broadphase, after=self._entity_order.get(eB.uuid, -1))
+                return True
+
+        return True
+
+    # Remember that an entity may not be where the pool expected it during the rest of the step
+    def _note_pool_moved(self, entity):
+        if entity.collider is not None and not entity.disabled:
+            self._pool_moved_entities[entity.uuid] = entity
+            self._pool_moved.update(entity.uuid, PhysicsSystem.get_aabb(entity))
+
+    # After an entity's turn, check that it ended where the pool expected it to be
+    def _check_pool_expectation(self, entity):
+
+        if self._pool_hits is None:
+            return
+
+        expected = self._pool_hits.get(entity.uuid)
+        position = entity.transform.position
+
+        if expected is None or position.x != expected[0] or position.y != expected[1] or \
+                entity.uuid in self._pool_moved_entities:
+            self._note_pool_moved(entity)
+
+    # Test if two colliders are on layers that can collide with each other. Both colliders must
+    # accept the other's layer and so must the world's layer matrix.
+    def _layers_collide(self, collider_a, collider_b):
+
+        category_a = collider_a.category
+        category_b = collider_b.category
+
+        if not (category_a & collider_b.mask and category_b & collider_a.mask):
+            return False
+
+        matrix = self.world.layer_matrix
+        if matrix:
+            all_layers = Collider.all_layers
+            if not (matrix.get(category_a, all_layers) & category_b and matrix.get(category_b, all_layers) & category_a):
+                return False
+
+        return True
+
+    # Obtain the axis aligned bounding box (left, top, right, bottom) of an entity's collider
+    # relative to its transform. It is padded by a pixel since the collision boxes are integer rects.
+    @staticmethod
+    def get_aabb(entity):
+
+        position = entity.transform.position
+        collider = entity.collider
+
+        if collider.tag == CircleCollider.tag:
+            r = collider.radius
+            return position.x - r - 1, position.y - r - 1, position.x + r + 1, position.y + r + 1
+
+        half_w = collider.box.width / 2.0
+        half_h = collider.box.height / 2.0
+        x = position.x + collider.offset.x
+        y = position.y + collider.offset.y
+
+        return x - half_w - 1, y - half_h - 1, x + half_w + 1, y + half_h + 1
+
+    @staticmethod
+    def _pad_aabb(aabb, pad):
+        return aabb[0] - pad, aabb[1] - pad, aabb[2] + pad, aabb[3] + pad
+
+    # Run the narrow phase between two entities, apply the collision response and notify
+    # the scripts. Returns True if the entities collided.
+    # If b is static then its collision box is expected to be already offset to its transform.
+    # The side of the hit between two boxes can be given if it is already known.
+    def _collide_pair(self, eA, eB, b_is_static=False, side=None):
+
+        transform_a = eA.transform
+        collider_a = eA.collider
+        rigid_body_a = eA.rigid_body
+
+        transform_b = eB.transform
+        collider_b = eB.collider
+
+        # colliders on layers that do not interact are never tested
+        if not self._layers_collide(collider_a, collider_b):
+            return False
+
+        profile = self._profile
+        if profile is not None:
+            profile.narrow_tests += 1
+
+        collision_occurred = False
+
+        # A flag to tell the physics systems not to apply physics or collision
+        # resolution on the entity if this collider collides with another collider.
+        b_isnt_trigger = not collider_b.is_trigger
+
+        # box to box collision
+        if collider_a.tag == BoxCollider.tag and collider_b.tag == BoxCollider.tag:
+
+            # offset the collision boxes relative to their transform positions
+            get_relative_rect_pos(transform_a.position, collider_a)
+            if not b_is_static:
+                get_relative_rect_pos(transform_b.position, collider_b)
+
+            # check for collision
+            if collider_a.box.colliderect(collider_b.box):
+                collision_occurred = True
+
+                if rigid_body_a is not None and b_isnt_trigger:
+                    if profile is not None:
+                        profile.responses += 1
+
+                    if self.solver is not None and rigid_body_a.use_contact_solver:
+                        self.solver.add_contact(eA, eB)
+                    else:
+                        PhysicsSystem.box2box_response(collider_a, collider_b, side)
+
+        # circle to circle collision
+        elif collider_a.tag == CircleCollider.tag and collider_b.tag == CircleCollider.tag:
+
+            # check if circles collided
+            if PhysicsSystem._circle2circle_collision(collider_a, collider_b):
+                collision_occurred = True
+
+                if rigid_body_a is not None and b_isnt_trigger:
+                    if profile is not None:
+                        profile.responses += 1
+
+                    if self.solver is not None and rigid_body_a.use_contact_solver:
+                        self.solver.add_contact(eA, eB)
+                    else:
+                        PhysicsSystem.circle2circle_response(collider_a, collider_b)
+
+        # circle to box
+        elif collider_a.tag == CircleCollider.tag and collider_b.tag == BoxCollider.tag:
+
+            # Get the relative collision box position to its transform.
+            if not b_is_static:
+                get_relative_rect_pos(transform_b.position, collider_b)
+
+            # check for collision
+            if PhysicsSystem._circle2box_collision(collider_a, collider_b):
+                collision_occurred = True
+
+                # the circle is treated as a box in the collision response
+                if rigid_body_a is not None and b_isnt_trigger:
+                    if profile is not None:
+                        profile.responses += 1
+
+                    if self.solver is not None and rigid_body_a.use_contact_solver:
+                        self.solver.add_contact(eA, eB)
+                    else:
+                        PhysicsSystem.box2box_response(PhysicsSystem._get_circle_proxy(collider_a), collider_b)
+
+        if collision_occurred:
+            # add collision event into the queue
+            PhysicsSystem.collision_queue.append((eA, eB))
+
+            if profile is not None:
+                profile.collisions += 1
+
+            # an awake body ran into a sleeping one
+            if eB.rigid_body is not None and eB.rigid_body.sleeping:
+                self.wake(eB)
+
+            # trigger the collision enter or stay events
+            self._touch_contact(eA, eB)
+
+            # call the collision inside the scripts
+            for s in eA.scripts:
+                if s.collision_mask & collider_b.category:
+                    PhysicsSystem._call_script(profile, s, s.collision_event, collider_b)
+
+            for s in eB.scripts:
+                if s.collision_mask & collider_a.category:
+                    PhysicsSystem._call_script(profile, s, s.collision_event, collider_a)
+
+            # Scripts can move any entity, so the rest of the step is tested in this process
+            if self._pool_hits is not None and (eA.scripts or eB.scripts):
+                self._pool_hits = None
+
+        return collision_occurred
+
+    # Record that the entities are touching during this frame. The first time that a pair
+    # touches during a frame, the scripts get a collision enter event if the pair was not
+    # touching before or a collision stay event otherwise.
+    def _touch_contact(self, eA, eB):
+
+        if eA.uuid < eB.uuid:
+            key = (eA.uuid, eB.uuid)
+        else:
+            key = (eB.uuid, eA.uuid)
+
+        contact = self.contacts.get(key)
+
+        # the ids of destroyed entities are recycled, so make sure it is the same pair
+        if contact is not None and (contact.get_other(eA) is not eB or contact.get_other(eB) is not eA):
+            self._remove_contact(key, contact)
+            contact = None
+
+        if contact is None:
+            contact = Contact(eA, eB, self.frame)
+            self.contacts[key] = contact
+            self._entity_contacts.setdefault(eA.uuid, dict())[eB.uuid] = contact
+            self._entity_contacts.setdefault(eB.uuid, dict())[eA.uuid] = contact
+
+            for s in eA.scripts:
+                if s.collision_mask & eB.collider.category:
+                    PhysicsSystem._call_script(self._profile, s, s.collision_enter_event, eB.collider)
+
+            for s in eB.scripts:
+                if s.collision_mask & eA.collider.category:
+                    PhysicsSystem._call_script(self._profile, s, s.collision_enter_event, eA.collider)
+
+        # already touched during this frame
+        elif contact.last_frame == self.frame:
+            return
+
+        else:
+            contact.last_frame = self.frame
+            contact.collider_a = contact.entity_a.collider
+            contact.collider_b = contact.entity_b.collider
+
+            for s in eA.scripts:
+                if s.collision_mask & eB.collider.category:
+                    PhysicsSystem._call_script(self._profile, s, s.collision_stay_event, eB.collider)
+
+            for s in eB.scripts:
+                if s.collision_mask & eA.collider.category:
+                    PhysicsSystem._call_script(self._profile, s, s.collision_stay_event, eA.collider)
+
+    def _remove_contact(self, key, contact):
+
+        del self.contacts[key]
+
+        for entity, other in ((contact.entity_a, contact.entity_b), (contact.entity_b, contact.entity_a)):
+            entity_contacts = self._entity_contacts.get(entity.uuid)
+            if entity_contacts is not None and entity_contacts.get(other.uuid) is contact:
+                del entity_contacts[other.uuid]
+                if not entity_contacts:
+                    del self._entity_contacts[entity.uuid]
+
+    # An exit event means that an entity is no longer colliding with another. These are the
+    # contacts that were not touched during this frame.
+    def _end_contacts(self):
+
+        frame = self.frame
+        ended = [item for item in self.contacts.items() if item[1].last_frame != frame]
+
+        # Contacts where no side looked for collisions are kept as they were. This keeps a
+        # sleeping body touching whatever it is resting on.
+        is_resting = PhysicsSystem._is_resting
+        ended = [item for item in ended if not (is_resting(item[1].entity_a) and is_resting(item[1].entity_b))]
+
+        for key, contact in ended:
+
+            # a script may have already removed it
+            if self.contacts.get(key) is not contact:
+                continue
+
+            self._remove_contact(key, contact)
+            PhysicsSystem._dispatch_exit(contact, self._profile)
+
+    # test if an entity does not look for collisions because it is sleeping or static
+    @staticmethod
+    def _is_resting(entity):
+        if entity.disabled or entity.collider is None:
+            return False
+        rigid_body = entity.rigid_body
+        return not PhysicsSystem._is_dynamic(entity) or (rigid_body is not None and rigid_body.sleeping)
+
+    # Count the steps that the body has been resting. Returns True once it rested for enough of them.
+    def _update_sleep_counter(self, entity):
+
+        rigid_body = entity.rigid_body
+        position = entity.transform.position
+        anchor = rigid_body.sleep_anchor
+
+        if rigid_body.sleep_counter == 0 or anchor is None:
+            anchor = rigid_body.sleep_anchor = Vector2(position.x, position.y)
+
+        epsilon = PhysicsSystem.ignore_velocity_epsilon
+        distance = PhysicsSystem.sleep_distance
+
+        if rigid_body.velocity.sq_magnitude() < epsilon * epsilon or \
+                (abs(position.x - anchor.x) <= distance and abs(position.y - anchor.y) <= distance):
+
+            rigid_body.sleep_counter += 1
+            return rigid_body.sleep_counter >= PhysicsSystem.sleep_steps
+
+        rigid_body.sleep_counter = 0
+        return False
+
+    # Put the resting bodies (uuid -> entity) to sleep. The bodies of an island of the contact
+    # solver only sleep together, once all of them are resting. A body of the island that went
+    # to sleep on its own would be woken up again by the others still settling against it.
+    def _put_resting_to_sleep(self, resting):
+
+        if self.solver is not None:
+            for island in self.solver.islands:
+                if not all([e.uuid in resting for e in island]):
+                    for e in island:
+                        resting.pop(e.uuid, None)
+
+        for e in resting.values():
+            self._put_to_sleep(e)
+
+    def _put_to_sleep(self, entity):
+
+        rigid_body = entity.rigid_body
+        position = entity.transform.position
+
+        rigid_body.sleeping = True
+        rigid_body.velocity.x = 0.0
+        rigid_body.velocity.y = 0.0
+
+        # remember the state of the body to detect when a script changes it
+        rigid_body.sleep_position = Vector2(position.x, position.y)
+        rigid_body.sleep_gravity_scale = rigid_body.gravity_scale
+
+        # The body is woken if something it is resting on moves
+        rigid_body.sleep_contacts = [(other, other.transform.position.x, other.transform.position.y)
+                                     for other in self._get_nearby_colliders(entity)]
+
+        rigid_body.previous_position = Vector2(position.x, position.y)
+        rigid_body.step_position = Vector2(position.x, position.y)
+
+        self._sleeping[entity.uuid] = entity
+
+    # Find the colliders close to an entity's collider. A resting body is not always overlapping
+    # what it rests on, so this pads the collider by the sleep distance.
+    def _get_nearby_colliders(self, entity):
+
+        aabb = PhysicsSystem._pad_aabb(PhysicsSystem.get_aabb(entity), PhysicsSystem.sleep_distance + 1)
+
+        if self.broadphase is not None:
+            nearby = [self._broadphase_entities[key] for key in self.broadphase.query(aabb)]
+            nearby.extend([self._static_entities[key] for key in self.static_tree.query(aabb)])
+
+        else:
+            nearby = [e for e in self.world.entity_manager.entities
+                      if not e.disabled and e.collider is not None and aabb_overlap(aabb, PhysicsSystem.get_aabb(e))]
+
+        return [e for e in nearby if e is not entity]
+
+    # Wake up a sleeping rigid body. Scripts can call this to force a body to be simulated.
+    def wake(self, entity):
+
+        if self._sleeping.get(entity.uuid) is entity:
+            del self._sleeping[entity.uuid]
+
+        rigid_body = entity.rigid_body
+        if rigid_body is not None:
+            rigid_body.sleeping = False
+            rigid_body.sleep_counter = 0
+            rigid_body.sleep_contacts = None
+
+    # Wake the sleeping bodies whose velocity or gravity was changed by a script, that were
+    # moved (teleported) or whose resting contacts moved.
+    def _check_sleeping_bodies(self):
+
+        for entity in list(self._sleeping.values()):
+
+            rigid_body = entity.rigid_body
+
+            # the rigid body was removed or replaced
+            if rigid_body is None or not rigid_body.sleeping:
+                self.wake(entity)
+                continue
+
+            velocity = rigid_body.velocity
+            position = entity.transform.position
+            sleep_position = rigid_body.sleep_position
+
+            disturbed = velocity.x != 0 or velocity.y != 0 or \
+                position.x != sleep_position.x or position.y != sleep_position.y or \
+                rigid_body.gravity_scale != rigid_body.sleep_gravity_scale
+
+            if not disturbed:
+                for other, x, y in rigid_body.sleep_contacts:
+                    other_position = other.transform.position
+                    if other.disabled or other_position.x != x or other_position.y != y:
+                        disturbed = True
+                        break
+
+            if disturbed:
+                self.wake(entity)
+
+    # Call the collision event of a script, timing it when the step is profiled
+    @staticmethod
+    def _call_script(profile, script, event, collider):
+
+        if profile is None:
+            event(collider)
+        else:
+            PhysicsProfiler.time_event(profile, script, event, collider)
+
+    @staticmethod
+    def _dispatch_exit(contact, profile=None):
+
+        for s in contact.entity_a.scripts:
+            if s.collision_mask & contact.collider_b.category:
+                PhysicsSystem._call_script(profile, s, s.collision_exit_event, contact.collider_b)
+
+        for s in contact.entity_b.scripts:
+            if s.collision_mask & contact.collider_a.category:
+                PhysicsSystem._call_script(profile, s, s.collision_exit_event, contact.collider_a)
+
+    # Remove the contacts of an entity. The entities that it was touching get a collision
+    # exit event. The world calls this when it destroys an entity.
+    def remove_contacts(self, entity):
+
+        entity_contacts = self._entity_contacts.get(entity.uuid)
+        if entity_contacts is None:
+            return
+
+        for contact in list(entity_contacts.values()):
+            if contact.entity_a is not entity and contact.entity_b is not entity:
+                continue
+
+            a = contact.entity_a.uuid
+            b = contact.entity_b.uuid
+            self._remove_contact((min(a, b), max(a, b)), contact)
+
+            other = contact.get_other(entity)
+            if other is contact.entity_a:
+                other_collider = contact.collider_b
+            else:
+                other_collider = contact.collider_a
+
+            for s in other.scripts:
+                if s.collision_mask & other_collider.category:
+                    s.collision_exit_event(other_collider)
+
+    # get the entities that are touching the given entity
+    def get_contacts(self, entity):
+
+        entity_contacts = self._entity_contacts.get(entity.uuid)
+        if entity_contacts is None:
+            return []
+
+        return [contact.get_other(entity) for contact in entity_contacts.values()
+                if contact.entity_a is entity or contact.entity_b is entity]
+
+    # test if the colliders of two entities are touching
+    def is_touching(self, entity_a, entity_b):
+
+        entity_contacts = self._entity_contacts.get(entity_a.uuid)
+        if entity_contacts is None:
+            return False
+
+        contact = entity_contacts.get(entity_b.uuid)
+        return contact is not None and contact.get_other(entity_a) is entity_b and contact.get_other(entity_b) is entity_a
+
+    # Find the entities that may be inside the (left, top, right, bottom) box. The broadphase and
+    # the static tree hold the colliders where they were during the last physics step, so entities
+    # created or moved by scripts since then are found at their old location. Without a broadphase
+    # every entity of the world is a candidate.
+    def _get_query_candidates(self, aabb):
+
+        if self.broadphase is None:
+            return [e for e in self.world.entity_manager.entities if not e.disabled and e.collider is not None]
+
+        return self._get_candidates(aabb, self.broadphase)
+
+    # test if an entity has the tag and is in one of the layers
+    @staticmethod
+    def _query_accepts(entity, tag, layers):
+
+        collider = entity.collider
+        if entity.disabled or collider is None:
+            return False
+
+        return (tag is None or entity.tag == tag) and collider.category & layers
+
+    # test if a circle overlaps a rect, the same way as _circle2box_collision
+    @staticmethod
+    def _circle_overlaps_rect(x, y, radius, rect):
+
+        # closest point on the rect to the center of the circle
+        x_closest = min(max(x, rect.left), rect.right)
+        y_closest = min(max(y, rect.top), rect.bottom)
+
+        dx = x_closest - x
+        dy = y_closest - y
+
+        return dx * dx + dy * dy < radius * radius
+
+    # Get the entities whose colliders overlap the rect, in the order they exist in the world.
+    # Only the entities with the tag (if given) and in the layers are returned.
+    def query_aabb(self, rect, tag=None, layers=Collider.all_layers):
+
+        aabb = (rect.left, rect.top, rect.right, rect.bottom)
+
+        result = list()
+        for e in self._get_query_candidates(aabb):
+
+            if not PhysicsSystem._query_accepts(e, tag, layers):
+                continue
+
+            collider = e.collider
+            position = e.transform.position
+
+            if collider.tag == CircleCollider.tag:
+                if PhysicsSystem._circle_overlaps_rect(position.x, position.y, collider.radius, rect):
+                    result.append(e)
+
+            else:
+                get_relative_rect_pos(position, collider)
+                if rect.colliderect(collider.box):
+                    result.append(e)
+
+        return result
+
+    # Get the entities whose tolerance hit boxes overlap the tolerance hit box of an entity, such
+    # as the ground under a resting body. Only box colliders have tolerance hit boxes. The result
+    # is kept until the physics runs again, so asking again during a frame does not re-test.
+    def get_near(self, entity, tag=None, layers=Collider.all_layers):
+
+        collider = entity.collider
+        if entity.disabled or collider is None or collider.tag != BoxCollider.tag:
+            return []
+
+        position = entity.transform.position
+
+        cached = self._near_cache.get(entity.uuid)
+        if cached is None or cached[0] is not entity or cached[1] != position.x or cached[2] != position.y:
+
+            rect = PhysicsSystem._place_tolerance_box(collider, Rect(0, 0, 0, 0))
+
+            # the other tolerance hit boxes reach at most the margin past the boxes in the broadphase
+            margin = self.tolerance_margin
+            reach = rect.inflate(2 * margin, 2 * margin)
+
+            near = list()
+            for e in self._get_query_candidates((reach.left, reach.top, reach.right, reach.bottom)):
+
+                other = e.collider
+                if e is entity or e.disabled or other is None or other.tag != BoxCollider.tag:
+                    continue
+
+                if rect.colliderect(PhysicsSystem._place_tolerance_box(other, PhysicsSystem._tolerance_rect_b)):
+                    near.append(e)
+
+            cached = (entity, position.x, position.y, near)
+            self._near_cache[entity.uuid] = cached
+
+        return [e for e in cached[3] if PhysicsSystem._query_accepts(e, tag, layers)]
+
+    # Get the entities whose colliders contain the point
+    def query_point(self, point, tag=None, layers=Collider.all_layers):
+
+        x = point.x
+        y = point.y
+
+        result = list()
+        for e in self._get_query_candidates((x, y, x, y)):
+
+            if not PhysicsSystem._query_accepts(e, tag, layers):
+                continue
+
+            collider = e.collider
+            position = e.transform.position
+
+            if collider.tag == CircleCollider.tag:
+                dx = x - position.x
+                dy = y - position.y
+                if dx * dx + dy * dy < collider.radius * collider.radius:
+                    result.append(e)
+
+            else:
+                get_relative_rect_pos(position, collider)
+                if collider.box.collidepoint(x, y):
+                    result.append(e)
+
+        return result
+
+    # Get the entities whose colliders overlap the circle
+    def query_circle(self, center, radius, tag=None, layers=Collider.all_layers):
+
+        x = center.x
+        y = center.y
+
+        result = list()
+        for e in self._get_query_candidates((x - radius, y - radius, x + radius, y + radius)):
+
+            if not PhysicsSystem._query_accepts(e, tag, layers):
+                continue
+
+            collider = e.collider
+            position = e.transform.position
+
+            if collider.tag == CircleCollider.tag:
+                dx = x - position.x
+                dy = y - position.y
+                r = radius + collider.radius
+                if dx * dx + dy * dy < r * r:
+                    result.append(e)
+
+            else:
+                get_relative_rect_pos(position, collider)
+                if PhysicsSystem._circle_overlaps_rect(x, y, radius, collider.box):
+                    result.append(e)
+
+        return result
+
+    # Distance along the ray (x, y) + t * (dx, dy) where it enters the rect, or None if it misses.
+    # The direction is a unit vector. A ray that starts inside the rect hits it at 0.
+    @staticmethod
+    def _ray_to_rect(x, y, dx, dy, rect):
+
+        t_min = 0.0
+        t_max = float("inf")
+
+        for origin, direction, low, high in ((x, dx, rect.left, rect.right), (y, dy, rect.top, rect.bottom)):
+
+            # parallel to the sides, so it must be between them
+            if direction == 0:
+                if origin < low or origin > high:
+                    return None
+                continue
+
+            t_low = (low - origin) / direction
+            t_high = (high - origin) / direction
+            if t_low > t_high:
+                t_low, t_high = t_high, t_low
+
+            t_min = max(t_min, t_low)
+            t_max = min(t_max, t_high)
+
+            if t_min > t_max:
+                return None
+
+        return t_min
+
+    # Distance along the ray where it enters the circle, or None if it misses
+    @staticmethod
+    def _ray_to_circle(x, y, dx, dy, cx, cy, radius):
+
+        # solve |(x, y) + t * (dx, dy) - (cx, cy)| = radius for t
+        ox = x - cx
+        oy = y - cy
+
+        b = ox * dx + oy * dy
+        c = ox * ox + oy * oy - radius * radius
+
+        # starts inside the circle
+        if c <= 0:
+            return 0.0
+
+        discriminant = b * b - c
+        if discriminant < 0 or b > 0:
+            return None
+
+        return -b - sqrt(discriminant)
+
+    # Find the closest entity hit by a ray that starts at the origin and goes max_distance pixels
+    # in the direction. Returns (entity, distance) or None if nothing was hit. Triggers are hit too,
+    # so use the tag or the layers to ignore them.
+    def raycast(self, origin, direction, max_distance, tag=None, layers=Collider.all_layers):
+
+        length = direction.magnitude()
+        if length == 0:
+            return None
 
-    # holds the collisions of the past frame
-    #past_collisions = list()
+        x = float(origin.x)
+        y = float(origin.y)
+        dx = direction.x / length
+        dy = direction.y / length
 
-    def __init__(self):
-        super(PhysicsSystem, self).__init__()
+        # A long ray is split in segments so that only the colliders near the start of the ray are
+        # tested if it hits something early. Without a broadphase there is one segment.
+        if self.broadphase is None:
+            segment_length = max_distance
+        else:
+            segment_length = self.raycast_segment_length
 
-        self.gravity = Vector2(0.0, 500.0)
-        self.terminal_speed = 800
+        closest = None
+        closest_distance = max_distance
 
-    def process(self, entities):
-        # save the collisions of the past frame
-        #PhysicsSystem.past_collisions = PhysicsSystem.collision_queue[:]
+        start = 0.0
+        tested = set()
 
-        # empty the collision queue
-        del PhysicsSystem.collision_queue[:]
+        while start <= max_distance:
 
-        for eA in entities:
+            end = min(start + segment_length, max_distance)
 
-            # ignore disabled entities
-            if eA.disabled:
-                continue
+            x0 = x + dx * start
+            y0 = y + dy * start
+            x1 = x + dx * end
+            y1 = y + dy * end
 
-            transform_a = eA.transform
-            collider_a = eA.collider
-            rigid_body_a = eA.rigid_body
+            for e in self._get_query_candidates((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))):
 
-            valid_collider = collider_a is not None
+                # colliders that reach over several segments are only tested once
+                if e.uuid in tested or not PhysicsSystem._query_accepts(e, tag, layers):
+                    continue
+                tested.add(e.uuid)
 
-            # if there is a collider attached to the entity, then make sure that the
-            # entity also has a rigid body to modify or if the collider should trigger a collision event.
-            consider_entity = False
-            if valid_collider:
-                consider_entity = rigid_body_a is not None or collider_a.treat_as_dynamic
+                collider = e.collider
+                position = e.transform.position
 
-            if valid_collider and consider_entity:
+                if collider.tag == CircleCollider.tag:
+                    distance = PhysicsSystem._ray_to_circle(x, y, dx, dy, position.x, position.y, collider.radius)
+                else:
+                    get_relative_rect_pos(position, collider)
+                    distance = PhysicsSystem._ray_to_rect(x, y, dx, dy, collider.box)
 
-                # Move the rigid body
-                if rigid_body_a is not None:
-                    self._integrate_motion(transform_a, rigid_body_a)
+                if distance is not None and distance <= max_distance and (closest is None or distance < closest_distance):
+                    closest = e
+                    closest_distance = distance
 
-                # Find another entity that it may collide with
-                for eB in entities:
+            # A hit past the end of this segment may still be behind a collider of the next segments
+            if closest is not None and closest_distance <= end:
+                return closest, closest_distance
 
-                    if eB.disabled:
-                        continue
+            if end >= max_distance:
+                break
 
-                    transform_b = eB.transform
-                    collider_b = eB.collider
+            start = end
 
-                    # Check that coll_comp_b is valid and that coll_comp_a is not colliding with itself
-                    if collider_b is not None and eA is not eB:
-
-                        collision_occurred = False
-
-                        # A flag to tell the physics systems not to apply physics or collision
-                        # resolution on the entity if this collider collides with another collider.
-                        b_isnt_trigger = not collider_b.is_trigger
-
-                        # box to box collision
-                        if collider_a.tag == BoxCollider.tag and collider_b.tag == BoxCollider.tag:
-
-                            # check for collision
-                            if PhysicsSystem.box2box_collision(collider_a, collider_b):
-                                collision_occurred = True
-
-                                if rigid_body_a is not None and b_isnt_trigger:
-                                    PhysicsSystem.box2box_response(collider_a, collider_b)
-
-                        # circle to circle collision
-                        elif collider_a.tag == CircleCollider.tag and collider_b.tag == CircleCollider.tag:
-
-                            # check if circles collided
-                            if PhysicsSystem._circle2circle_collision(collider_a, collider_b):
-                                collision_occurred = True
-
-                                if rigid_body_a is not None and b_isnt_trigger:
-                                    PhysicsSystem.circle2circle_response(collider_a, collider_b)
-
-                        # circle to box
-                        elif collider_a.tag == CircleCollider.tag and collider_b.tag == BoxCollider.tag:
-
-                            # create a temporary box collider associated to A
-                            box_collider_a = BoxCollider(collider_a.radius*2, collider_a.radius*2)
-                            box_collider_a.entity = collider_a.entity
-                            box_collider_a.restitution = collider_a.restitution
-                            box_collider_a.surface_friction = collider_a.surface_friction
-
-                            # Get the relative collision box positions to their transforms.
-                            get_relative_rect_pos(transform_a.position, box_collider_a)
-                            get_relative_rect_pos(transform_b.position, collider_b)
-
-                            # check for collision
-                            if PhysicsSystem._circle2box_collision(collider_a, collider_b):
-                                collision_occurred = True
-
-                                if rigid_body_a is not None and b_isnt_trigger:
-                                    PhysicsSystem.box2box_response(box_collider_a, collider_b)
-
-                        if collision_occurred:
-                            # add collision event into the queue
-                            PhysicsSystem.collision_queue.append((eA, eB))
-
-                            # call the collision inside the scripts
-                            for s in eA.scripts:
-                                s.collision_event(collider_b)
-
-                            for s in eB.scripts:
-                                s.collision_event(collider_a)
-
-        # trigger the collision exit event
-        # An exit event means  that the an object is no longer colliding with another.
-        # We can test this by checking the past collisions and seeing if they are NOT
-        # in the current collision event queue.
-        # for past_collision in PhysicsSystem.past_collisions:
-        #     trigger_exit = True
-        #
-        #     for current_collision in PhysicsSystem.collision_queue:
-        #
-        #         # If the collisions are the same then don't trigger collision exit event
-        #         if past_collision == current_collision:
-        #             trigger_exit = False
-        #             break
-        #
-        #     # The inner for loop failed which means that there was a collision exit event
-        #     if trigger_exit and self.world.engine.delta_time > 0.011:
-        #
-        #         eA = past_collision[0]
-        #         eB = past_collision[1]
-        #
-        #         # call the collision exit inside the scripts
-        #         for s in eA.scripts:
-        #             s.collision_exit_event(eB.collider)
-        #
-        #         for s in eB.scripts:
-        #             s.collision_exit_event(eA.collider)
+        return None
 
     @staticmethod
     def _calc_1d_elastic_collision_velocity(vel_a, mass_a, vel_b, mass_b):
@@ -215,15 +1693,42 @@ class PhysicsSystem (System):
 
         # Collision occurs if the distance from the center of the circle to the closest point on the box
         # is less than the radius of the circle.
-
-        distance_to_closest = Vector2(x_closest, y_closest)
-
-        distance_to_closest -= collider_a.entity.transform.position
+        dx = x_closest - position_a.x
+        dy = y_closest - position_a.y
 
         # square radius
         r_sq = collider_a.radius * collider_a.radius
 
-        return distance_to_closest.sq_magnitude() < r_sq
+        return dx * dx + dy * dy < r_sq
+
+    # Get the square box collider that stands in for a circle collider in the box collision response.
+    # The box is kept on the circle collider and only moved when the circle moved since its last use.
+    @staticmethod
+    def _get_circle_proxy(collider):
+
+        proxy = collider.proxy
+        position = collider.entity.transform.position
+        proxy_position = collider.proxy_position
+
+        # create the box or resize it if the circle was scaled
+        if proxy is None or collider.proxy_radius != collider.radius:
+            proxy = BoxCollider(collider.radius * 2, collider.radius * 2)
+            collider.proxy = proxy
+            collider.proxy_radius = collider.radius
+            moved = True
+        else:
+            moved = position.x != proxy_position.x or position.y != proxy_position.y
+
+        proxy.entity = collider.entity
+        proxy.restitution = collider.restitution
+        proxy.surface_friction = collider.surface_friction
+
+        if moved:
+            get_relative_rect_pos(position, proxy)
+            proxy_position.x = position.x
+            proxy_position.y = position.y
+
+        return proxy
 
     @staticmethod
     def _circle2circle_collision(collider_a, collider_b):
@@ -364,24 +1869,25 @@ class PhysicsSystem (System):
     @staticmethod
     def tolerance_collision(collider_a, collider_b):
 
-        result = False
+        rect_a = PhysicsSystem._place_tolerance_box(collider_a, PhysicsSystem._tolerance_rect_a)
+        rect_b = PhysicsSystem._place_tolerance_box(collider_b, PhysicsSystem._tolerance_rect_b)
 
-        temp_box_a = collider_a.box
-        temp_box_b = collider_b.box
+        return rect_a.colliderect(rect_b)
 
-        # use the tolerance hit boxes to detect collision
-        collider_a.box = collider_a.tolerance_hitbox
-        collider_b.box = collider_b.tolerance_hitbox
+    # Place the tolerance hit box of a collider at its transform position, the same way as
+    # get_relative_rect_pos places the collision box. The given rect is moved instead of the
+    # hit box so the collider is left untouched.
+    @staticmethod
+    def _place_tolerance_box(collider, rect):
 
-        # use the tolerance hit boxes to detect collision
-        if PhysicsSystem.box2box_collision(collider_a, collider_b):
-            result = True
+        hitbox = collider.tolerance_hitbox
+        position = collider.entity.transform.position
 
-        # # reset the collider boxes to the original ones
-        collider_a.box = temp_box_a
-        collider_b.box = temp_box_b
+        rect.size = hitbox.size
+        rect.x = position.x - hitbox.width/2 + collider.offset.x
+        rect.y = position.y - hitbox.height/2 + collider.offset.y
 
-        return result
+        return rect
 
     # determine which side of the box_b did box_a hit
     @staticmethod
@@ -434,7 +1940,7 @@ class PhysicsSystem (System):
     # Basically, they are treated as particles
     # This should be called if there was a detected collision
     @staticmethod
-    def box2box_response(collider_a, collider_b):
+    def box2box_response(collider_a, collider_b, orientation=None):
 
         rigid_a = collider_a.entity.rigid_body
         rigid_b = collider_b.entity.rigid_body
@@ -444,7 +1950,8 @@ class PhysicsSystem (System):
         transform_b = collider_b.entity.transform
 
         x_change = y_change = 1
-        orientation = PhysicsSystem.calc_box_hit_orientation(collider_a, collider_b)
+        if orientation is None:
+            orientation = PhysicsSystem.calc_box_hit_orientation(collider_a, collider_b)
         if orientation == PhysicsSystem.top or orientation == PhysicsSystem.bottom:
             y_change = -1
 
@@ -586,16 +2093,137 @@ class PhysicsSystem (System):
             transform_a.position.x -= delta
 
     def _integrate_motion(self, transform, rigid_body):
+
+        profile = self._profile
+        if profile is not None:
+            start = clock()
+
         # time step
-        dt = self.world.engine.delta_time
+        dt = self.fixed_time_step
+
+        rigid_body.previous_position = Vector2(transform.position.x, transform.position.y)
 
-        transform.position += dt * rigid_body.velocity
+        motion = dt * rigid_body.velocity
+
+        # stop fast bodies at the first static collider in their way instead of passing through it
+        if rigid_body.continuous:
+            motion *= self._sweep_static(transform.entity, motion)
+
+        transform.position += motion
 
         # apply gravity
         # limit acceleration due to terminal velocity
         if rigid_body.velocity.sq_magnitude() < self.terminal_speed * self.terminal_speed:
             rigid_body.velocity += dt * rigid_body.gravity_scale * self.gravity
 
+        if profile is not None:
+            profile.integration_time += clock() - start
+
+    # Time of impact of box a moving by (mx, my) against the static box b, both given as
+    # (left, top, right, bottom). Returns (time, axis distance) where time is the fraction of the
+    # motion done when they first touch, or None if they don't touch or already overlap.
+    @staticmethod
+    def _sweep_box(a, mx, my, b):
+
+        entry = list()
+        leave = list()
+
+        for move, a_low, a_high, b_low, b_high in ((mx, a[0], a[2], b[0], b[2]), (my, a[1], a[3], b[1], b[3])):
+
+            # not moving along this axis, so the boxes must already overlap on it
+            if move == 0:
+                if a_high <= b_low or a_low >= b_high:
+                    return None
+                entry.append((float("-inf"), move))
+                leave.append(float("inf"))
+
+            elif move > 0:
+                entry.append(((b_low - a_high) / move, move))
+                leave.append((b_high - a_low) / move)
+
+            else:
+                entry.append(((b_high - a_low) / move, move))
+                leave.append((b_low - a_high) / move)
+
+        time, move = max(entry)
+
+        if time < 0 or time > 1 or time >= min(leave):
+            return None
+
+        return time, abs(move)
+
+    # Sweep the collision box of an entity along its motion against the static colliders and get
+    # the fraction of the motion that it can do. The box is stopped continuous_skin pixels inside
+    # the first collider it touches so that the collision response resolves the contact as usual.
+    def _sweep_static(self, entity, motion):
+
+        collider = entity.collider
+        if collider is None or collider.tag != BoxCollider.tag or collider.is_trigger or motion.is_zero():
+            return 1.0
+
+        position = entity.transform.position
+        half_w = collider.box.width / 2.0
+        half_h = collider.box.height / 2.0
+        x = position.x + collider.offset.x
+        y = position.y + collider.offset.y
+
+        start = (x - half_w, y - half_h, x + half_w, y + half_h)
+        swept = (min(start[0], start[0] + motion.x), min(start[1], start[1] + motion.y),
+                 max(start[2], start[2] + motion.x), max(start[3], start[3] + motion.y))
+
+        # The static tree is only kept up to date while there is a broadphase
+        if self.broadphase is not None:
+            others = [self._static_entities[key] for key in self.static_tree.query(swept)]
+        else:
+            others = [e for e in self.world.entity_manager.entities if PhysicsSystem._is_static(e)]
+
+        fraction = 1.0
+
+        for other in others:
+
+            other_collider = other.collider
+
+            if other.disabled or other_collider.tag != BoxCollider.tag or other_collider.is_trigger:
+                continue
+
+            if not self._layers_collide(collider, other_collider):
+                continue
+
+            get_relative_rect_pos(other.transform.position, other_collider)
+            box = other_collider.box
+
+            impact = PhysicsSystem._sweep_box(start, motion.x, motion.y, (box.left, box.top, box.right, box.bottom))
+            if impact is not None:
+                time, speed = impact
+                fraction = min(fraction, time + self.continuous_skin / speed)
+
+        return fraction
+
+    # Get the position to draw an entity at. Rigid bodies are drawn between their last two
+    # physics states so their motion stays smooth when the frame rate differs from the step.
+    def get_render_position(self, entity):
+
+        position = entity.transform.position
+        rigid_body = entity.rigid_body
+
+        if rigid_body is None or rigid_body.step_position is None:
+            return position
+
+        current = rigid_body.step_position
+
+        # a script moved the body since the last step
+        if position.x != current.x or position.y != current.y:
+            return position
+
+        previous = rigid_body.previous_position
+        alpha = self.interpolation_alpha
+
+        return Vector2(previous.x + (current.x - previous.x) * alpha, previous.y + (current.y - previous.y) * alpha)
+
+
+# Surface.blits was added in pygame 1.9.4
+_has_blits = hasattr(pygame.Surface, "blits")
+
 
 # Requires for an entity to have a render and transform component
 # Holds the surface to render images
@@ -603,6 +2231,21 @@ class RenderSystem (System):
 
     tag = "render system"
 
+    # size in pixels of the cells of the spatial hashes that the renderers are culled with
+    culling_cell_size = 256
+
+    # Draw each layer with a single Surface.blits call and keep its draw list while nothing in it
+    # changes. Otherwise every sprite is drawn with its own blit call.
+    batch_blits = True
+
+    # Bake the runs of sprites that never move on their own onto chunk surfaces when the scene is
+    # constructed, with the size in pixels of the square chunks and the most pixels that the chunks
+    # of the scene can take up. Small chunks are faster to draw when the camera only sees part of
+    # them, which is most of the time.
+    bake_static_layers = True
+    static_chunk_size = 128
+    static_chunk_budget = 2048 * 2048
+
     def __init__(self):
         super(RenderSystem, self).__init__()
 
@@ -623,10 +2266,62 @@ class RenderSystem (System):
         self.blit_buffer = None
         self.light_sources = list()
 
+        # where the lights are blended together before they are applied to the scene
+        self._light_buffer = None
+
         # This tells the render system to fill the screen black and set up lighting effects
         # in a dark environment.
         self.simulate_dark_env = False
 
+        # depth -> spatial hash of the renderers in that layer that are drawn relative to the
+        # camera. Only the ones in the cells seen by the camera are visited when drawing.
+        self._layer_hashes = dict()
+
+        # depth -> renderers in that layer that are not affected by the camera
+        self._screen_renderers = dict()
+
+        # uuid -> (renderer, depth) of the renderers in the layer structures
+        self._indexed = dict()
+
+        # uuid -> renderer of the renderers that can move every frame (rigid bodies, scripts,
+        # animators). Their location in the spatial hash is updated before drawing.
+        self._mobile = dict()
+
+        # Renderers added to the scene since the last frame. They are indexed when the next
+        # frame is drawn, once their entity has been placed.
+        self._pending = list()
+
+        # uuid -> order in which the renderer was added to its layer, which is its draw order
+        self._draw_order = dict()
+        self._next_order = 0
+
+        # depth -> (version, camera view, renderers, their states, [(sprite, destination)]) of the
+        # last frame. The version of a layer changes whenever its renderers are added, removed or moved.
+        self._draw_lists = dict()
+        self._layer_versions = dict()
+
+        # depth -> runs of baked renderers in that layer, and uuid -> run of the baked renderers.
+        # The runs are made on the first frame after the scene is constructed.
+        self._static_runs = dict()
+        self._baked = dict()
+        self._bake_pending = False
+
+        # Set to find the regions of the screen that change every frame, so the engine only has
+        # to update those regions of the display. Meant for scenes with a still camera, since
+        # the whole display changes when the camera moves. Sprite surfaces that are drawn on
+        # instead of being replaced are not noticed.
+        self.dirty_rect_mode = False
+
+        # Regions of the screen that changed during the last frame, or None if the whole
+        # screen has to be updated.
+        self.dirty_rects = None
+
+        # depth -> draw list shown during the last frame, with the camera view and the lights
+        # that were shown. None when the changes are not being tracked.
+        self._shown_lists = None
+        self._shown_view = None
+        self._shown_lights = None
+
     # for utility to create a solid image surface of some color
     @staticmethod
     def create_solid_image(width, height, color):
@@ -641,6 +2336,8 @@ class RenderSystem (System):
 
         # clear the entire layer dictionary
         self.scene.clear()
+        self._clear_index()
+        self._bake_pending = True
 
         for e in entities:
             renderer = e.renderer
@@ -656,6 +2353,7 @@ class RenderSystem (System):
 
                 # add a renderer to that layer
                 self.scene[depth].append(renderer)
+                self._add_pending(renderer)
 
         # create the layer order
         for key in self.scene:
@@ -674,6 +2372,8 @@ class RenderSystem (System):
         if renderer is not None:
             depth = renderer.depth
 
+            self._add_pending(renderer)
+
             # layer already exists
             if depth in self.scene:
                 self.scene[depth].append(renderer)
@@ -707,6 +2407,7 @@ class RenderSystem (System):
             # check that it exists in the scene
             if old_depth in self.scene:
                 renderer_list = self.scene[old_depth]
+                self._remove_from_index(renderer)
 
                 # find the renderer's entity
                 i = 0
@@ -730,6 +2431,8 @@ class RenderSystem (System):
 
             depth = renderer.depth
 
+            self._remove_from_index(renderer)
+
             # check that it exists in the scene
             if depth in self.scene:
                 renderer_list = self.scene[depth]
@@ -744,96 +2447,482 @@ class RenderSystem (System):
 
                     i += 1
 
-    def render_scene(self):
+    # Update the location of an entity's sprite for culling. Use this after moving an entity
+    # that has no rigid body, scripts or animator, since those are the only ones tracked every frame.
+    def refresh_in_scene(self, entity):
+        renderer = entity.renderer
+        if renderer is None:
+            return
 
-        # paint the screen black to setup the dark environment
-        if self.simulate_dark_env:
-            self.world.engine.display.fill((0, 0, 0))
+        entry = self._indexed.get(entity.uuid)
+        if entry is None or entry[0] is not renderer:
+            return
+
+        run = self._baked.get(entity.uuid)
+        if run is not None:
+            if run.refresh(renderer):
+                self._touch_layer(entry[1])
+
+        elif entry[1] in self._layer_hashes:
+            physics = self.world.get_system(PhysicsSystem.tag)
+            if self._layer_hashes[entry[1]].update(entity.uuid, RenderSystem._get_sprite_aabb(renderer, physics)):
+                self._touch_layer(entry[1])
+
+    def _clear_index(self):
+        self._layer_hashes.clear()
+        self._screen_renderers.clear()
+        self._indexed.clear()
+        self._mobile.clear()
+        del self._pending[:]
+        self._draw_order.clear()
+        self._draw_lists.clear()
+        self._static_runs.clear()
+        self._baked.clear()
+
+    def _add_pending(self, renderer):
+        self._draw_order[renderer.entity.uuid] = self._next_order
+        self._next_order += 1
+        self._pending.append(renderer)
+
+    def _remove_from_index(self, renderer):
+
+        key = renderer.entity.uuid
+
+        self._pending = [r for r in self._pending if r is not renderer]
+
+        entry = self._indexed.get(key)
+        if entry is None or entry[0] is not renderer:
+            return
+
+        del self._indexed[key]
+        self._mobile.pop(key, None)
+
+        depth = entry[1]
+        self._touch_layer(depth)
+
+        run = self._baked.pop(key, None)
+        if run is not None:
+            run.remove(renderer)
+        elif depth in self._layer_hashes:
+            self._layer_hashes[depth].remove(key)
+
+        screen_renderers = self._screen_renderers.get(depth)
+        if screen_renderers is not None and renderer in screen_renderers:
+            screen_renderers.remove(renderer)
+
+    # Put the renderers that were added since the last frame into the structure of their layer
+    def _index_pending(self, physics):
+
+        for renderer in self._pending:
+
+            entity = renderer.entity
+            key = entity.uuid
+            depth = renderer.depth
+
+            self._indexed[key] = (renderer, depth)
+            self._touch_layer(depth)
+
+            if renderer.is_static:
+                self._screen_renderers.setdefault(depth, list()).append(renderer)
+                continue
+
+            layer_hash = self._layer_hashes.get(depth)
+            if layer_hash is None:
+                layer_hash = SpatialHash(self.culling_cell_size)
+                self._layer_hashes[depth] = layer_hash
+
+            layer_hash.update(key, RenderSystem._get_sprite_aabb(renderer, physics))
+
+            if entity.rigid_body is not None or entity.scripts or entity.animator is not None:
+                self._mobile[key] = renderer
+
+        del self._pending[:]
+
+        if self._bake_pending:
+            self._bake_pending = False
+            if self.bake_static_layers:
+                self._bake_static_runs()
+
+    # Move the runs of renderers that can be baked from the spatial hashes to chunk surfaces.
+    # The renderers between two that can't be baked make a group of runs, so that the order of the
+    # layer is kept. A renderer joins the run of its group whose sprites are as far between pixels,
+    # so sprites placed differently don't break the runs of the sprites around them. It starts a new
+    # group if it overlaps a sprite of another run of the group, since the runs of a group are drawn
+    # one after the other.
+    def _bake_static_runs(self):
+
+        lights = set([light_source.uuid for light_source in self.light_sources])
+        size = self.static_chunk_size
+        area = 0
 
-        # Iterate through each layer in the scene in order
         for layer in self.ordered_layers:
 
+            layer_hash = self._layer_hashes.get(layer)
+            if layer_hash is None:
+                continue
+
+            runs = list()
+            group = list()
+
             for renderer in self.scene[layer]:
 
-                # access the transform
                 entity = renderer.entity
-                if entity.disabled:
+                key = entity.uuid
+
+                if renderer.is_static or key in self._mobile or key in lights or entity.transform is None or \
+                        not StaticRun.can_bake(renderer, size):
+                    group = list()
                     continue
 
-                transform = entity.transform
+                run = None
+                for other in group:
+                    if other.can_add(renderer):
+                        run = other
+                    elif other.overlaps(renderer):
+                        group = list()
+                        run = None
+                        break
 
-                # transform exists
-                if transform is not None:
+                if run is None:
+                    run = StaticRun(self._draw_order[key], size, self.culling_cell_size)
+                    runs.append(run)
+                    group.append(run)
 
-                    # Center it around the image pivot
-                    position = transform.position - renderer.pivot
+                run.add(renderer, self._draw_order[key])
+
+            for run in runs:
+
+                # a single sprite is drawn as fast on its own
+                if len(run) < 2:
+                    continue
+
+                run_area = run.get_area()
+                if area + run_area > self.static_chunk_budget:
+                    continue
 
-                    # Offset image position with the camera if the renderer is not static
-                    if self.camera is not None and not renderer.is_static:
+                area += run_area
 
-                        position -= self.camera.transform.position
+                for renderer in run.get_renderers():
+                    key = renderer.entity.uuid
+                    layer_hash.remove(key)
+                    self._baked[key] = run
 
-                        render_rect = renderer.sprite.get_rect().copy()
+                self._static_runs.setdefault(layer, list()).append(run)
+                self._touch_layer(layer)
 
-                        # center the rect around its transform
-                        render_rect.topleft = (position.x, position.y)
+    # the box (left, top, right, bottom) where the sprite is drawn in the world
+    @staticmethod
+    def _get_sprite_aabb(renderer, physics):
 
-                        # obtain camera data, topleft corner coordinates, width, and height
-                        cx = self.camera.transform.position.x
-                        cy = self.camera.transform.position.y
+        if physics is not None:
+            position = physics.get_render_position(renderer.entity)
+        else:
+            position = renderer.entity.transform.position
 
-                        # FIX, have width and height be a permanent location for the engine
-                        # such as having it as variables for the camera object.
-                        cw = self.camera.get_script("camera follow").width
-                        ch = self.camera.get_script("camera follow").height
+        x = position.x - renderer.pivot.x
+        y = position.y - renderer.pivot.y
 
-                        camera_rect = Rect(cx, cy, cw, ch)
+        return x, y, x + renderer.sprite.get_width(), y + renderer.sprite.get_height()
 
-                        # adjust with camera movement
-                        render_rect.x += cx
-                        render_rect.y += cy
+    # Get the renderers of a layer that may be seen by the camera, in their draw order
+    def _get_visible(self, layer, camera_aabb):
 
-                        # if the sprite rect is colliding with the camera's rect
-                        # then blit
-                        if camera_rect.colliderect(render_rect):
-                            # render to the buffer first if we want to simulate a dark environment
-                            if self.simulate_dark_env:
-                                self.blit_buffer.blit(renderer.sprite, (position.x, position.y))
+        visible = list(self._screen_renderers.get(layer, ()))
 
-                            # render to the screen
-                            else:
-                                display = self.world.engine.display
-                                display.blit(renderer.sprite, (position.x, position.y))
+        layer_hash = self._layer_hashes.get(layer)
+        if layer_hash is not None:
+            indexed = self._indexed
+            visible.extend([indexed[key][0] for key in layer_hash.query(camera_aabb)])
 
-                    # if there is no camera just blit directly to the buffer
-                    else:
-                        # render to the buffer first if we want to simulate a dark environment
-                        if self.simulate_dark_env:
-                            self.blit_buffer.blit(renderer.sprite, (position.x, position.y))
+            if len(visible) > 1:
+                order = self._draw_order
+                visible.sort(key=lambda renderer: order[renderer.entity.uuid])
+
+        return visible
+
+    # Get the top left corner, width and height of the camera view in the world
+    def _get_camera_view(self):
+
+        x = self.camera.transform.position.x
+        y = self.camera.transform.position.y
+
+        # FIX, have width and height be a permanent location for the engine
+        # such as having it as variables for the camera object.
+        follow = self.camera.get_script("camera follow")
+        if follow is not None:
+            return x, y, follow.width, follow.height
+
+        width, height = self.world.engine.display.get_size()
+        return x, y, width, height
+
+    # Get the baked chunks of a layer that may be seen by the camera as (draw order, run, chunk).
+    # The chunks whose renderers changed are baked again first.
+    def _get_visible_chunks(self, layer, view):
+
+        runs = self._static_runs.get(layer)
+        if not runs:
+            return []
+
+        if view is None:
+            aabb = None
+        else:
+            cx, cy, cw, ch = view
+            aabb = (cx, cy, cx + cw, cy + ch)
+
+        visible = list()
+        for run in runs:
+
+            chunks, changed = run.get_visible(aabb)
+            if changed:
+                self._touch_layer(layer)
+
+            visible.extend([(run.order, run, chunk) for chunk in chunks])
+
+        return visible
+
+    # Get the (sprite, destination) pairs to draw for a layer. The pairs of the last frame are
+    # reused if the camera did not move and nothing in the layer moved or changed its sprite.
+    def _get_draw_list(self, layer, physics, view):
+
+        chunks = self._get_visible_chunks(layer, view)
+
+        version = self._layer_versions.get(layer, 0)
+
+        cached = self._draw_lists.get(layer)
+        if cached is not None and self.batch_blits and cached[0] == version and cached[1] == view:
+            renderers, states, draw_list = cached[2:]
+            if states is not None and RenderSystem._get_draw_states(renderers) == states:
+                return draw_list
+
+        if view is None:
+            baked = self._baked
+            renderers = [r for r in self.scene[layer] if r.entity.uuid not in baked]
+        else:
+            cx, cy, cw, ch = view
+            renderers = self._get_visible(layer, (cx, cy, cx + cw, cy + ch))
+
+        draw_list = list()
 
-                        # render to the screen
-                        else:
-                            display = self.world.engine.display
-                            display.blit(renderer.sprite, (position.x, position.y))
+        # the chunks are drawn in the place of their run in the layer
+        order = self._draw_order
+        c = 0
 
+        for renderer in renderers:
+
+            # access the transform
+            entity = renderer.entity
+
+            while c < len(chunks) and chunks[c][0] < order[entity.uuid]:
+                draw_list.append(RenderSystem._get_chunk_entry(chunks[c][1], chunks[c][2], view))
+                c += 1
+
+            if entity.disabled:
+                continue
+
+            transform = entity.transform
+
+            # transform exists
+            if transform is not None:
+
+                # Center it around the image pivot
+                if physics is not None:
+                    position = physics.get_render_position(entity) - renderer.pivot
+                else:
+                    position = transform.position - renderer.pivot
+
+                # Offset image position with the camera if the renderer is not static
+                if view is not None and not renderer.is_static:
+
+                    # only draw the sprites that overlap the camera view
+                    if position.x >= cx + cw or position.y >= cy + ch or \
+                            position.x + renderer.sprite.get_width() <= cx or \
+                            position.y + renderer.sprite.get_height() <= cy:
+                        continue
+
+                    draw_list.append(RenderSystem._get_sprite_entry(renderer.sprite, position.x - cx, position.y - cy))
+
+                # if there is no camera just draw directly to the buffer
                 else:
-                    print("Renderer has no transform associated.")
+                    draw_list.append(RenderSystem._get_sprite_entry(renderer.sprite, position.x, position.y))
 
-        # to simulate light sources in dark environments
+            else:
+                print("Renderer has no transform associated.")
+
+        for run_order, run, chunk in chunks[c:]:
+            draw_list.append(RenderSystem._get_chunk_entry(run, chunk, view))
+
+        # The states are only kept once the camera stops, since the list can't be reused while it moves
+        states = None
+        if self.batch_blits and cached is not None and cached[1] == view:
+            states = RenderSystem._get_draw_states(renderers)
+
+        self._draw_lists[layer] = (version, view, renderers, states, draw_list)
+
+        return draw_list
+
+    # Get the (sprite, destination) or (sprite, destination, area) to draw a sprite at. Blit
+    # truncates negative destinations toward zero, which would draw a sprite that sticks out of the
+    # left or top of the view between pixels a pixel further than the sprites around it. The part
+    # of the sprite outside is clipped off with the area instead.
+    @staticmethod
+    def _get_sprite_entry(sprite, x, y):
+
+        if x >= 0 and y >= 0:
+            return sprite, (x, y)
+
+        left = top = 0
+
+        if x < 0:
+            left = -int(floor(x))
+            x = 0
+
+        if y < 0:
+            top = -int(floor(y))
+            y = 0
+
+        return sprite, (x, y), (left, top, sprite.get_width() - left, sprite.get_height() - top)
+
+    # The chunk is placed as far between pixels as the sprites of its run, so they are drawn on
+    # the same pixels as on their own.
+    @staticmethod
+    def _get_chunk_entry(run, chunk, view):
+
+        x = chunk.rect.x + run.fraction[0]
+        y = chunk.rect.y + run.fraction[1]
+
+        if view is None:
+            return chunk.surface, (x, y)
+
+        return chunk.surface, (int(floor(x - view[0])), int(floor(y - view[1])))
+
+    # what a draw list depends on besides the location of the mobile sprites
+    @staticmethod
+    def _get_draw_states(renderers):
+        states = list()
+        for renderer in renderers:
+            entity = renderer.entity
+            transform = entity.transform
+            if transform is None:
+                states.append((renderer.sprite, entity.disabled))
+            else:
+                states.append((renderer.sprite, entity.disabled, transform.position.x, transform.position.y))
+        return states
+
+    # Get the regions of the screen that changed between two draw lists: where the sprites that
+    # were removed or moved used to be and where the new or moved sprites are now.
+    @staticmethod
+    def get_changed_rects(old, new):
+
+        if old is new:
+            return []
+
+        if old is None:
+            old = []
+
+        old_keys = [(id(entry[0]),) + entry[1:] for entry in old]
+        new_keys = [(id(entry[0]),) + entry[1:] for entry in new]
+
+        if old_keys == new_keys:
+            return []
+
+        old_set = set(old_keys)
+        new_set = set(new_keys)
+
+        changed = [old[i] for i in range(len(old)) if old_keys[i] not in new_set]
+        changed.extend([new[i] for i in range(len(new)) if new_keys[i] not in old_set])
+
+        # the same sprites are drawn in a different order
+        if not changed:
+            changed = new
+
+        # a pixel of margin since the destinations are truncated when blitting
+        rects = list()
+        for entry in changed:
+            x, y = entry[1]
+            width, height = entry[2][2:] if len(entry) > 2 else entry[0].get_size()
+            rects.append(Rect(int(floor(x)) - 1, int(floor(y)) - 1, width + 2, height + 2))
+
+        return rects
+
+    # the layer changed, so its draw list has to be built again
+    def _touch_layer(self, depth):
+        self._layer_versions[depth] = self._layer_versions.get(depth, 0) + 1
+
+    def render_scene(self):
+
+        # paint the screen black to setup the dark environment
+        if self.simulate_dark_env:
+            self.world.engine.display.fill((0, 0, 0))
+
+        # render to the buffer first if we want to simulate a dark environment
         if self.simulate_dark_env:
+            target = self.blit_buffer
+        else:
+            target = self.world.engine.display
 
-            for light_source in self.light_sources:
+        physics = self.world.get_system(PhysicsSystem.tag)
+
+        if self._pending:
+            self._index_pending(physics)
+
+        # move the sprites that can move on their own and the lights that follow them
+        for key, renderer in self._mobile.items():
+            depth = self._indexed[key][1]
+            if self._layer_hashes[depth].update(key, RenderSystem._get_sprite_aabb(renderer, physics)):
+                self._touch_layer(depth)
+
+        for light_source in self.light_sources:
+            self.refresh_in_scene(light_source)
+
+        camera = self.camera
+        if camera is not None:
+
+            # the camera view is the same for every renderer
+            cx, cy, cw, ch = self._get_camera_view()
+            view = (cx, cy, cw, ch)
+
+        else:
+            view = None
+
+        # The whole display changes when the view scrolls or the changes were not tracked
+        # during the last frame.
+        dirty = None
+        if self.dirty_rect_mode:
+            if self._shown_lists is not None and view == self._shown_view:
+                dirty = list()
+            else:
+                self._shown_lists = dict()
+            self._shown_view = view
 
-                # obtain camera data, topleft corner coordinates, width, and height
-                cx = self.camera.transform.position.x
-                cy = self.camera.transform.position.y
+        else:
+            self._shown_lists = None
+
+        # Iterate through each layer in the scene in order
+        for layer in self.ordered_layers:
+
+            draw_list = self._get_draw_list(layer, physics, view)
+
+            if self.batch_blits and _has_blits:
+                target.blits(draw_list, False)
+
+            else:
+                for entry in draw_list:
+                    target.blit(*entry)
 
-                # FIX, have width and height be a permanent location for the engine
-                # such as having it as variables for the camera object.
-                cw = self.camera.get_script("camera follow").width
-                ch = self.camera.get_script("camera follow").height
+            if self._shown_lists is not None:
+                if dirty is not None:
+                    dirty.extend(RenderSystem.get_changed_rects(self._shown_lists.get(layer), draw_list))
+                self._shown_lists[layer] = draw_list
 
-                camera_rect = Rect(cx, cy, cw, ch)
+        # to simulate light sources in dark environments
+        if self.simulate_dark_env:
+
+            camera_rect = Rect(cx, cy, cw, ch)
+
+            # the lights that were drawn, to find the ones that changed
+            shown_lights = list()
+
+            for light_source in self.light_sources:
 
                 x = light_source.transform.position.x
                 y = light_source.transform.position.y
@@ -851,11 +2940,65 @@ class RenderSystem (System):
                 light_rect.x += cx
                 light_rect.y += cy
 
-                # if the camera rect is within the camera then blit buffer onto the light source
+                # if the camera rect is within the camera then light the buffer with the light source
                 if camera_rect.colliderect(light_rect):
-                    tmp = light_source.renderer.sprite.copy()
-                    tmp.blit(self.blit_buffer, (-x, -y), special_flags=pygame.BLEND_RGBA_MIN)
-                    self.world.engine.display.blit(tmp, (x, y))
+                    shown_lights.append((light_source.renderer.sprite, (x, y)))
+
+            self._draw_lights(shown_lights)
+
+            if self._shown_lists is not None:
+                if dirty is not None:
+                    dirty.extend(RenderSystem.get_changed_rects(self._shown_lights, shown_lights))
+                self._shown_lights = shown_lights
+
+        self.dirty_rects = dirty
+
+    # Draw the parts of the scene buffer that are lit by the (sprite, destination) lights onto the
+    # display. The lights are blended together in the light buffer, which then keeps the darkest
+    # of each light and the scene, and the lit area is drawn in one blit.
+    def _draw_lights(self, lights):
+
+        if not lights:
+            return
+
+        # the buffer is kept between frames and only the lit area is cleared
+        light_buffer = self._light_buffer
+        if light_buffer is None or light_buffer.get_size() != self.blit_buffer.get_size():
+            light_buffer = pygame.Surface(self.blit_buffer.get_size(), pygame.SRCALPHA).convert_alpha()
+            self._light_buffer = light_buffer
+
+        # The lit area as boxes that don't overlap, so that every part of it is drawn once.
+        # The destinations are truncated like blit does.
+        areas = list()
+        for sprite, (x, y) in lights:
+
+            area = Rect(int(x), int(y), sprite.get_width(), sprite.get_height())
+
+            i = area.collidelist(areas)
+            while i != -1:
+                area.union_ip(areas.pop(i))
+                i = area.collidelist(areas)
+
+            areas.append(area)
+
+        bounds = light_buffer.get_rect()
+        areas = [area.clip(bounds) for area in areas]
+
+        for area in areas:
+            light_buffer.fill((0, 0, 0, 0), area)
+
+        if _has_blits:
+            light_buffer.blits(lights, False)
+        else:
+            for sprite, destination in lights:
+                light_buffer.blit(sprite, destination)
+
+        display = self.world.engine.display
+
+        for area in areas:
+            # the scene has no alpha, so only the colors are compared, which is much faster
+            light_buffer.blit(self.blit_buffer, area.topleft, area, pygame.BLEND_RGB_MIN)
+            display.blit(light_buffer, area.topleft, area)
 
     def process(self, entities):
         self.render_scene()
@@ -0,0 +1,164 @@
+import os
+import sys
+import unittest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# the game loads its assets relative to its own directory
+game_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, game_directory)
+os.chdir(game_directory)
+
+import pygame
+
+import main_room
+from main_room import PlatformWorld
+from systems import PhysicsSystem
+from util_math import Vector2
+from utility import LAYER_GROUND, LAYER_LADDER, set_box_attributes
+
+
+# Stands in for pygame.key.get_pressed with the keys that the test holds down
+class HeldKeys(object):
+
+    def __init__(self):
+        self.keys = set()
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+    def get_pressed(self):
+        return self
+
+
+class LadderTest (unittest.TestCase):
+
+    def setUp(self):
+
+        self.held_keys = HeldKeys()
+        self.get_pressed = pygame.key.get_pressed
+        pygame.key.get_pressed = self.held_keys.get_pressed
+
+        world = PlatformWorld()
+        world.engine = main_room.engine
+
+        world.loading_scene = True
+
+        world.load_player()
+
+        floor = world.create_box_collider_object(800, 40)
+        floor.transform.position = Vector2(230, 700)
+        floor.collider.category = LAYER_GROUND
+        floor.tag = "floor"
+
+        ladder = world.create_box_collider_object(40, 300)
+        ladder.transform.position = Vector2(230, 530)
+        ladder.collider.is_trigger = True
+        ladder.collider.category = LAYER_LADDER
+        ladder.tag = "ladder"
+
+        world.loading_scene = False
+
+        self.physics = world.get_system(PhysicsSystem.tag)
+        self.physics.build_static_tree(world.entity_manager.entities)
+
+        self.world = world
+        self.player = world.player
+
+    def tearDown(self):
+        pygame.key.get_pressed = self.get_pressed
+
+    # run the physics and the movement scripts of the player for a number of frames
+    def run_frames(self, frames):
+
+        self.world.engine.delta_time = PhysicsSystem.fixed_time_step
+
+        for i in range(frames):
+            self.physics.process(self.world.entity_manager.entities)
+            self.player.get_script("player climb").update()
+            self.player.get_script("player plat move").update()
+
+    def test_idle_player_climbs_ladder(self):
+
+        # stand in front of the ladder for longer than a body takes to fall asleep
+        self.run_frames(PhysicsSystem.sleep_steps * 3)
+
+        self.assertFalse(self.player.rigid_body.sleeping)
+        self.assertTrue(self.player.get_script("player plat move").grounded)
+
+        y = self.player.transform.position.y
+
+        self.held_keys.keys.add(pygame.K_w)
+        self.run_frames(30)
+
+        self.assertTrue(self.player.get_script("player climb").climbing)
+        self.assertLess(self.player.transform.position.y, y - 10)
+
+
+class PackageStackTest (unittest.TestCase):
+
+    def setUp(self):
+
+        world = PlatformWorld()
+        world.engine = main_room.engine
+
+        world.loading_scene = True
+
+        floor = world.create_box_collider_object(800, 40)
+        floor.transform.position = Vector2(230, 700)
+        floor.collider.category = LAYER_GROUND
+        floor.tag = "floor"
+
+        # packages dropped on top of each other with a pixel between them
+        image = world.engine.assets.load_image("assets/images/crates/red_green.png", True)
+        self.packages = list()
+
+        y = floor.transform.position.y - floor.collider.box.height / 2.0
+        for i in range(5):
+            package = world.create_game_object(image)
+            set_box_attributes(package)
+
+            y -= package.collider.box.height / 2.0 + 1
+            package.transform.position = Vector2(230 + 5 * i, y)
+            y -= package.collider.box.height / 2.0
+
+            self.packages.append(package)
+
+        world.loading_scene = False
+
+        self.physics = world.get_system(PhysicsSystem.tag)
+        self.physics.build_static_tree(world.entity_manager.entities)
+
+        self.world = world
+        self.floor = floor
+
+    def test_stack_settles_and_sleeps(self):
+
+        self.world.engine.delta_time = PhysicsSystem.fixed_time_step
+
+        for i in range(PhysicsSystem.sleep_steps * 3):
+            self.physics.process(self.world.entity_manager.entities)
+
+        for package in self.packages:
+            self.assertTrue(package.rigid_body.sleeping)
+
+        # how deep each package sunk into what it rests on
+        below = self.floor
+        for package in self.packages:
+            bottom = package.transform.position.y + package.collider.box.height / 2.0
+            top = below.transform.position.y - below.collider.box.height / 2.0
+            self.assertLess(abs(bottom - top), 0.5)
+            below = package
+
+        positions = [(package.transform.position.x, package.transform.position.y) for package in self.packages]
+
+        for i in range(PhysicsSystem.sleep_steps):
+            self.physics.process(self.world.entity_manager.entities)
+
+        self.assertEqual(positions, [(package.transform.position.x, package.transform.position.y)
+                                     for package in self.packages])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,12 +10,29 @@ from pygame import Surface
 from pygame import image
 from components import RigidBody
 from components import BoxCollider
+from components import Collider
+
+# Collision layers of the game objects
+LAYER_DEFAULT = Collider.default_category
+LAYER_GROUND = 1 << 1
+LAYER_CEILING = 1 << 2
+LAYER_CRATE = 1 << 3
+LAYER_PLAYER = 1 << 4
+LAYER_LIGHT = 1 << 5
+LAYER_LADDER = 1 << 6
+LAYER_LEVER = 1 << 7
+LAYER_BLOCKED = 1 << 8
 
 
 def set_lamp_light_attributes(lamp_light, rs):
     lamp_light.renderer.depth = 10000
     lamp_light.add_component(BoxCollider(50, 50))
     lamp_light.collider.is_trigger = True
+
+    # only the player picks up lamp lights
+    lamp_light.collider.category = LAYER_LIGHT
+    lamp_light.collider.mask = LAYER_PLAYER
+
     lamp_light.tag = "lamp light"
     rs.light_sources.append(lamp_light)
 
@@ -24,18 +41,21 @@ def set_floor_attributes(floor):
     floor.collider.restitution = 0
     floor.collider.surface_friction = 0.75
     floor.renderer.depth = -10
+    floor.collider.category = LAYER_GROUND
     floor.tag = "floor"
 
 
 def set_wall_attributes(wall):
     wall.collider.restitution = 0
     wall.collider.surface_friction = 0.8
+    wall.collider.category = LAYER_GROUND
     wall.tag = "wall"
 
 
 def set_ceiling_attributes(ceiling):
     ceiling.collider.restitution = 0
     ceiling.collider.surface_friction = 0.8
+    ceiling.collider.category = LAYER_CEILING
     ceiling.tag = "ceiling"
 
 
@@ -43,6 +63,7 @@ def set_platform_attributes(platform):
     platform.renderer.depth = 1
     platform.collider.restitution = 0
     platform.collider.surface_friction = 0.75
+    platform.collider.category = LAYER_GROUND
     platform.tag = "platform"
 
 
@@ -56,6 +77,8 @@ def set_box_attributes(box):
     box.add_component(RigidBody())
     box.rigid_body.velocity = Vector2(0.0, 0.0)
     box.rigid_body.gravity_scale = 2.0
+    box.rigid_body.continuous = True
+    box.collider.category = LAYER_CRATE
     box.tag = "box"
 
 
@@ -78,14 +101,19 @@ def get_files_in_dir(dir_path):
 
 # This goes to a directory where each file represents an individual
 # animation frame. This returns an animation object with the loaded frames.
-def load_anim_from_directory(dir_path):
+# The frames are loaded through the asset manager if one is given, which
+# takes them from the texture atlas if they were packed.
+def load_anim_from_directory(dir_path, assets=None):
 
     file_list = get_files_in_dir(dir_path)
 
     # set up animation
     animation = Animator.Animation()
     for file_ in file_list:
-        frame = image.load(file_).convert_alpha()
+        if assets is None:
+            frame = image.load(file_).convert_alpha()
+        else:
+            frame = assets.load_image(file_, True)
         animation.add_frame(frame)
 
     return animation
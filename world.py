@@ -21,9 +21,7 @@ class World (object):
         # for world behavior
         self.scripts = list()
 
-        # add the fundamental systems
-        self.add_system(PhysicsSystem())
-        self.add_system(RenderSystem())
+        self._add_fundamental_systems()
 
         # bounds - negative values means no bounds
         self.width = -1
@@ -32,6 +30,44 @@ class World (object):
 
         self.loading_scene = False
 
+        # The broadphase used by the physics system to find the colliders that may be colliding.
+        # Either SpatialHash.tag or SweepAndPrune.tag. Set the tag to None to test every
+        # collider against every other collider.
+        self.broadphase_tag = SpatialHash.tag
+
+        # layer -> mask of the layers that it can collide with in this world.
+        # Layers that are not in the matrix collide with every layer.
+        self.layer_matrix = dict()
+
+        # Set to BoxBatch.tag to test box colliders against each other in vectorized batches.
+        # Requires NumPy. It only helps when broadphase_tag is None, since the few candidates of a
+        # broadphase are tested faster with rects than by packing them into arrays.
+        # Set to PairPool.tag to test the candidate pairs of large worlds in worker processes,
+        # which requires a broadphase. None tests the colliders pair by pair.
+        self.collision_backend = None
+
+        # Set to ImpulseSolver.tag to resolve the contacts of each physics step with impulses over
+        # islands of touching bodies, except for the bodies without RigidBody.use_contact_solver.
+        # None pushes the colliders apart one pair at a time.
+        self.contact_solver = None
+
+        # size in pixels of the cells of the spatial hash broadphase
+        self.broadphase_cell_size = 128
+
+        # (kind, path) of the assets that are loaded by the engine before the scene, such as the
+        # ones used by the scripts during the game. See AssetManager.
+        self.asset_manifest = list()
+
+        # The scene is loaded by the engine the first time the game goes to the world. Worlds that
+        # can be unloaded may be unloaded by the engine while the game is in other worlds, which
+        # releases the entities, scripts and systems of the scene. The other attributes of the world
+        # are kept, such as whether its puzzle was completed.
+        self.scene_loaded = False
+        self.can_unload = False
+
+        # when the game last went to the world, set by the engine
+        self.last_visit = 0
+
     # this function is a wrapper that is used to detect if we are loading the scene of the world
     def start_scene_loading(self):
         self.loading_scene = True
@@ -41,6 +77,49 @@ class World (object):
 
         self.loading_scene = False
 
+        # the static colliders of the scene are put into a tree once
+        self.get_system(PhysicsSystem.tag).build_static_tree(self.entity_manager.entities)
+
+        self.scene_loaded = True
+
+    # Release the entities, scripts and systems of the scene, so that it can be loaded again.
+    # Worlds that keep entities of the scene in their own attributes, such as lists that load_scene
+    # adds to, override this to reset them.
+    def unload_scene(self):
+
+        # stop the worker processes of the physics system
+        physics_system = self.get_system(PhysicsSystem.tag)
+        if physics_system is not None and physics_system.pair_pool is not None:
+            physics_system.pair_pool.close()
+
+        self.entity_manager = EntityManager()
+        self.scripts = list()
+
+        self.systems = list()
+        self._add_fundamental_systems()
+
+        self.scene_loaded = False
+
+    # Get the bytes of the images drawn by the entities of the world.
+    def get_memory(self):
+
+        # id -> surface, since the entities share images
+        surfaces = dict()
+
+        for e in self.entity_manager.entities:
+
+            renderer = e.renderer
+            if renderer is not None:
+                surfaces[id(renderer.sprite)] = renderer.sprite
+                surfaces[id(renderer.original_image)] = renderer.original_image
+
+            animator = e.animator
+            if animator is not None and animator.current_animation is not None:
+                for frame in animator.current_animation.frames:
+                    surfaces[id(frame)] = frame
+
+        return sum(s.get_width() * s.get_height() * s.get_bytesize() for s in surfaces.values())
+
     @abstractmethod
     def load_scene(self):
         """
@@ -69,6 +148,44 @@ class World (object):
                 return e
         return None
 
+    # Spatial queries. These find the entities by the location of their colliders using the
+    # broadphase of the physics system. Only the entities with the tag (if given) and whose
+    # collider category is in the layers are returned.
+
+    # entities whose colliders overlap a rect
+    def query_aabb(self, rect, tag=None, layers=Collider.all_layers):
+        return self.get_system(PhysicsSystem.tag).query_aabb(rect, tag, layers)
+
+    # entities whose colliders contain a point
+    def query_point(self, point, tag=None, layers=Collider.all_layers):
+        return self.get_system(PhysicsSystem.tag).query_point(point, tag, layers)
+
+    # entities whose colliders overlap a circle
+    def query_circle(self, center, radius, tag=None, layers=Collider.all_layers):
+        return self.get_system(PhysicsSystem.tag).query_circle(center, radius, tag, layers)
+
+    # the closest entity hit by a ray as (entity, distance), or None
+    def raycast(self, origin, direction, max_distance, tag=None, layers=Collider.all_layers):
+        return self.get_system(PhysicsSystem.tag).raycast(origin, direction, max_distance, tag, layers)
+
+    # entities whose tolerance hit boxes overlap the tolerance hit box of the given entity
+    def query_near(self, entity, tag=None, layers=Collider.all_layers):
+        return self.get_system(PhysicsSystem.tag).get_near(entity, tag, layers)
+
+    # entities whose colliders overlap the collider of the given entity
+    def query_collider(self, entity, tag=None, layers=Collider.all_layers):
+
+        collider = entity.collider
+        position = entity.transform.position
+
+        if collider.tag == CircleCollider.tag:
+            result = self.query_circle(position, collider.radius, tag, layers)
+        else:
+            get_relative_rect_pos(position, collider)
+            result = self.query_aabb(collider.box, tag, layers)
+
+        return [e for e in result if e is not entity]
+
     # create an empty entity (no components)
     def create_entity(self):
         e = self.entity_manager.create_entity()
@@ -115,8 +232,24 @@ class World (object):
         render_system = self.get_system(RenderSystem.tag)
         render_system.remove_from_scene(entity)
 
+        # remove the entity's collider from the physics
+        physics_system = self.get_system(PhysicsSystem.tag)
+        if physics_system is not None:
+            physics_system.remove_from_broadphase(entity)
+            physics_system.remove_contacts(entity)
+
+            # stop keeping track of it if it was sleeping
+            physics_system.wake(entity)
+
+            if physics_system.solver is not None:
+                physics_system.solver.remove_entity(entity)
+
         self.entity_manager.remove_entity(entity)
 
+    def _add_fundamental_systems(self):
+        self.add_system(PhysicsSystem())
+        self.add_system(RenderSystem())
+
     def add_system(self, system):
         system.world = self
 
@@ -168,6 +301,26 @@ class World (object):
             s = self.scripts[i]
             s.update()
 
+    # Set if colliders in one layer can collide with colliders in another layer.
+    def set_layer_collision(self, layer_a, layer_b, collide):
+
+        for layer, other in ((layer_a, layer_b), (layer_b, layer_a)):
+            mask = self.layer_matrix.get(layer, Collider.all_layers)
+
+            if collide:
+                mask |= other
+            else:
+                mask &= ~other
+
+            self.layer_matrix[layer] = mask
+
+    # Switch the physics system to the next broadphase. Used to compare their performance
+    # while the game is running.
+    def cycle_broadphase(self):
+        tags = PhysicsSystem.broadphase_tags
+        self.broadphase_tag = tags[(tags.index(self.broadphase_tag) + 1) % len(tags)]
+        print("Broadphase: " + str(self.broadphase_tag))
+
     # determine if the world has bounds
     def is_bounded(self):
         return self.width > 0 and self.height > 0
\ No newline at end of file